@@ -0,0 +1,282 @@
+"""请求参数解析与响应构造
+
+Flask 路由（app.py）和异步模式（asgi.py）共用，保证两种服务模式的参数校验和
+返回格式一致。args 为 request.args 这类 MultiDict。
+"""
+from bulk_import import IMPORT_FORMATS
+from db_pool import PoolTimeout
+from pagination import Paging, decode_cursor
+
+# 各列表接口支持的筛选参数
+PRODUCT_FILTERS = ('material_type', 'status')
+CUSTOMER_FILTERS = ('customer_type', 'status', 'search')
+SUPPLIER_FILTERS = ('rating', 'status', 'search')
+PURCHASE_ORDER_FILTERS = ('status', 'supplier_id', 'search')
+SALES_ORDER_FILTERS = ('status', 'customer_id', 'payment_status', 'search')
+
+# 批量状态转换一次最多的订单数
+TRANSITION_MAX_ORDERS = 1000
+
+
+class InvalidParameter(ValueError):
+    """请求参数不合法，返回 400"""
+
+
+def _int_arg(args, name, default):
+    try:
+        value = int(args.get(name, default))
+    except (TypeError, ValueError):
+        raise InvalidParameter(f'参数 {name} 必须是整数')
+    if value < 1:
+        raise InvalidParameter(f'参数 {name} 必须大于 0')
+    return value
+
+
+def page_args(args, sorts, default_limit=20):
+    """分页参数 Paging：page/limit，排序 sort/order，游标 after/before，总数策略 count
+
+    sorts 为仓储中的排序方式表（如 Repository.PRODUCT_SORTS）。带 after 或
+    before 时按游标翻页，page 被忽略。
+    """
+    page = _int_arg(args, 'page', 1)
+    limit = _int_arg(args, 'limit', default_limit)
+
+    # 带 search 时默认按相关度排序
+    searching = bool(args.get('search'))
+    sort = args.get('sort') or ('relevance' if searching and 'relevance' in sorts else 'id')
+    if sort not in sorts:
+        raise InvalidParameter(f'不支持的排序方式: {sort}，可选 {", ".join(sorts)}')
+    if sort == 'relevance' and not searching:
+        raise InvalidParameter('按相关度排序需要提供 search 参数')
+    order = (args.get('order') or 'desc').lower()
+    if order not in ('asc', 'desc'):
+        raise InvalidParameter('参数 order 只能是 asc 或 desc')
+    descending = order == 'desc'
+
+    after = args.get('after')
+    before = args.get('before')
+    if after and before:
+        raise InvalidParameter('after 和 before 不能同时使用')
+    try:
+        after = decode_cursor(after, sort, descending) if after else None
+        before = decode_cursor(before, sort, descending) if before else None
+    except ValueError as e:
+        raise InvalidParameter(str(e))
+
+    count = args.get('count') or 'exact'
+    if count not in ('exact', 'estimate', 'none'):
+        raise InvalidParameter('参数 count 只能是 exact、estimate 或 none')
+
+    return Paging(page, limit, sort, descending, after, before, count)
+
+
+def include_arg(args):
+    """订单列表的明细加载方式：items（默认）、summary 或 none"""
+    include = args.get('include') or 'items'
+    if include not in ('items', 'summary', 'none'):
+        raise InvalidParameter('参数 include 只能是 items、summary 或 none')
+    return include
+
+
+def fields_arg(args, field_map):
+    """稀疏字段集：fields=a,b,c 解析为字段名列表，未提供时为 None（返回全部字段）
+
+    field_map 为仓储中的字段表（如 Repository.PRODUCT_FIELDS）。主键和排序列总会返回。
+    """
+    raw = args.get('fields')
+    if not raw:
+        return None
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in field_map]
+    if unknown:
+        raise InvalidParameter(f'不支持的字段: {", ".join(unknown)}')
+    return fields
+
+
+def suggest_args(args, default_limit=10, max_limit=50):
+    """联想参数 (q, limit)"""
+    return args.get('q', ''), min(_int_arg(args, 'limit', default_limit), max_limit)
+
+
+def import_format_arg(mimetype, args):
+    """批量导入的数据格式：format 参数优先，否则按 Content-Type 判断"""
+    fmt = args.get('format') or IMPORT_FORMATS.get(mimetype)
+    if fmt not in ('csv', 'ndjson'):
+        raise InvalidParameter('请求体须为 CSV（text/csv）或 NDJSON（application/x-ndjson），或用 format=csv|ndjson 指定')
+    return fmt
+
+
+def expected_version(if_match, data):
+    """客户端期望的行版本：If-Match 请求头（"3" 或 W/"3"）或请求体 expected_version
+
+    未提供或 If-Match 为 * 时返回 None（不检查版本）。
+    """
+    if if_match and if_match.strip() != '*':
+        value = if_match.strip()
+        value = value[2:] if value.startswith('W/') else value
+        value = value.strip('"')
+    elif isinstance(data, dict) and data.get('expected_version') is not None:
+        value = data['expected_version']
+    else:
+        return None
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise InvalidParameter('If-Match 或 expected_version 必须是正整数行版本号')
+    return value
+
+
+def order_items(items):
+    """订单明细 [{product_id, quantity, unit_price}] -> [(产品ID, 数量, 单价)]"""
+    if not isinstance(items, list) or not items:
+        raise InvalidParameter('订单必须包含至少一个项目')
+    rows = []
+    for row_no, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            raise InvalidParameter(f'第 {row_no} 个项目必须是对象')
+        product_id, quantity, unit_price = (item.get(name) for name in ('product_id', 'quantity', 'unit_price'))
+        if isinstance(product_id, bool) or not isinstance(product_id, int):
+            raise InvalidParameter(f'第 {row_no} 个项目的 product_id 必须是整数')
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+            raise InvalidParameter(f'第 {row_no} 个项目的 quantity 必须是正整数')
+        if isinstance(unit_price, bool) or not isinstance(unit_price, (int, float)) or unit_price < 0:
+            raise InvalidParameter(f'第 {row_no} 个项目的 unit_price 必须是非负数')
+        rows.append((product_id, quantity, unit_price))
+    return rows
+
+
+def transition_args(data, actions):
+    """批量状态转换的请求体 {action, order_ids} -> (动作, [订单ID])，订单 ID 去重"""
+    action = data.get('action') if isinstance(data, dict) else None
+    if action not in actions:
+        raise InvalidParameter(f'action 只能是 {"、".join(actions)}')
+    order_ids = data.get('order_ids')
+    if not isinstance(order_ids, list) or not order_ids:
+        raise InvalidParameter('order_ids 不能为空')
+    if len(order_ids) > TRANSITION_MAX_ORDERS:
+        raise InvalidParameter(f'一次最多转换 {TRANSITION_MAX_ORDERS} 个订单')
+    for row_no, order_id in enumerate(order_ids, 1):
+        if isinstance(order_id, bool) or not isinstance(order_id, int):
+            raise InvalidParameter(f'第 {row_no} 个 order_id 必须是整数')
+    return action, list(dict.fromkeys(order_ids))
+
+
+def stocktake_items(data):
+    """盘点单 items：[{product_id 或 product_code, quantity}]，quantity 为实盘数量
+
+    返回 [(行号, 键列, 键, 实盘数量)]，键列为 product_id 或 product_code。
+    """
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise InvalidParameter('盘点单 items 不能为空')
+
+    sheet = []
+    for row_no, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            raise InvalidParameter(f'第 {row_no} 行必须是对象')
+        if item.get('product_id') is not None:
+            column, key = 'product_id', item['product_id']
+            if isinstance(key, bool) or not isinstance(key, int):
+                raise InvalidParameter(f'第 {row_no} 行的 product_id 必须是整数')
+        elif item.get('product_code'):
+            column, key = 'product_code', str(item['product_code'])
+        else:
+            raise InvalidParameter(f'第 {row_no} 行缺少 product_id 或 product_code')
+        quantity = item.get('quantity')
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 0:
+            raise InvalidParameter(f'第 {row_no} 行的 quantity 必须是非负整数')
+        sheet.append((row_no, column, key, quantity))
+    return sheet
+
+
+def filter_args(args, names):
+    """筛选参数，未提供的为空字符串"""
+    return {name: args.get(name, '') for name in names}
+
+
+def page_payload(result, paging):
+    """分页列表的返回格式；游标分页没有页码，不返回 page/total_pages
+
+    total_type 说明 total 是精确值（exact）、估算值（estimated）还是未统计（none）。
+    """
+    payload = {
+        'data': result.rows,
+        'total': result.total,
+        'total_type': result.total_type,
+        'limit': paging.limit,
+        'sort': paging.sort,
+        'order': 'desc' if paging.descending else 'asc',
+        'next_cursor': result.next_cursor,
+        'prev_cursor': result.prev_cursor
+    }
+    if not paging.keyset:
+        payload['page'] = paging.page
+        payload['total_pages'] = None if result.total is None else (result.total + paging.limit - 1) // paging.limit
+    return payload
+
+
+def sales_statistics_payload(monthly_stats, category_stats, customer_stats):
+    """销售统计的返回格式"""
+    # 如果还没有销售数据，使用模拟数据
+    if not monthly_stats:
+        monthly_stats = [
+            {'month': '2024-03', 'order_count': 0, 'total_amount': 0, 'avg_order_amount': 0},
+            {'month': '2024-02', 'order_count': 0, 'total_amount': 0, 'avg_order_amount': 0},
+            {'month': '2024-01', 'order_count': 0, 'total_amount': 0, 'avg_order_amount': 0}
+        ]
+
+    return {
+        'monthly': monthly_stats,
+        'by_category': category_stats,
+        'by_customer': customer_stats
+    }
+
+
+def dashboard_payload(inventory, counts, alerts, sales):
+    """仪表盘的返回格式：库存按材料类别汇总，预警只返回前几条和总数"""
+    return {
+        'inventory': {
+            'total_products': sum(row['product_count'] for row in inventory),
+            'total_items': sum(row['total_items'] for row in inventory),
+            'total_value': round(sum(row['total_value'] for row in inventory), 2),
+            'by_material': {row['material_type']: {
+                'product_count': row['product_count'],
+                'total_items': row['total_items'],
+                'total_value': round(row['total_value'], 2)
+            } for row in inventory}
+        },
+        'alerts': {
+            'low_stock': counts['low_stock'],
+            'overstock': counts['overstock'],
+            'top': alerts
+        },
+        'pending': {
+            'purchase_orders': counts['pending_purchase'],
+            'sales_orders': counts['pending_sales']
+        },
+        'sales': sales_statistics_payload(*sales)
+    }
+
+
+def stocktake_payload(lines):
+    """盘点差异报告：汇总盘盈/盘亏，差异明细按差异金额绝对值降序"""
+    variances = [line for line in lines if line['variance']]
+    variances.sort(key=lambda line: abs(line['variance_amount']), reverse=True)
+    return {
+        'counted': len(lines),
+        'changed': len(variances),
+        'unchanged': len(lines) - len(variances),
+        'surplus_quantity': sum(line['variance'] for line in variances if line['variance'] > 0),
+        'shortage_quantity': -sum(line['variance'] for line in variances if line['variance'] < 0),
+        'variance_amount': round(sum(line['variance_amount'] for line in variances), 2),
+        'variances': variances
+    }
+
+
+def error_payload(e):
+    """异常对应的 (返回内容, 状态码)：参数错误返回 400，连接池耗尽返回 503，其余返回 500"""
+    if isinstance(e, InvalidParameter):
+        return {'error': str(e)}, 400
+    if isinstance(e, PoolTimeout):
+        return {'error': '数据库繁忙，请稍后重试'}, 503
+    return {'error': str(e)}, 500
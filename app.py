@@ -1,12 +1,32 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_app_context, has_request_context
 from flask_cors import CORS
-import mysql.connector
-from mysql.connector import Error
+from werkzeug.http import http_date
 from datetime import datetime
+from contextlib import contextmanager
+import atexit
 import json
 from decimal import Decimal
 import os
-import random
+import time
+
+from api_utils import (CUSTOMER_FILTERS, PRODUCT_FILTERS, PURCHASE_ORDER_FILTERS, SALES_ORDER_FILTERS,
+                       SUPPLIER_FILTERS, dashboard_payload, error_payload, expected_version, fields_arg,
+                       filter_args, import_format_arg, include_arg, order_items, page_args, page_payload,
+                       sales_statistics_payload, stocktake_items, stocktake_payload, suggest_args,
+                       transition_args)
+from backends import backend_from_dsn, create_backend
+from bulk_import import chunked, product_values, read_rows
+from cache import (TableVersions, VersionedCache, cache_key, cached, conditional, not_modified, validators,
+                   writes)
+from hot_stock import StockCoalescer
+from idempotency import (BUSY, MISMATCH, REPLAY, IdempotencyStore, IdempotencyTable, fingerprint,
+                         idempotent)
+from ledger import LedgerWriter
+from order_numbers import OrderNumberAllocator
+from order_states import PURCHASE_ORDER_STATES, SALES_ORDER_STATES
+from replicas import ReplicaRouter
+from repository import Repository
+from suggest import PrefixIndex
 
 app = Flask(__name__)
 CORS(app)
@@ -20,6 +40,53 @@ db_config = {
     'port': 3306
 }
 
+# 连接池配置（可通过环境变量调整）
+pool_config = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+    'borrow_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+    'max_lifetime': float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+    'idle_timeout': float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300)),
+    'ping_after': float(os.environ.get('DB_POOL_PING_AFTER', 0.5))
+}
+
+# 存储后端：mysql（默认）或 sqlite（嵌入式 WAL 模式，用于单仓库站点和测试环境）
+db_backend = create_backend(
+    os.environ.get('DB_BACKEND', 'mysql'),
+    mysql_config=db_config,
+    sqlite_path=os.environ.get('SQLITE_PATH', 'factory.db'),
+    pool_config=pool_config
+)
+db_pool = db_backend.pool
+
+# 各表的数据版本号，写接口成功后递增，缓存据此失效
+table_versions = TableVersions()
+# 列表总数缓存（COUNT_CACHE_TTL 秒兜底，覆盖其他进程的写入）
+count_cache = VersionedCache(table_versions, ttl=float(os.environ.get('COUNT_CACHE_TTL', 30)))
+# 读接口响应缓存（@cached 标记的接口），按依赖表失效
+response_cache = VersionedCache(table_versions,
+                                ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 60)),
+                                max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', 2048)))
+# 仪表盘汇总整个目录，其他进程的写入感知不到，缓存时间更短
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', 10))
+# SEARCH_LIMIT：search 参数最多匹配的条数（按相关度取前 N 条），限制大表上的搜索代价
+repo = Repository(db_backend, count_cache, search_limit=int(os.environ.get('SEARCH_LIMIT', 1000)))
+# 批量导入每块的行数，每块一个事务
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+
+# 产品联想前缀索引（启动时预加载，SUGGEST_MAX_AGE 秒后在查询时重新加载）
+product_index = PrefixIndex('product_id', ('product_code', 'product_name', 'specification'),
+                            max_age=float(os.environ.get('SUGGEST_MAX_AGE', 300)))
+
+# 读写分离：DB_REPLICAS 为逗号分隔的从库 DSN，GET 请求自动路由到从库
+# （例如 mysql://root:pw@10.0.0.2:3306/factory 或 sqlite:///replica.db）
+replica_router = ReplicaRouter(
+    db_backend,
+    [backend_from_dsn(dsn.strip(), pool_config)
+     for dsn in os.environ.get('DB_REPLICAS', '').split(',') if dsn.strip()],
+    max_lag=float(os.environ.get('DB_REPLICA_MAX_LAG', 5)),
+    read_your_writes=float(os.environ.get('DB_READ_YOUR_WRITES', 5))
+)
+
 
 class DecimalEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -31,14 +98,384 @@ class DecimalEncoder(json.JSONEncoder):
 app.json_encoder = DecimalEncoder
 
 
-def get_db_connection():
-    """获取数据库连接"""
+def client_key():
+    """读你所写窗口使用的客户端标识"""
+    return request.headers.get('X-Client-Id') or request.remote_addr
+
+
+def get_db_connection(readonly=None):
+    """从连接池借用数据库连接，conn.close() 即归还；借用超时抛出 PoolTimeout
+
+    readonly 为 None 时按请求方法判断：GET/HEAD 请求走从库（如有），其余走主库。
+    """
+    if readonly is None:
+        readonly = has_request_context() and request.method in ('GET', 'HEAD')
+
+    conn = None
+    if readonly:
+        # 同一请求内的只读连接来自同一个库，条件请求的版本查询与数据查询一致
+        backend = g.get('read_backend') if has_app_context() else None
+        if backend is None:
+            backend = replica_router.read_backend(client_key())
+            if has_app_context():
+                g.read_backend = backend
+        if backend is not db_backend:
+            try:
+                conn = backend.pool.acquire()
+            except Exception as e:
+                # 从库不可用时回退主库
+                replica_router.mark_unhealthy(backend, e)
+
+    if conn is None:
+        try:
+            conn = db_pool.acquire()
+        except db_backend.Error as e:
+            app.logger.error("数据库连接错误: %s", e)
+            return None
+
+    # 记录到请求上下文，请求结束时统一归还，处理函数抛异常也不会泄漏连接
+    if has_app_context():
+        g.setdefault('db_connections', []).append(conn)
+    return conn
+
+
+@contextmanager
+def db_cursor(dictionary=False):
+    """with db_cursor() as (conn, cursor): ... 退出时关闭游标并归还连接"""
+    with db_pool.connection() as conn:
+        cursor = conn.cursor(dictionary=dictionary)
+        try:
+            yield conn, cursor
+        finally:
+            cursor.close()
+
+
+def upgrade_schema():
+    """启动时把主库升级到当前版本的结构（MySQL 旧库补列、表、索引和触发器），
+    新建的派生表（库存预警、销售汇总）按现有数据重建；连接失败时跳过，由各接口返回数据库错误"""
+    try:
+        created = db_backend.upgrade_schema()
+    except db_backend.Error as e:
+        app.logger.error("数据库连接错误，跳过结构升级: %s", e)
+        return
+    if 'stock_alerts' not in created and 'sales_monthly_summary' not in created:
+        return
+    with db_cursor(dictionary=True) as (conn, cursor):
+        try:
+            if 'stock_alerts' in created:
+                repo.rebuild_stock_alerts(cursor)
+            if 'sales_monthly_summary' in created:
+                repo.rebuild_sales_summary(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+upgrade_schema()
+
+
+def warm_product_index():
+    """启动时加载产品联想索引，第一个联想请求不用等全量加载；失败时记录日志，首次查询时再加载"""
+    try:
+        with db_cursor(dictionary=True) as (conn, cursor):
+            token = product_index.begin_load()
+            product_index.load(repo.list_product_suggestions(cursor), token)
+    except Exception as e:
+        app.logger.warning("产品联想索引预加载失败: %s", e)
+
+
+warm_product_index()
+
+
+def reserve_order_numbers(key, count):
+    """在主库上用独立的短事务预留一段单号，不随订单事务回滚"""
+    with db_cursor(dictionary=True) as (conn, cursor):
+        try:
+            first = repo.reserve_sequence(cursor, key, count)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return first
+
+
+# 单号分配器：每个进程一次预留 ORDER_NUMBER_BLOCK 个序号，在内存中发放
+order_numbers = OrderNumberAllocator(reserve_order_numbers,
+                                     block_size=int(os.environ.get('ORDER_NUMBER_BLOCK', 100)))
+
+
+def write_ledger_batch(spool_key, advance, groups):
+    """延迟写入的一批库存流水，独立事务提交后让依赖流水的缓存失效"""
+    with db_cursor(dictionary=True) as (conn, cursor):
+        try:
+            written = repo.write_ledger(cursor, spool_key, advance, groups)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    table_versions.bump('inventory_transactions')
+    return written
+
+
+def ledger_flushed_seq(spool_key):
+    with db_cursor(dictionary=True) as (conn, cursor):
+        return repo.ledger_flushed_seq(cursor, spool_key)
+
+
+def defer_ledger_entry(rows):
+    """请求中 add_transaction 的流水在请求事务提交前写入 spool，返回 (spool_key, 序号)
+    由 Repository 在同一事务中登记，请求结束后交给 ledger_writer 写入；不在请求中时直接写库"""
+    if not has_request_context():
+        return None
+    now = db_backend.current_timestamp()
+    seq = ledger_writer.prepare([row + (now,) for row in rows])
+    g.setdefault('ledger_seqs', []).append(seq)
+    return ledger_writer.key, seq
+
+
+def allocate_hot_stock(product_id, quantities):
+    """合并器的一批扣减：独立的短事务（同时写出库流水并登记预留），提交后库存缓存失效"""
+    with db_cursor(dictionary=True) as (conn, cursor):
+        try:
+            results = repo.allocate_stock(cursor, product_id, quantities, time.time())
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    table_versions.bump('products', 'inventory_transactions')
+    return results
+
+
+def release_hot_stock(reservation):
+    """订单没有提交时退回合并器的预留 (流水ID, 扣减前, 扣减后)"""
+    with db_cursor(dictionary=True) as (conn, cursor):
+        try:
+            repo.release_reservation(cursor, reservation[0])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    table_versions.bump('products', 'inventory_transactions')
+
+
+def reclaim_hot_stock():
+    """退回登记超过 HOT_STOCK_RESERVATION_TTL 秒仍未被订单认领的预留"""
+    with db_cursor(dictionary=True) as (conn, cursor):
+        try:
+            released = repo.release_expired_reservations(cursor, time.time() - HOT_STOCK_RESERVATION_TTL)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if released:
+        table_versions.bump('products', 'inventory_transactions')
+    return released
+
+
+# 热门产品库存扣减合并：HOT_PRODUCTS 为逗号分隔的产品 ID，这些产品同一时间窗口
+# （HOT_STOCK_WINDOW 毫秒）内的扣减合并为一次 UPDATE；未设置时订单事务中直接扣减。
+# 预留超过 HOT_STOCK_RESERVATION_TTL 秒仍未被订单认领时退回（进程崩溃等），须远大于下单耗时
+HOT_STOCK_RESERVATION_TTL = float(os.environ.get('HOT_STOCK_RESERVATION_TTL', 300))
+stock_coalescer = None
+if os.environ.get('HOT_PRODUCTS'):
+    stock_coalescer = StockCoalescer(
+        [int(x) for x in os.environ['HOT_PRODUCTS'].split(',') if x.strip()],
+        allocate_hot_stock, release_hot_stock,
+        window=float(os.environ.get('HOT_STOCK_WINDOW', 2)) / 1000,
+        reclaim=reclaim_hot_stock, reclaim_interval=HOT_STOCK_RESERVATION_TTL / 5
+    )
+    stock_coalescer.start()
+
+# Idempotency-Key：响应保存 IDEMPOTENCY_TTL 秒；设置 IDEMPOTENCY_DB 时键同时写入 idempotency_keys 表，
+# 多进程之间共享
+idempotency = IdempotencyStore(
+    ttl=float(os.environ.get('IDEMPOTENCY_TTL', 86400)),
+    max_entries=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000)),
+    table=IdempotencyTable(repo, db_cursor) if os.environ.get('IDEMPOTENCY_DB') else None
+)
+
+# 库存流水延迟批量写入：LEDGER_SPOOL 为本进程的 spool 目录（每个进程一个），
+# 未设置时流水随请求事务逐条写入
+ledger_writer = None
+if os.environ.get('LEDGER_SPOOL'):
+    ledger_writer = LedgerWriter(os.environ['LEDGER_SPOOL'], write_ledger_batch, ledger_flushed_seq,
+                                 batch_size=int(os.environ.get('LEDGER_BATCH_SIZE', 500)),
+                                 flush_interval=float(os.environ.get('LEDGER_FLUSH_INTERVAL', 1)))
+    repo.ledger = defer_ledger_entry
+    atexit.register(ledger_writer.close)
+
+
+def sync_product_index(conn, product_id):
+    """产品写入提交后同步联想索引"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        product = repo.get_product(cursor, product_id, repo.PRODUCT_SUGGEST_FIELDS)
+    finally:
+        cursor.close()
+    if product:
+        product_index.upsert(product_id, product)
+    else:
+        product_index.remove(product_id)
+
+
+@app.before_request
+def check_conditional():
+    """条件 GET：用数据版本探针算出 ETag / Last-Modified，客户端已是最新时直接返回 304"""
+    if request.method != 'GET':
+        return None
+    tables = getattr(app.view_functions.get(request.endpoint), 'etag_tables', None)
+    if not tables:
+        return None
+
+    # 版本查询失败时按普通请求处理，由路由返回错误
     try:
-        conn = mysql.connector.connect(**db_config)
-        return conn
-    except Error as e:
-        print(f"数据库连接错误: {e}")
+        conn = get_db_connection()
+        if not conn:
+            return None
+        cursor = conn.cursor(dictionary=True)
+        try:
+            version, last_modified, now = repo.data_version(cursor, tables)
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception:
+        return None
+
+    g.etag, g.last_modified = validators(cache_key(request.path, request.args), version, last_modified, now)
+    if not_modified(request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since'),
+                    g.etag, g.last_modified):
+        response = app.response_class(status=304)
+        set_validators(response)
+        return response
+
+
+def set_validators(response):
+    response.headers['ETag'] = g.etag
+    if g.last_modified is not None:
+        response.headers['Last-Modified'] = http_date(g.last_modified)
+
+
+@app.after_request
+def add_validators(response):
+    if 'etag' in g and response.status_code == 200:
+        set_validators(response)
+    return response
+
+
+def cache_tables():
+    """当前请求可缓存时返回响应依赖的表，否则返回 None"""
+    if request.method != 'GET':
+        return None
+    return getattr(app.view_functions.get(request.endpoint), 'cache_tables', None)
+
+
+@app.before_request
+def serve_cached_response():
+    """可缓存的 GET 请求命中缓存时直接返回，不借连接也不查库"""
+    tables = cache_tables()
+    if not tables:
+        return None
+    body = response_cache.get(tables, cache_key(request.path, request.args))
+    if body is not None:
+        response = app.response_class(body, mimetype='application/json')
+        response.headers['X-Cache'] = 'HIT'
+        return response
+    # 记录查询前的版本，查询期间有写入时缓存的条目直接失效
+    g.cache_version = table_versions.get(tables)
+
+
+@app.after_request
+def store_cached_response(response):
+    if 'cache_version' in g and response.status_code == 200:
+        view = app.view_functions[request.endpoint]
+        response_cache.put(view.cache_tables, cache_key(request.path, request.args),
+                           response.get_data(), g.cache_version, view.cache_ttl)
+        response.headers['X-Cache'] = 'MISS'
+    return response
+
+
+@app.after_request
+def track_writes(response):
+    """写请求成功后开启该客户端的读你所写窗口，递增被修改表的版本号"""
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+        replica_router.mark_write(client_key())
+        view = app.view_functions.get(request.endpoint)
+        table_versions.bump(*getattr(view, 'write_tables', ()))
+    return response
+
+
+@app.before_request
+def check_idempotency_key():
+    """带 Idempotency-Key 的重复写请求直接返回第一次的响应，并发的重复请求等第一次完成"""
+    key = request.headers.get('Idempotency-Key')
+    if not key or not getattr(app.view_functions.get(request.endpoint), 'idempotent', False):
         return None
+    if len(key) > 200:
+        return jsonify({'error': 'Idempotency-Key 不能超过 200 个字符'}), 400
+
+    key = f'{request.path}:{key}'
+    try:
+        outcome, stored = idempotency.begin(key, fingerprint(request.get_data()))
+    except Exception as e:
+        return error_response(e)
+    if outcome == REPLAY:
+        response = app.response_class(stored[1], status=stored[0], mimetype='application/json')
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    if outcome == MISMATCH:
+        return jsonify({'error': '该 Idempotency-Key 已用于内容不同的请求'}), 422
+    if outcome == BUSY:
+        return jsonify({'error': '相同 Idempotency-Key 的请求仍在处理中，请稍后重试'}), 409
+    g.idempotency_key = key
+
+
+@app.after_request
+def store_idempotent_response(response):
+    """保存第一次请求的响应；5xx 不保存，重试会重新执行"""
+    key = g.pop('idempotency_key', None)
+    if key is not None:
+        try:
+            if response.status_code < 500:
+                idempotency.complete(key, response.status_code, response.get_data(as_text=True))
+            else:
+                idempotency.release(key)
+        except Exception as e:
+            # 本进程内已保存；表中的键在租约到期后可被其他进程重新执行
+            app.logger.warning("保存幂等键结果失败: %s", e)
+    return response
+
+
+@app.teardown_request
+def release_idempotency_key(exc):
+    """请求异常结束时释放幂等键"""
+    key = g.pop('idempotency_key', None)
+    if key is not None:
+        try:
+            idempotency.release(key)
+        except Exception as e:
+            app.logger.warning("释放幂等键失败: %s", e)
+
+
+@app.teardown_request
+def finish_ledger_entries(exc):
+    """请求结束（事务已提交或回滚）后，本次请求写入 spool 的流水可以批量写库"""
+    seqs = g.pop('ledger_seqs', ())
+    if ledger_writer is not None and seqs:
+        ledger_writer.finish(*seqs)
+
+
+@app.teardown_appcontext
+def release_db_connections(exc):
+    """归还本次请求中未关闭的连接"""
+    for conn in g.pop('db_connections', []):
+        conn.close()
+
+
+def error_response(e):
+    """统一的异常响应：连接池耗尽返回 503，其余返回 500"""
+    payload, status = error_payload(e)
+    return jsonify(payload), status
 
 
 # ==================== 主页路由 ====================
@@ -99,6 +536,7 @@ def home():
                         <tr><td>DELETE</td><td><code>/api/products/&lt;id&gt;</code></td><td>删除产品</td></tr>
                         <tr><td>GET</td><td><code>/api/inventory/alerts</code></td><td>获取库存预警</td></tr>
                         <tr><td>GET</td><td><code>/api/statistics/sales</code></td><td>获取销售统计</td></tr>
+                        <tr><td>GET</td><td><code>/api/system/pool</code></td><td>连接池指标</td></tr>
                     </tbody>
                 </table>
             </div>
@@ -155,7 +593,47 @@ def test_api():
         }), 500
 
 
+@app.route('/api/system/pool', methods=['GET'])
+def get_pool_stats():
+    """获取连接池指标（借出数、等待数、等待时间）及从库状态"""
+    stats = db_pool.stats()
+    stats['routing'] = replica_router.stats()
+    return jsonify(stats)
+
+
+@app.route('/api/system/ledger', methods=['GET'])
+def get_ledger_stats():
+    """获取库存流水延迟写入的指标（队列深度、写入耗时等）；未开启时 enabled 为 false"""
+    if ledger_writer is None:
+        return jsonify({'enabled': False})
+    stats = ledger_writer.stats()
+    stats['enabled'] = True
+    return jsonify(stats)
+
+
+@app.route('/api/system/hot-stock', methods=['GET'])
+def get_hot_stock_stats():
+    """获取热门产品扣减合并的指标（批次数、平均批大小等）；未开启时 enabled 为 false"""
+    if stock_coalescer is None:
+        return jsonify({'enabled': False})
+    stats = stock_coalescer.stats()
+    stats['enabled'] = True
+    return jsonify(stats)
+
+
+@app.route('/api/system/cache', methods=['GET'])
+def get_cache_stats():
+    """获取缓存命中率等指标，用于调整缓存大小和 TTL"""
+    return jsonify({
+        'responses': response_cache.stats(),
+        'counts': count_cache.stats(),
+        'product_index': product_index.stats(),
+        'idempotency': idempotency.stats()
+    })
+
+
 @app.route('/api/products', methods=['GET'])
+@conditional('products')
 def get_products():
     """获取产品列表"""
     try:
@@ -166,49 +644,21 @@ def get_products():
         cursor = conn.cursor(dictionary=True)
 
         # 支持分页和筛选
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
-        offset = (page - 1) * limit
-        material_type = request.args.get('material_type', '')
-        status = request.args.get('status', '')
-
-        query = "SELECT * FROM products WHERE 1=1"
-        params = []
-
-        if material_type:
-            query += " AND material_type = %s"
-            params.append(material_type)
-        if status:
-            query += " AND status = %s"
-            params.append(status)
-
-        # 获取总数
-        count_query = query.replace("SELECT *", "SELECT COUNT(*) as total")
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
-
-        # 获取分页数据
-        query += " ORDER BY product_id DESC LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        cursor.execute(query, params)
-        products = cursor.fetchall()
+        paging = page_args(request.args, repo.PRODUCT_SORTS)
+        fields = fields_arg(request.args, repo.PRODUCT_FIELDS)
+        result = repo.list_products(cursor, paging, fields, **filter_args(request.args, PRODUCT_FILTERS))
 
         cursor.close()
         conn.close()
 
-        return jsonify({
-            'data': products,
-            'total': total,
-            'page': page,
-            'limit': limit,
-            'total_pages': (total + limit - 1) // limit
-        })
+        return jsonify(page_payload(result, paging))
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/products', methods=['POST'])
+@writes('products', 'inventory_transactions')
 def create_product():
     """创建新产品"""
     try:
@@ -263,23 +713,20 @@ def create_product():
 
         # 记录库存变动
         if data.get('current_stock', 0) > 0:
-            cursor.execute("""
-                INSERT INTO inventory_transactions (
-                    product_id, transaction_type, quantity_change,
-                    quantity_before, quantity_after, notes
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
+            repo.add_transaction(
+                cursor,
                 product_id,
                 '库存调整',
                 int(data.get('current_stock', 0)),
                 0,
                 int(data.get('current_stock', 0)),
                 '初始库存'
-            ))
+            )
 
         conn.commit()
-
         cursor.close()
+
+        sync_product_index(conn, product_id)
         conn.close()
 
         return jsonify({
@@ -290,10 +737,118 @@ def create_product():
 
     except Exception as e:
         print("创建产品错误:", e)
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+
+def import_product_chunk(conn, cursor, chunk, category_ids, seen_codes):
+    """导入一块数据：逐行校验，编码按集合查重，多行 INSERT 后在一个事务中提交；返回每行结果"""
+    results, valid = [], []
+    for row_no, record, error in chunk:
+        code = record.get('product_code') if record else None
+        try:
+            if error:
+                raise ValueError(error)
+            values = product_values(record, category_ids)
+            if values[0] in seen_codes:
+                raise ValueError('产品编码在导入数据中重复')
+        except ValueError as e:
+            results.append({'row': row_no, 'product_code': code, 'status': 'error', 'error': str(e)})
+            continue
+        seen_codes.add(values[0])
+        valid.append((row_no, values))
+
+    existing = repo.existing_product_codes(cursor, [values[0] for _, values in valid]) if valid else set()
+    rows = []
+    for row_no, values in valid:
+        if values[0] in existing:
+            results.append({'row': row_no, 'product_code': values[0], 'status': 'error', 'error': '产品编码已存在'})
+        else:
+            rows.append((row_no, values))
+
+    if rows:
+        try:
+            ids = repo.insert_products(cursor, [values for _, values in rows])
+            conn.commit()
+        except db_backend.Error as e:
+            # 并发写入了相同编码等情况：整块回滚，逐行报告
+            conn.rollback()
+            results.extend({'row': row_no, 'product_code': values[0], 'status': 'error', 'error': str(e)}
+                           for row_no, values in rows)
+        else:
+            results.extend({'row': row_no, 'product_code': values[0], 'status': 'created',
+                            'product_id': ids[values[0]]} for row_no, values in rows)
+
+    results.sort(key=lambda result: result['row'])
+    return results
+
+
+@app.route('/api/products/import', methods=['POST'])
+@writes('products', 'inventory_transactions')
+def import_products():
+    """批量导入产品：请求体为 CSV 或 NDJSON，流式读取，每 IMPORT_CHUNK_SIZE 行一个事务
+
+    返回每一行的结果（created 或 error），部分行失败不影响其他行。
+    """
+    try:
+        fmt = import_format_arg(request.mimetype, request.args)
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': '数据库连接失败'}), 500
+
+        cursor = conn.cursor(dictionary=True)
+        category_ids = {category['category_id'] for category in repo.list_categories(cursor)}
+
+        results = []
+        seen_codes = set()
+        for chunk in chunked(read_rows(request.stream, fmt), IMPORT_CHUNK_SIZE):
+            results.extend(import_product_chunk(conn, cursor, chunk, category_ids, seen_codes))
+
+        cursor.close()
+        conn.close()
+
+        created = sum(1 for result in results if result['status'] == 'created')
+        if created:
+            product_index.invalidate()
+
+        return jsonify({
+            'total': len(results),
+            'created': created,
+            'failed': len(results) - created,
+            'results': results
+        })
+
+    except Exception as e:
+        return error_response(e)
+
+
+@app.route('/api/products/suggest', methods=['GET'])
+def suggest_products():
+    """产品联想：按编码/名称/规格前缀匹配，q 为输入内容"""
+    try:
+        q, limit = suggest_args(request.args)
+
+        if product_index.stale():
+            conn = get_db_connection()
+            if not conn:
+                return jsonify({'error': '数据库连接失败'}), 500
+
+            cursor = conn.cursor(dictionary=True)
+            token = product_index.begin_load()
+            product_index.load(repo.list_product_suggestions(cursor), token)
+
+            cursor.close()
+            conn.close()
+
+        return jsonify(product_index.search(q, limit))
+
+    except Exception as e:
+        return error_response(e)
 
 
 @app.route('/api/products/<int:product_id>', methods=['GET'])
+@conditional('products')
+@cached('products')
 def get_product(product_id):
     """获取单个产品详情"""
     try:
@@ -302,8 +857,8 @@ def get_product(product_id):
             return jsonify({'error': '数据库连接失败'}), 500
 
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM products WHERE product_id = %s", (product_id,))
-        product = cursor.fetchone()
+        fields = fields_arg(request.args, repo.PRODUCT_FIELDS)
+        product = repo.get_product(cursor, product_id, fields)
 
         cursor.close()
         conn.close()
@@ -314,101 +869,63 @@ def get_product(product_id):
         return jsonify(product)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/products/<int:product_id>', methods=['PUT'])
+@writes('products', 'inventory_transactions')
 def update_product(product_id):
-    """更新产品信息"""
+    """更新产品信息
+
+    If-Match 请求头或请求体 expected_version 为读取时的 version，产品已被其他请求修改时
+    返回 409；不带时直接覆盖。
+    """
     try:
         data = request.json
+        version = expected_version(request.headers.get('If-Match'), data)
+
+        # 要更新的列
+        changes = {}
+        for column in ('product_name', 'material_type', 'specification', 'warehouse_location', 'status'):
+            if column in data:
+                changes[column] = data[column]
+        if 'unit_price' in data:
+            changes['unit_price'] = float(data['unit_price'])
+        for column in ('current_stock', 'min_stock_level', 'max_stock_level'):
+            if column in data:
+                changes[column] = int(data[column])
 
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': '数据库连接失败'}), 500
 
-        cursor = conn.cursor()
+        cursor = conn.cursor(dictionary=True)
 
-        # 检查产品是否存在
-        cursor.execute("SELECT product_id FROM products WHERE product_id = %s", (product_id,))
-        if not cursor.fetchone():
+        # 一条以版本为条件的 UPDATE（修改库存时另记流水），失败时才读取版本区分 404 / 409
+        new_version = repo.update_product(cursor, product_id, changes, version)
+        if new_version is None:
+            conn.rollback()
+            current_version = repo.row_version(cursor, 'products', 'product_id', product_id)
             cursor.close()
             conn.close()
-            return jsonify({'error': '产品不存在'}), 404
-
-        # 构建更新语句
-        update_fields = []
-        values = []
-
-        if 'product_name' in data:
-            update_fields.append("product_name = %s")
-            values.append(data['product_name'])
-        if 'material_type' in data:
-            update_fields.append("material_type = %s")
-            values.append(data['material_type'])
-        if 'specification' in data:
-            update_fields.append("specification = %s")
-            values.append(data['specification'])
-        if 'unit_price' in data:
-            update_fields.append("unit_price = %s")
-            values.append(float(data['unit_price']))
-        if 'current_stock' in data:
-            # 获取当前库存用于记录变动
-            cursor.execute("SELECT current_stock FROM products WHERE product_id = %s", (product_id,))
-            old_stock = cursor.fetchone()[0]
-            new_stock = int(data['current_stock'])
-
-            update_fields.append("current_stock = %s")
-            values.append(new_stock)
-
-            # 记录库存变动
-            if new_stock != old_stock:
-                cursor.execute("""
-                    INSERT INTO inventory_transactions (
-                        product_id, transaction_type, quantity_change,
-                        quantity_before, quantity_after, notes
-                    ) VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    product_id,
-                    '库存调整',
-                    new_stock - old_stock,
-                    old_stock,
-                    new_stock,
-                    '手动调整库存'
-                ))
-
-        if 'min_stock_level' in data:
-            update_fields.append("min_stock_level = %s")
-            values.append(int(data['min_stock_level']))
-        if 'max_stock_level' in data:
-            update_fields.append("max_stock_level = %s")
-            values.append(int(data['max_stock_level']))
-        if 'warehouse_location' in data:
-            update_fields.append("warehouse_location = %s")
-            values.append(data['warehouse_location'])
-        if 'status' in data:
-            update_fields.append("status = %s")
-            values.append(data['status'])
-
-        update_fields.append("updated_at = CURRENT_TIMESTAMP")
-
-        if update_fields:
-            query = f"UPDATE products SET {', '.join(update_fields)} WHERE product_id = %s"
-            values.append(product_id)
-            cursor.execute(query, tuple(values))
+            if current_version is None:
+                return jsonify({'error': '产品不存在'}), 404
+            return jsonify({'error': '产品已被修改，请刷新后重试', 'version': current_version}), 409
 
         conn.commit()
-
         cursor.close()
+
+        sync_product_index(conn, product_id)
         conn.close()
 
-        return jsonify({'message': '产品更新成功'})
+        return jsonify({'message': '产品更新成功', 'version': new_version})
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/products/<int:product_id>', methods=['DELETE'])
+@writes('products')
 def delete_product(product_id):
     """删除产品"""
     try:
@@ -428,6 +945,7 @@ def delete_product(product_id):
         # 删除产品（实际项目中可能需要软删除）
         cursor.execute("DELETE FROM products WHERE product_id = %s", (product_id,))
         conn.commit()
+        product_index.remove(product_id)
 
         cursor.close()
         conn.close()
@@ -435,11 +953,13 @@ def delete_product(product_id):
         return jsonify({'message': '产品删除成功'})
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 # ==================== 库存管理API ====================
 @app.route('/api/inventory/alerts', methods=['GET'])
+@conditional('products')
+@cached('products')
 def get_stock_alerts():
     """获取库存预警"""
     try:
@@ -449,31 +969,7 @@ def get_stock_alerts():
 
         cursor = conn.cursor(dictionary=True)
 
-        # 使用存储过程或直接查询
-        cursor.execute("""
-            SELECT 
-                p.product_id,
-                p.product_code,
-                p.product_name,
-                p.current_stock,
-                p.min_stock_level,
-                p.max_stock_level,
-                CASE 
-                    WHEN p.current_stock < p.min_stock_level THEN '库存不足'
-                    WHEN p.current_stock > p.max_stock_level THEN '库存过剩'
-                    ELSE '正常'
-                END as alert_type,
-                CASE 
-                    WHEN p.current_stock < p.min_stock_level THEN p.min_stock_level - p.current_stock
-                    WHEN p.current_stock > p.max_stock_level THEN p.current_stock - p.max_stock_level
-                    ELSE 0
-                END as alert_value
-            FROM products p
-            WHERE p.current_stock < p.min_stock_level OR p.current_stock > p.max_stock_level
-            ORDER BY alert_type, ABS(p.current_stock - p.min_stock_level) DESC
-        """)
-
-        alerts = cursor.fetchall()
+        alerts = repo.stock_alerts(cursor)
 
         cursor.close()
         conn.close()
@@ -481,10 +977,11 @@ def get_stock_alerts():
         return jsonify(alerts)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/inventory/transactions', methods=['GET'])
+@conditional('inventory_transactions', 'products')
 def get_inventory_transactions():
     """获取库存变动记录"""
     try:
@@ -497,26 +994,7 @@ def get_inventory_transactions():
         product_id = request.args.get('product_id')
         limit = int(request.args.get('limit', 50))
 
-        query = """
-            SELECT 
-                it.*,
-                p.product_name,
-                p.product_code
-            FROM inventory_transactions it
-            JOIN products p ON it.product_id = p.product_id
-            WHERE 1=1
-        """
-        params = []
-
-        if product_id:
-            query += " AND it.product_id = %s"
-            params.append(product_id)
-
-        query += " ORDER BY it.transaction_date DESC LIMIT %s"
-        params.append(limit)
-
-        cursor.execute(query, tuple(params))
-        transactions = cursor.fetchall()
+        transactions = repo.list_inventory_transactions(cursor, limit, product_id=product_id)
 
         cursor.close()
         conn.close()
@@ -524,10 +1002,12 @@ def get_inventory_transactions():
         return jsonify(transactions)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/inventory/adjust', methods=['POST'])
+@writes('products', 'inventory_transactions')
+@idempotent
 def adjust_inventory():
     """调整库存"""
     try:
@@ -558,24 +1038,25 @@ def adjust_inventory():
         old_stock = result[0]
         new_stock = quantity
 
-        # 更新库存
-        cursor.execute("UPDATE products SET current_stock = %s, updated_at = CURRENT_TIMESTAMP WHERE product_id = %s",
-                       (new_stock, product_id))
+        # 更新库存：以读到的库存为条件，期间被其他请求修改时不覆盖，流水的调整前库存与实际一致
+        cursor.execute("UPDATE products SET current_stock = %s, version = version + 1, updated_at = CURRENT_TIMESTAMP "
+                       "WHERE product_id = %s AND current_stock = %s", (new_stock, product_id, old_stock))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return jsonify({'error': '库存已被修改，请刷新后重试'}), 409
 
         # 记录库存变动
-        cursor.execute("""
-            INSERT INTO inventory_transactions (
-                product_id, transaction_type, quantity_change,
-                quantity_before, quantity_after, notes
-            ) VALUES (%s, %s, %s, %s, %s, %s)
-        """, (
+        repo.add_transaction(
+            cursor,
             product_id,
             '库存调整',
             new_stock - old_stock,
             old_stock,
             new_stock,
             notes
-        ))
+        )
 
         conn.commit()
 
@@ -591,11 +1072,82 @@ def adjust_inventory():
         })
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+
+@app.route('/api/inventory/stocktake', methods=['POST'])
+@writes('products', 'inventory_transactions')
+@idempotent
+def stocktake():
+    """盘点：提交整张盘点单，按实盘数量调整库存并写 '盘点' 流水，返回差异报告
+
+    整张盘点单在一个事务中生效；有产品不存在、重复或盘点期间库存被改动时整单不生效。
+    """
+    try:
+        data = request.json
+        sheet = stocktake_items(data)
+        notes = data.get('notes') or '盘点'
+        created_by = data.get('created_by')
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': '数据库连接失败'}), 500
+
+        cursor = conn.cursor(dictionary=True)
+        products = repo.stock_levels(
+            cursor,
+            {key for _, column, key, _ in sheet if column == 'product_id'},
+            {key for _, column, key, _ in sheet if column == 'product_code'}
+        )
+        found = {(column, product[column]): product for product in products
+                 for column in ('product_id', 'product_code')}
+
+        lines, errors = {}, []
+        for row_no, column, key, quantity in sheet:
+            product = found.get((column, key))
+            if product is None:
+                errors.append({'row': row_no, column: key, 'error': '产品不存在'})
+            elif product['product_id'] in lines:
+                errors.append({'row': row_no, column: key, 'error': '产品在盘点单中重复'})
+            else:
+                book = product['current_stock']
+                lines[product['product_id']] = {
+                    'product_id': product['product_id'],
+                    'product_code': product['product_code'],
+                    'product_name': product['product_name'],
+                    'book_stock': book,
+                    'counted': quantity,
+                    'variance': quantity - book,
+                    'variance_amount': round(float(product['unit_price']) * (quantity - book), 2)
+                }
+        if errors:
+            cursor.close()
+            conn.close()
+            return jsonify({'error': '盘点单有误，未做任何调整', 'errors': errors}), 400
+
+        changes = [(line['product_id'], line['book_stock'], line['counted'])
+                   for line in lines.values() if line['variance']]
+        if changes and not repo.apply_stocktake(cursor, changes, notes, created_by):
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return jsonify({'error': '盘点期间库存发生变动，请重新提交'}), 409
+        conn.commit()
+
+        cursor.close()
+        conn.close()
+
+        report = stocktake_payload(list(lines.values()))
+        report['message'] = '盘点完成'
+        return jsonify(report)
+
+    except Exception as e:
+        return error_response(e)
 
 
 # ==================== 销售统计API ====================
 @app.route('/api/statistics/sales', methods=['GET'])
+@conditional('sales_orders', 'customers')
 def get_sales_statistics():
     """获取销售统计"""
     try:
@@ -605,74 +1157,44 @@ def get_sales_statistics():
 
         cursor = conn.cursor(dictionary=True)
 
-        # 月度销售统计（如果有销售数据）
-        cursor.execute("""
-            SELECT 
-                DATE_FORMAT(order_date, '%Y-%m') as month,
-                COUNT(*) as order_count,
-                COALESCE(SUM(total_amount), 0) as total_amount,
-                COALESCE(AVG(total_amount), 0) as avg_order_amount
-            FROM sales_orders 
-            WHERE status = '已完成'
-            GROUP BY DATE_FORMAT(order_date, '%Y-%m')
-            ORDER BY month DESC
-            LIMIT 12
-        """)
-        monthly_stats = cursor.fetchall()
-
-        # 如果还没有销售数据，使用模拟数据
-        if not monthly_stats:
-            monthly_stats = [
-                {'month': '2024-03', 'order_count': 0, 'total_amount': 0, 'avg_order_amount': 0},
-                {'month': '2024-02', 'order_count': 0, 'total_amount': 0, 'avg_order_amount': 0},
-                {'month': '2024-01', 'order_count': 0, 'total_amount': 0, 'avg_order_amount': 0}
-            ]
-
-        # 产品类别销售统计
-        cursor.execute("""
-            SELECT 
-                p.material_type,
-                COALESCE(SUM(sod.quantity), 0) as total_quantity,
-                COALESCE(SUM(sod.total_price), 0) as total_amount,
-                COALESCE(COUNT(DISTINCT so.order_id), 0) as order_count
-            FROM products p
-            LEFT JOIN sales_order_details sod ON p.product_id = sod.product_id
-            LEFT JOIN sales_orders so ON sod.order_id = so.order_id AND so.status = '已完成'
-            GROUP BY p.material_type
-            ORDER BY total_amount DESC
-        """)
-        category_stats = cursor.fetchall()
-
-        # 客户销售排名
-        cursor.execute("""
-            SELECT 
-                c.customer_name,
-                c.customer_type,
-                COALESCE(COUNT(so.order_id), 0) as order_count,
-                COALESCE(SUM(so.total_amount), 0) as total_amount
-            FROM customers c
-            LEFT JOIN sales_orders so ON c.customer_id = so.customer_id AND so.status = '已完成'
-            GROUP BY c.customer_id
-            ORDER BY total_amount DESC
-            LIMIT 10
-        """)
-        customer_stats = cursor.fetchall()
+        stats = repo.sales_statistics(cursor)
 
         cursor.close()
         conn.close()
 
-        return jsonify({
-            'monthly': monthly_stats,
-            'by_category': category_stats,
-            'by_customer': customer_stats
-        })
+        return jsonify(sales_statistics_payload(*stats))
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+
+# ==================== 仪表盘API ====================
+@app.route('/api/dashboard', methods=['GET'])
+@conditional('products', 'sales_orders', 'purchase_orders', 'customers')
+@cached('products', 'sales_orders', 'purchase_orders', 'customers', ttl=DASHBOARD_CACHE_TTL)
+def get_dashboard():
+    """仪表盘：库存汇总、预警、待处理订单和销售统计，一个连接上查询完成"""
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': '数据库连接失败'}), 500
+
+        cursor = conn.cursor(dictionary=True)
+
+        dashboard = repo.dashboard(cursor)
+
+        cursor.close()
+        conn.close()
+
+        return jsonify(dashboard_payload(*dashboard))
+
+    except Exception as e:
+        return error_response(e)
 
 
 # ==================== 客户管理API ====================
 @app.route('/api/customers', methods=['GET'])
+@conditional('customers')
 def get_customers():
     """获取客户列表"""
     try:
@@ -683,53 +1205,21 @@ def get_customers():
         cursor = conn.cursor(dictionary=True)
 
         # 支持分页和筛选
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
-        offset = (page - 1) * limit
-        customer_type = request.args.get('customer_type', '')
-        status = request.args.get('status', '')
-        search = request.args.get('search', '')
-
-        query = "SELECT * FROM customers WHERE 1=1"
-        params = []
-
-        if customer_type:
-            query += " AND customer_type = %s"
-            params.append(customer_type)
-        if status:
-            query += " AND status = %s"
-            params.append(status)
-        if search:
-            query += " AND (customer_name LIKE %s OR customer_code LIKE %s OR contact_person LIKE %s)"
-            params.extend([f'%{search}%', f'%{search}%', f'%{search}%'])
-
-        # 获取总数
-        count_query = query.replace("SELECT *", "SELECT COUNT(*) as total")
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
-
-        # 获取分页数据
-        query += " ORDER BY customer_id DESC LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        cursor.execute(query, params)
-        customers = cursor.fetchall()
+        paging = page_args(request.args, repo.CUSTOMER_SORTS)
+        fields = fields_arg(request.args, repo.CUSTOMER_FIELDS)
+        result = repo.list_customers(cursor, paging, fields, **filter_args(request.args, CUSTOMER_FILTERS))
 
         cursor.close()
         conn.close()
 
-        return jsonify({
-            'data': customers,
-            'total': total,
-            'page': page,
-            'limit': limit,
-            'total_pages': (total + limit - 1) // limit
-        })
+        return jsonify(page_payload(result, paging))
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/customers', methods=['POST'])
+@writes('customers')
 def create_customer():
     """创建新客户"""
     try:
@@ -791,10 +1281,12 @@ def create_customer():
 
     except Exception as e:
         print("创建客户错误:", e)
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/customers/<int:customer_id>', methods=['GET'])
+@conditional('customers')
+@cached('customers')
 def get_customer(customer_id):
     """获取单个客户详情"""
     try:
@@ -803,8 +1295,8 @@ def get_customer(customer_id):
             return jsonify({'error': '数据库连接失败'}), 500
 
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM customers WHERE customer_id = %s", (customer_id,))
-        customer = cursor.fetchone()
+        fields = fields_arg(request.args, repo.CUSTOMER_FIELDS)
+        customer = repo.get_customer(cursor, customer_id, fields)
 
         cursor.close()
         conn.close()
@@ -815,11 +1307,12 @@ def get_customer(customer_id):
         return jsonify(customer)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 # ==================== 供应商管理API ====================
 @app.route('/api/suppliers', methods=['GET'])
+@conditional('suppliers')
 def get_suppliers():
     """获取供应商列表"""
     try:
@@ -830,53 +1323,21 @@ def get_suppliers():
         cursor = conn.cursor(dictionary=True)
 
         # 支持分页和筛选
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
-        offset = (page - 1) * limit
-        rating = request.args.get('rating', '')
-        status = request.args.get('status', '')
-        search = request.args.get('search', '')
-
-        query = "SELECT * FROM suppliers WHERE 1=1"
-        params = []
-
-        if rating:
-            query += " AND rating = %s"
-            params.append(rating)
-        if status:
-            query += " AND status = %s"
-            params.append(status)
-        if search:
-            query += " AND (supplier_name LIKE %s OR supplier_code LIKE %s OR contact_person LIKE %s)"
-            params.extend([f'%{search}%', f'%{search}%', f'%{search}%'])
-
-        # 获取总数
-        count_query = query.replace("SELECT *", "SELECT COUNT(*) as total")
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
-
-        # 获取分页数据
-        query += " ORDER BY supplier_id DESC LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        cursor.execute(query, params)
-        suppliers = cursor.fetchall()
+        paging = page_args(request.args, repo.SUPPLIER_SORTS)
+        fields = fields_arg(request.args, repo.SUPPLIER_FIELDS)
+        result = repo.list_suppliers(cursor, paging, fields, **filter_args(request.args, SUPPLIER_FILTERS))
 
         cursor.close()
         conn.close()
 
-        return jsonify({
-            'data': suppliers,
-            'total': total,
-            'page': page,
-            'limit': limit,
-            'total_pages': (total + limit - 1) // limit
-        })
+        return jsonify(page_payload(result, paging))
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/suppliers', methods=['POST'])
+@writes('suppliers')
 def create_supplier():
     """创建新供应商"""
     try:
@@ -937,10 +1398,12 @@ def create_supplier():
 
     except Exception as e:
         print("创建供应商错误:", e)
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/suppliers/<int:supplier_id>', methods=['GET'])
+@conditional('suppliers')
+@cached('suppliers')
 def get_supplier(supplier_id):
     """获取单个供应商详情"""
     try:
@@ -949,8 +1412,8 @@ def get_supplier(supplier_id):
             return jsonify({'error': '数据库连接失败'}), 500
 
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM suppliers WHERE supplier_id = %s", (supplier_id,))
-        supplier = cursor.fetchone()
+        fields = fields_arg(request.args, repo.SUPPLIER_FIELDS)
+        supplier = repo.get_supplier(cursor, supplier_id, fields)
 
         cursor.close()
         conn.close()
@@ -961,11 +1424,63 @@ def get_supplier(supplier_id):
         return jsonify(supplier)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+
+# ==================== 订单状态转换 ====================
+# 转换生效后在同一事务中执行的操作：动作 -> hook(cursor, 生效的订单ID)
+SALES_ORDER_HOOKS = {'cancel': repo.restore_sales_order_stock}
+
+
+def apply_transitions(machine, order_ids, action, version=None, hooks=None):
+    """在一个事务中转换订单状态，返回 (生效的订单ID, {没有生效的订单ID: (返回内容, 状态码)})
+
+    没有生效的订单由转换后读到的状态和版本构造错误。
+    """
+    hook = (hooks or {}).get(action)
+    with db_cursor(dictionary=True) as (conn, cursor):
+        try:
+            changed, rows = repo.transition_orders(cursor, machine, order_ids, action, version)
+            if changed and hook is not None:
+                hook(cursor, changed)
+            failed = sorted(set(order_ids) - set(changed))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return changed, {order_id: machine.error(action, rows.get(order_id), version) for order_id in failed}
+
+
+def transition_response(machine, order_id, action, message, hooks=None):
+    """单个订单的状态转换；If-Match / expected_version 指定期望的版本"""
+    version = expected_version(request.headers.get('If-Match'), request.get_json(silent=True))
+    _, errors = apply_transitions(machine, [order_id], action, version, hooks)
+    if errors:
+        payload, status = errors[order_id]
+        return jsonify(payload), status
+
+    payload = {'message': message, 'order_id': order_id, 'status': machine.target(action)}
+    if version is not None:
+        payload['version'] = version + 1
+    return jsonify(payload)
+
+
+def bulk_transition_response(machine, data, hooks=None):
+    """批量状态转换：各订单独立判断，能转换的全部生效，其余在 failed 中说明原因"""
+    action, order_ids = transition_args(data, machine.transitions)
+    changed, errors = apply_transitions(machine, order_ids, action, hooks=hooks)
+    return jsonify({
+        'action': action,
+        'status': machine.target(action),
+        'updated': changed,
+        'failed': [dict(payload, order_id=order_id, status_code=status)
+                   for order_id, (payload, status) in errors.items()]
+    })
 
 
 # ==================== 采购订单管理API ====================
 @app.route('/api/purchase/orders', methods=['GET'])
+@conditional('purchase_orders', 'purchase_order_details', 'suppliers', 'products')
 def get_purchase_orders():
     """获取采购订单列表"""
     try:
@@ -976,68 +1491,22 @@ def get_purchase_orders():
         cursor = conn.cursor(dictionary=True)
 
         # 支持分页和筛选
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
-        offset = (page - 1) * limit
-        status = request.args.get('status', '')
-        supplier_id = request.args.get('supplier_id', '')
-        search = request.args.get('search', '')
-
-        query = """
-            SELECT po.*, s.supplier_name 
-            FROM purchase_orders po
-            LEFT JOIN suppliers s ON po.supplier_id = s.supplier_id
-            WHERE 1=1
-        """
-        params = []
-
-        if status:
-            query += " AND po.status = %s"
-            params.append(status)
-        if supplier_id:
-            query += " AND po.supplier_id = %s"
-            params.append(supplier_id)
-        if search:
-            query += " AND po.order_number LIKE %s"
-            params.append(f'%{search}%')
-
-        # 获取总数
-        count_query = query.replace("SELECT po.*, s.supplier_name", "SELECT COUNT(*) as total")
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
-
-        # 获取分页数据
-        query += " ORDER BY po.order_id DESC LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        cursor.execute(query, params)
-        orders = cursor.fetchall()
-
-        # 获取每个订单的明细
-        for order in orders:
-            cursor.execute("""
-                SELECT pod.*, p.product_code, p.product_name 
-                FROM purchase_order_details pod
-                JOIN products p ON pod.product_id = p.product_id
-                WHERE pod.order_id = %s
-            """, (order['order_id'],))
-            order['items'] = cursor.fetchall()
+        paging = page_args(request.args, repo.PURCHASE_ORDER_SORTS)
+        fields = fields_arg(request.args, repo.PURCHASE_ORDER_FIELDS)
+        result = repo.list_purchase_orders(cursor, paging, include_arg(request.args), fields,
+                                           **filter_args(request.args, PURCHASE_ORDER_FILTERS))
 
         cursor.close()
         conn.close()
 
-        return jsonify({
-            'data': orders,
-            'total': total,
-            'page': page,
-            'limit': limit,
-            'total_pages': (total + limit - 1) // limit
-        })
+        return jsonify(page_payload(result, paging))
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/purchase/orders/pending', methods=['GET'])
+@conditional('purchase_orders')
 def get_pending_purchase_orders():
     """获取待处理采购订单"""
     try:
@@ -1046,25 +1515,22 @@ def get_pending_purchase_orders():
             return jsonify({'error': '数据库连接失败'}), 500
 
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT COUNT(*) as count 
-            FROM purchase_orders 
-            WHERE status IN ('待审核', '已批准', '已发货')
-        """)
-        result = cursor.fetchone()
+        pending_count = repo.count_pending_purchase_orders(cursor)
 
         cursor.close()
         conn.close()
 
         return jsonify({
-            'pending_count': result['count'] if result else 0
+            'pending_count': pending_count
         })
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/purchase/orders', methods=['POST'])
+@writes('purchase_orders', 'purchase_order_details', 'products', 'inventory_transactions')
+@idempotent
 def create_purchase_order():
     """创建采购订单"""
     try:
@@ -1087,7 +1553,7 @@ def create_purchase_order():
         cursor = conn.cursor()
 
         # 生成订单号
-        order_number = f"PO-{datetime.now().strftime('%Y%m%d')}-{str(random.randint(1000, 9999))}"
+        order_number = order_numbers.next('PO')
 
         # 插入采购订单
         query = """
@@ -1142,10 +1608,11 @@ def create_purchase_order():
 
     except Exception as e:
         print("创建采购订单错误:", e)
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/purchase/orders/<int:order_id>', methods=['GET'])
+@conditional('purchase_orders', 'purchase_order_details', 'suppliers', 'products')
 def get_purchase_order(order_id):
     """获取单个采购订单详情"""
     try:
@@ -1155,134 +1622,54 @@ def get_purchase_order(order_id):
 
         cursor = conn.cursor(dictionary=True)
 
-        # 获取订单基本信息
-        cursor.execute("""
-            SELECT po.*, s.supplier_name, s.supplier_code 
-            FROM purchase_orders po
-            LEFT JOIN suppliers s ON po.supplier_id = s.supplier_id
-            WHERE po.order_id = %s
-        """, (order_id,))
-        order = cursor.fetchone()
-
-        if not order:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': '采购订单不存在'}), 404
-
-        # 获取订单明细
-        cursor.execute("""
-            SELECT pod.*, p.product_code, p.product_name, p.specification
-            FROM purchase_order_details pod
-            JOIN products p ON pod.product_id = p.product_id
-            WHERE pod.order_id = %s
-        """, (order_id,))
-        order['items'] = cursor.fetchall()
+        fields = fields_arg(request.args, repo.PURCHASE_ORDER_FIELDS)
+        order = repo.get_purchase_order(cursor, order_id, fields)
 
         cursor.close()
         conn.close()
 
+        if not order:
+            return jsonify({'error': '采购订单不存在'}), 404
+
         return jsonify(order)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/purchase/orders/<int:order_id>/approve', methods=['PUT'])
+@writes('purchase_orders')
 def approve_purchase_order(order_id):
     """审核通过采购订单"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': '数据库连接失败'}), 500
-
-        cursor = conn.cursor()
-
-        # 检查订单是否存在
-        cursor.execute("SELECT status FROM purchase_orders WHERE order_id = %s", (order_id,))
-        result = cursor.fetchone()
-
-        if not result:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': '采购订单不存在'}), 404
-
-        current_status = result[0]
-        if current_status != '待审核':
-            cursor.close()
-            conn.close()
-            return jsonify({'error': f'订单当前状态为{current_status}，无法审核'}), 400
-
-        # 更新订单状态
-        cursor.execute("""
-            UPDATE purchase_orders 
-            SET status = '已批准', updated_at = CURRENT_TIMESTAMP 
-            WHERE order_id = %s
-        """, (order_id,))
-
-        conn.commit()
-
-        cursor.close()
-        conn.close()
-
-        return jsonify({
-            'message': '采购订单审核通过',
-            'order_id': order_id,
-            'status': '已批准'
-        })
-
+        return transition_response(PURCHASE_ORDER_STATES, order_id, 'approve', '采购订单审核通过')
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/purchase/orders/<int:order_id>/cancel', methods=['PUT'])
+@writes('purchase_orders')
 def cancel_purchase_order(order_id):
     """取消采购订单"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': '数据库连接失败'}), 500
-
-        cursor = conn.cursor()
-
-        # 检查订单是否存在
-        cursor.execute("SELECT status FROM purchase_orders WHERE order_id = %s", (order_id,))
-        result = cursor.fetchone()
-
-        if not result:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': '采购订单不存在'}), 404
-
-        current_status = result[0]
-        if current_status in ['已完成', '已取消']:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': f'订单当前状态为{current_status}，无法取消'}), 400
-
-        # 更新订单状态
-        cursor.execute("""
-            UPDATE purchase_orders 
-            SET status = '已取消', updated_at = CURRENT_TIMESTAMP 
-            WHERE order_id = %s
-        """, (order_id,))
-
-        conn.commit()
-
-        cursor.close()
-        conn.close()
+        return transition_response(PURCHASE_ORDER_STATES, order_id, 'cancel', '采购订单已取消')
+    except Exception as e:
+        return error_response(e)
 
-        return jsonify({
-            'message': '采购订单已取消',
-            'order_id': order_id,
-            'status': '已取消'
-        })
 
+@app.route('/api/purchase/orders/transitions', methods=['POST'])
+@writes('purchase_orders')
+def transition_purchase_orders():
+    """批量审核或取消采购订单：{"action": "approve" | "cancel", "order_ids": [...]}"""
+    try:
+        return bulk_transition_response(PURCHASE_ORDER_STATES, request.json)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 # ==================== 销售订单管理API ====================
 @app.route('/api/sales/orders', methods=['GET'])
+@conditional('sales_orders', 'sales_order_details', 'customers', 'products')
 def get_sales_orders():
     """获取销售订单列表"""
     try:
@@ -1293,72 +1680,22 @@ def get_sales_orders():
         cursor = conn.cursor(dictionary=True)
 
         # 支持分页和筛选
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
-        offset = (page - 1) * limit
-        status = request.args.get('status', '')
-        customer_id = request.args.get('customer_id', '')
-        payment_status = request.args.get('payment_status', '')
-        search = request.args.get('search', '')
-
-        query = """
-            SELECT so.*, c.customer_name 
-            FROM sales_orders so
-            LEFT JOIN customers c ON so.customer_id = c.customer_id
-            WHERE 1=1
-        """
-        params = []
-
-        if status:
-            query += " AND so.status = %s"
-            params.append(status)
-        if customer_id:
-            query += " AND so.customer_id = %s"
-            params.append(customer_id)
-        if payment_status:
-            query += " AND so.payment_status = %s"
-            params.append(payment_status)
-        if search:
-            query += " AND so.order_number LIKE %s"
-            params.append(f'%{search}%')
-
-        # 获取总数
-        count_query = query.replace("SELECT so.*, c.customer_name", "SELECT COUNT(*) as total")
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
-
-        # 获取分页数据
-        query += " ORDER BY so.order_id DESC LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        cursor.execute(query, params)
-        orders = cursor.fetchall()
-
-        # 获取每个订单的明细
-        for order in orders:
-            cursor.execute("""
-                SELECT sod.*, p.product_code, p.product_name 
-                FROM sales_order_details sod
-                JOIN products p ON sod.product_id = p.product_id
-                WHERE sod.order_id = %s
-            """, (order['order_id'],))
-            order['items'] = cursor.fetchall()
+        paging = page_args(request.args, repo.SALES_ORDER_SORTS)
+        fields = fields_arg(request.args, repo.SALES_ORDER_FIELDS)
+        result = repo.list_sales_orders(cursor, paging, include_arg(request.args), fields,
+                                        **filter_args(request.args, SALES_ORDER_FILTERS))
 
         cursor.close()
         conn.close()
 
-        return jsonify({
-            'data': orders,
-            'total': total,
-            'page': page,
-            'limit': limit,
-            'total_pages': (total + limit - 1) // limit
-        })
+        return jsonify(page_payload(result, paging))
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/sales/orders/pending', methods=['GET'])
+@conditional('sales_orders')
 def get_pending_sales_orders():
     """获取待处理销售订单"""
     try:
@@ -1367,25 +1704,22 @@ def get_pending_sales_orders():
             return jsonify({'error': '数据库连接失败'}), 500
 
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT COUNT(*) as count 
-            FROM sales_orders 
-            WHERE status IN ('待处理', '已确认', '发货中')
-        """)
-        result = cursor.fetchone()
+        pending_count = repo.count_pending_sales_orders(cursor)
 
         cursor.close()
         conn.close()
 
         return jsonify({
-            'pending_count': result['count'] if result else 0
+            'pending_count': pending_count
         })
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/sales/orders', methods=['POST'])
+@writes('sales_orders', 'sales_order_details', 'products', 'inventory_transactions')
+@idempotent
 def create_sales_order():
     """创建销售订单"""
     try:
@@ -1398,29 +1732,13 @@ def create_sales_order():
             if field not in data:
                 return jsonify({'error': f'缺少必要字段: {field}'}), 400
 
-        if not data['items'] or len(data['items']) == 0:
-            return jsonify({'error': '销售订单必须包含至少一个项目'}), 400
-
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': '数据库连接失败'}), 500
-
-        cursor = conn.cursor()
+        items = order_items(data['items'])
 
         # 生成订单号
-        order_number = f"SO-{datetime.now().strftime('%Y%m%d')}-{str(random.randint(1000, 9999))}"
-
-        # 插入销售订单
-        query = """
-            INSERT INTO sales_orders (
-                order_number, customer_id, order_date, 
-                delivery_date, total_amount, status, 
-                payment_status, payment_method, notes, created_by
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
+        order_number = order_numbers.next('SO')
 
         # 计算订单总额
-        total_amount = sum(item['quantity'] * item['unit_price'] for item in data['items'])
+        total_amount = sum(quantity * unit_price for _, quantity, unit_price in items)
 
         values = (
             order_number,
@@ -1435,56 +1753,41 @@ def create_sales_order():
             data.get('created_by', 'admin')
         )
 
-        cursor.execute(query, values)
-        order_id = cursor.lastrowid
+        # 热门产品先由合并器批量扣减（已提交），订单事务失败时退回；
+        # 在借出连接之前扣减，等待合并批次时不占用连接
+        reserved = stock_coalescer.reserve(items) if stock_coalescer is not None else {}
 
-        # 插入销售订单明细
-        for item in data['items']:
-            cursor.execute("""
-                INSERT INTO sales_order_details (
-                    order_id, product_id, quantity, unit_price
-                ) VALUES (%s, %s, %s, %s)
-            """, (
-                order_id,
-                item['product_id'],
-                item['quantity'],
-                item['unit_price']
-            ))
+        conn = get_db_connection()
+        if not conn:
+            if reserved:
+                stock_coalescer.release(reserved)
+            return jsonify({'error': '数据库连接失败'}), 500
 
-            # 更新产品库存（检查库存是否充足）
-            cursor.execute("SELECT current_stock FROM products WHERE product_id = %s", (item['product_id'],))
-            current_stock = cursor.fetchone()[0]
+        cursor = conn.cursor(dictionary=True)
 
-            if current_stock < item['quantity']:
+        # 订单、明细、库存扣减和出库流水各一条语句，库存不足时整单回滚
+        order_id = None
+        if reserved is not None:
+            try:
+                order_id = repo.place_sales_order(cursor, values, items, reserved)
+                if order_id is not None:
+                    conn.commit()
+            except Exception:
                 conn.rollback()
-                cursor.close()
-                conn.close()
-                return jsonify({'error': f'产品ID {item["product_id"]} 库存不足'}), 400
-
-            # 扣减库存
-            cursor.execute("""
-                UPDATE products 
-                SET current_stock = current_stock - %s, 
-                    updated_at = CURRENT_TIMESTAMP 
-                WHERE product_id = %s
-            """, (item['quantity'], item['product_id']))
-
-            # 记录库存变动
-            cursor.execute("""
-                INSERT INTO inventory_transactions (
-                    product_id, transaction_type, quantity_change,
-                    quantity_before, quantity_after, notes
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                item['product_id'],
-                '销售出库',
-                -item['quantity'],
-                current_stock,
-                current_stock - item['quantity'],
-                f'销售订单: {order_number}'
-            ))
-
-        conn.commit()
+                if reserved:
+                    stock_coalescer.release(reserved)
+                raise
+        if order_id is None:
+            conn.rollback()
+            if reserved:
+                stock_coalescer.release(reserved)
+            shortages = repo.stock_shortages(cursor, items)
+            cursor.close()
+            conn.close()
+            return jsonify({
+                'error': '库存不足：' + '、'.join(f'产品ID {row["product_id"]}' for row in shortages),
+                'shortages': shortages
+            }), 400
 
         cursor.close()
         conn.close()
@@ -1498,10 +1801,11 @@ def create_sales_order():
 
     except Exception as e:
         print("创建销售订单错误:", e)
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/sales/orders/<int:order_id>', methods=['GET'])
+@conditional('sales_orders', 'sales_order_details', 'customers', 'products')
 def get_sales_order(order_id):
     """获取单个销售订单详情"""
     try:
@@ -1511,171 +1815,55 @@ def get_sales_order(order_id):
 
         cursor = conn.cursor(dictionary=True)
 
-        # 获取订单基本信息
-        cursor.execute("""
-            SELECT so.*, c.customer_name, c.customer_code 
-            FROM sales_orders so
-            LEFT JOIN customers c ON so.customer_id = c.customer_id
-            WHERE so.order_id = %s
-        """, (order_id,))
-        order = cursor.fetchone()
-
-        if not order:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': '销售订单不存在'}), 404
-
-        # 获取订单明细
-        cursor.execute("""
-            SELECT sod.*, p.product_code, p.product_name, p.specification
-            FROM sales_order_details sod
-            JOIN products p ON sod.product_id = p.product_id
-            WHERE sod.order_id = %s
-        """, (order_id,))
-        order['items'] = cursor.fetchall()
+        fields = fields_arg(request.args, repo.SALES_ORDER_FIELDS)
+        order = repo.get_sales_order(cursor, order_id, fields)
 
         cursor.close()
         conn.close()
 
+        if not order:
+            return jsonify({'error': '销售订单不存在'}), 404
+
         return jsonify(order)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/sales/orders/<int:order_id>/confirm', methods=['PUT'])
+@writes('sales_orders')
 def confirm_sales_order(order_id):
     """确认销售订单"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': '数据库连接失败'}), 500
-
-        cursor = conn.cursor()
-
-        # 检查订单是否存在
-        cursor.execute("SELECT status FROM sales_orders WHERE order_id = %s", (order_id,))
-        result = cursor.fetchone()
-
-        if not result:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': '销售订单不存在'}), 404
-
-        current_status = result[0]
-        if current_status != '待处理':
-            cursor.close()
-            conn.close()
-            return jsonify({'error': f'订单当前状态为{current_status}，无法确认'}), 400
-
-        # 更新订单状态
-        cursor.execute("""
-            UPDATE sales_orders 
-            SET status = '已确认', updated_at = CURRENT_TIMESTAMP 
-            WHERE order_id = %s
-        """, (order_id,))
-
-        conn.commit()
-
-        cursor.close()
-        conn.close()
-
-        return jsonify({
-            'message': '销售订单已确认',
-            'order_id': order_id,
-            'status': '已确认'
-        })
-
+        return transition_response(SALES_ORDER_STATES, order_id, 'confirm', '销售订单已确认')
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/sales/orders/<int:order_id>/cancel', methods=['PUT'])
+@writes('sales_orders', 'products', 'inventory_transactions')
 def cancel_sales_order(order_id):
-    """取消销售订单"""
+    """取消销售订单并恢复库存"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': '数据库连接失败'}), 500
-
-        cursor = conn.cursor()
-
-        # 检查订单是否存在
-        cursor.execute("SELECT status FROM sales_orders WHERE order_id = %s", (order_id,))
-        result = cursor.fetchone()
-
-        if not result:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': '销售订单不存在'}), 404
-
-        current_status = result[0]
-        if current_status in ['已完成', '已取消']:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': f'订单当前状态为{current_status}，无法取消'}), 400
-
-        # 恢复库存
-        cursor.execute("""
-            SELECT sod.product_id, sod.quantity, p.current_stock
-            FROM sales_order_details sod
-            JOIN products p ON sod.product_id = p.product_id
-            WHERE sod.order_id = %s
-        """, (order_id,))
-        order_items = cursor.fetchall()
-
-        for item in order_items:
-            product_id = item[0]
-            quantity = item[1]
-            current_stock = item[2]
-
-            # 恢复库存
-            cursor.execute("""
-                UPDATE products 
-                SET current_stock = current_stock + %s, 
-                    updated_at = CURRENT_TIMESTAMP 
-                WHERE product_id = %s
-            """, (quantity, product_id))
-
-            # 记录库存变动
-            cursor.execute("""
-                INSERT INTO inventory_transactions (
-                    product_id, transaction_type, quantity_change,
-                    quantity_before, quantity_after, notes
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                product_id,
-                '库存调整',
-                quantity,
-                current_stock,
-                current_stock + quantity,
-                f'销售订单取消恢复库存: {order_id}'
-            ))
-
-        # 更新订单状态
-        cursor.execute("""
-            UPDATE sales_orders 
-            SET status = '已取消', updated_at = CURRENT_TIMESTAMP 
-            WHERE order_id = %s
-        """, (order_id,))
-
-        conn.commit()
-
-        cursor.close()
-        conn.close()
+        return transition_response(SALES_ORDER_STATES, order_id, 'cancel', '销售订单已取消', SALES_ORDER_HOOKS)
+    except Exception as e:
+        return error_response(e)
 
-        return jsonify({
-            'message': '销售订单已取消',
-            'order_id': order_id,
-            'status': '已取消'
-        })
 
+@app.route('/api/sales/orders/transitions', methods=['POST'])
+@writes('sales_orders', 'products', 'inventory_transactions')
+def transition_sales_orders():
+    """批量确认或取消销售订单：{"action": "confirm" | "cancel", "order_ids": [...]}，取消的订单恢复库存"""
+    try:
+        return bulk_transition_response(SALES_ORDER_STATES, request.json, SALES_ORDER_HOOKS)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 # ==================== 产品类别API ====================
 @app.route('/api/categories', methods=['GET'])
+@conditional('product_categories')
+@cached('product_categories')
 def get_categories():
     """获取产品类别列表"""
     try:
@@ -1684,8 +1872,7 @@ def get_categories():
             return jsonify({'error': '数据库连接失败'}), 500
 
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM product_categories ORDER BY category_id")
-        categories = cursor.fetchall()
+        categories = repo.list_categories(cursor)
 
         cursor.close()
         conn.close()
@@ -1693,7 +1880,35 @@ def get_categories():
         return jsonify(categories)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+
+# ==================== 命令行 ====================
+@app.cli.command('rebuild-sales-summary')
+def rebuild_sales_summary():
+    """按已完成订单重建销售统计汇总表：flask --app app rebuild-sales-summary"""
+    with db_cursor() as (conn, cursor):
+        try:
+            counts = repo.rebuild_sales_summary(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    for table, rows in counts.items():
+        print(f"{table}: {rows} 行")
+
+
+@app.cli.command('rebuild-stock-alerts')
+def rebuild_stock_alerts():
+    """按当前库存重建库存预警表：flask --app app rebuild-stock-alerts"""
+    with db_cursor() as (conn, cursor):
+        try:
+            count = repo.rebuild_stock_alerts(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    print(f"stock_alerts: {count} 行")
 
 
 # ==================== 运行应用 ====================
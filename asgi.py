@@ -0,0 +1,611 @@
+"""异步服务模式（ASGI）
+
+    uvicorn asgi:application --host 127.0.0.1 --port 5000
+
+GET 接口由协程直接处理，一个进程可以同时挂起大量请求而不占用线程：
+- MySQL 使用 aiomysql 异步连接池（需要 pip install aiomysql）
+- SQLite 没有异步驱动，语句在专用的有界线程池中执行
+查询和参数解析与 Flask 路由共用 repository.py / api_utils.py。
+
+范围：只有读接口是异步的。写接口（POST/PUT/DELETE，包括创建订单）以及未在这里声明的
+路由仍由 app.py 中的同步 Flask 应用处理，在有界线程池（ASGI_THREADS，默认等于同步连接池
+大小）中执行，事务、校验、幂等键和读你所写窗口与同步模式完全一致。同时执行的写请求
+不超过 ASGI_THREADS 个，其余在事件循环中排队等待（不占线程）；写入吞吐与同步模式相同，
+异步模式提升的是大量并发读请求（仪表盘、列表、详情）的承载能力。
+"""
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import http_date
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from api_utils import (CUSTOMER_FILTERS, PRODUCT_FILTERS, PURCHASE_ORDER_FILTERS, SALES_ORDER_FILTERS,
+                       SUPPLIER_FILTERS, dashboard_payload, error_payload, fields_arg, filter_args,
+                       include_arg, page_args, page_payload, sales_statistics_payload, suggest_args)
+from app import (DASHBOARD_CACHE_TTL, app as flask_app, db_backend, db_pool, pool_config, product_index,
+                 replica_router, repo, response_cache, table_versions)
+from cache import cache_key, cached, conditional, not_modified, validators
+from db_pool import PoolTimeout
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+# 转交给 Flask 的请求在这个线程池中执行
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ASGI_THREADS', pool_config['pool_size'])),
+                              thread_name_prefix='asgi')
+
+
+# ==================== 异步连接池 ====================
+class Lease:
+    """借出的连接及其游标"""
+    __slots__ = ('conn', 'cursor')
+
+    def __init__(self, conn, cursor):
+        self.conn = conn
+        self.cursor = cursor
+
+
+class AioMySQLPool:
+    """aiomysql 连接池
+
+    只用于只读请求，连接设为 autocommit，归还时不会残留事务快照。
+    pool_recycle 对应同步连接池的 max_lifetime。
+    """
+
+    def __init__(self, config, pool_size=10, borrow_timeout=5.0, max_lifetime=1800, **kwargs):
+        if aiomysql is None:
+            raise RuntimeError('异步模式连接 MySQL 需要安装 aiomysql')
+        self.config = config
+        self.pool_size = pool_size
+        self.borrow_timeout = borrow_timeout
+        self.max_lifetime = max_lifetime
+        self._pool = None
+        self._waiters = 0
+        self._stats = {'borrowed': 0, 'timeouts': 0, 'wait_time_total': 0.0, 'wait_time_max': 0.0}
+
+    async def start(self):
+        self._pool = await aiomysql.create_pool(
+            host=self.config['host'],
+            port=self.config['port'],
+            user=self.config['user'],
+            password=self.config['password'],
+            db=self.config['database'],
+            minsize=1,
+            maxsize=self.pool_size,
+            pool_recycle=int(self.max_lifetime),
+            autocommit=True,
+            charset='utf8mb4'
+        )
+
+    async def _acquire(self):
+        return await self._pool.acquire()
+
+    async def acquire(self):
+        start = time.monotonic()
+        self._waiters += 1
+        try:
+            conn = await asyncio.wait_for(self._acquire(), self.borrow_timeout)
+        except asyncio.TimeoutError:
+            self._stats['timeouts'] += 1
+            raise PoolTimeout(f'{self.borrow_timeout:g} 秒内未能获取数据库连接（连接池大小 {self.pool_size}）')
+        finally:
+            self._waiters -= 1
+        waited = time.monotonic() - start
+        self._stats['borrowed'] += 1
+        self._stats['wait_time_total'] += waited
+        self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+        return Lease(conn, await conn.cursor(aiomysql.DictCursor))
+
+    async def release(self, lease):
+        await lease.cursor.close()
+        self._pool.release(lease.conn)
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats.update({
+            'pool_size': self.pool_size,
+            'open': self._pool.size if self._pool else 0,
+            'idle': self._pool.freesize if self._pool else 0,
+            'in_use': (self._pool.size - self._pool.freesize) if self._pool else 0,
+            'waiters': self._waiters
+        })
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['borrowed'] if stats['borrowed'] else 0.0
+        return stats
+
+
+class ThreadedCursor:
+    """把同步游标的调用放到线程池执行，提供协程接口"""
+
+    def __init__(self, cursor, executor):
+        self._cur = cursor
+        self._executor = executor
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def execute(self, sql, params=None):
+        await self._run(self._cur.execute, sql, params)
+
+    async def executemany(self, sql, seq_params):
+        await self._run(self._cur.executemany, sql, seq_params)
+
+    async def fetchone(self):
+        return await self._run(self._cur.fetchone)
+
+    async def fetchall(self):
+        return await self._run(self._cur.fetchall)
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+
+class ThreadedPool:
+    """没有异步驱动的后端（SQLite）：复用其同步连接池，调用在专用线程池中执行
+
+    借出数量先用信号量限制在连接池大小以内，等待连接的协程不占用线程，
+    持有连接的协程总能拿到线程执行语句，不会因线程耗尽而互相等待。
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.borrow_timeout = backend.pool.borrow_timeout
+        self._slots = asyncio.Semaphore(backend.pool.pool_size)
+        self._executor = ThreadPoolExecutor(max_workers=backend.pool.pool_size,
+                                            thread_name_prefix=f'asgi-{backend.name}')
+
+    async def start(self):
+        pass
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.borrow_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f'{self.borrow_timeout:g} 秒内未能获取数据库连接')
+        try:
+            conn = await asyncio.get_running_loop().run_in_executor(self._executor, self.backend.pool.acquire)
+        except BaseException:
+            self._slots.release()
+            raise
+        return Lease(conn, ThreadedCursor(conn.cursor(dictionary=True), self._executor))
+
+    async def release(self, lease):
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, lease.conn.close)
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        return self.backend.pool.stats()
+
+
+def async_pool_for(backend):
+    if backend.name == 'mysql':
+        return AioMySQLPool(backend.config, **pool_config)
+    return ThreadedPool(backend)
+
+
+# 主库和各从库对应的异步连接池，在 lifespan startup 中创建
+async_pools = {}
+
+
+@asynccontextmanager
+async def read_cursor(client):
+    """只读游标：按读写分离规则选择从库或主库，从库借连接失败时回退主库"""
+    backend = db_backend
+    if replica_router.replicas:
+        # 从库延迟检查会访问数据库，放到线程池里避免阻塞事件循环
+        backend = await asyncio.get_running_loop().run_in_executor(
+            executor, replica_router.read_backend, client)
+
+    pool = async_pools[id(backend)]
+    try:
+        lease = await pool.acquire()
+    except Exception as e:
+        if backend is db_backend:
+            raise
+        replica_router.mark_unhealthy(backend, e)
+        pool = async_pools[id(db_backend)]
+        lease = await pool.acquire()
+
+    try:
+        yield lease.cursor
+    finally:
+        await pool.release(lease)
+
+
+# ==================== 路由 ====================
+class Request:
+    def __init__(self, scope):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+
+    @property
+    def client(self):
+        """与 app.client_key() 一致的客户端标识"""
+        client = self.scope.get('client')
+        return self.headers.get('x-client-id') or (client[0] if client else None)
+
+
+class Router:
+    """GET 路由表，路径参数语法与 Flask 相同（<int:name>）"""
+
+    def __init__(self):
+        self.routes = []
+
+    def get(self, pattern):
+        regex = '^' + re.sub(r'<int:(\w+)>', r'(?P<\1>\\d+)', pattern) + '$'
+
+        def decorator(handler):
+            self.routes.append((re.compile(regex), handler))
+            return handler
+        return decorator
+
+    def match(self, method, path):
+        if method != 'GET':
+            return None, None
+        for regex, handler in self.routes:
+            m = regex.match(path)
+            if m:
+                return handler, {k: int(v) for k, v in m.groupdict().items()}
+        return None, None
+
+
+routes = Router()
+
+
+@routes.get('/api/products')
+@conditional('products')
+async def get_products(req, cursor):
+    paging = page_args(req.args, repo.PRODUCT_SORTS)
+    fields = fields_arg(req.args, repo.PRODUCT_FIELDS)
+    result = await repo.list_products(cursor, paging, fields, **filter_args(req.args, PRODUCT_FILTERS))
+    return page_payload(result, paging)
+
+
+@routes.get('/api/products/<int:product_id>')
+@conditional('products')
+@cached('products')
+async def get_product(req, cursor, product_id):
+    fields = fields_arg(req.args, repo.PRODUCT_FIELDS)
+    product = await repo.get_product(cursor, product_id, fields)
+    if not product:
+        return {'error': '产品不存在'}, 404
+    return product
+
+
+@routes.get('/api/inventory/alerts')
+@conditional('products')
+@cached('products')
+async def get_stock_alerts(req, cursor):
+    return await repo.stock_alerts(cursor)
+
+
+@routes.get('/api/inventory/transactions')
+@conditional('inventory_transactions', 'products')
+async def get_inventory_transactions(req, cursor):
+    limit = int(req.args.get('limit', 50))
+    return await repo.list_inventory_transactions(cursor, limit, product_id=req.args.get('product_id'))
+
+
+@routes.get('/api/statistics/sales')
+@conditional('sales_orders', 'customers')
+async def get_sales_statistics(req, cursor):
+    return sales_statistics_payload(*await repo.sales_statistics(cursor))
+
+
+@routes.get('/api/dashboard')
+@conditional('products', 'sales_orders', 'purchase_orders', 'customers')
+@cached('products', 'sales_orders', 'purchase_orders', 'customers', ttl=DASHBOARD_CACHE_TTL)
+async def get_dashboard(req, cursor):
+    return dashboard_payload(*await repo.dashboard(cursor))
+
+
+@routes.get('/api/customers')
+@conditional('customers')
+async def get_customers(req, cursor):
+    paging = page_args(req.args, repo.CUSTOMER_SORTS)
+    fields = fields_arg(req.args, repo.CUSTOMER_FIELDS)
+    result = await repo.list_customers(cursor, paging, fields, **filter_args(req.args, CUSTOMER_FILTERS))
+    return page_payload(result, paging)
+
+
+@routes.get('/api/customers/<int:customer_id>')
+@conditional('customers')
+@cached('customers')
+async def get_customer(req, cursor, customer_id):
+    fields = fields_arg(req.args, repo.CUSTOMER_FIELDS)
+    customer = await repo.get_customer(cursor, customer_id, fields)
+    if not customer:
+        return {'error': '客户不存在'}, 404
+    return customer
+
+
+@routes.get('/api/suppliers')
+@conditional('suppliers')
+async def get_suppliers(req, cursor):
+    paging = page_args(req.args, repo.SUPPLIER_SORTS)
+    fields = fields_arg(req.args, repo.SUPPLIER_FIELDS)
+    result = await repo.list_suppliers(cursor, paging, fields, **filter_args(req.args, SUPPLIER_FILTERS))
+    return page_payload(result, paging)
+
+
+@routes.get('/api/suppliers/<int:supplier_id>')
+@conditional('suppliers')
+@cached('suppliers')
+async def get_supplier(req, cursor, supplier_id):
+    fields = fields_arg(req.args, repo.SUPPLIER_FIELDS)
+    supplier = await repo.get_supplier(cursor, supplier_id, fields)
+    if not supplier:
+        return {'error': '供应商不存在'}, 404
+    return supplier
+
+
+@routes.get('/api/purchase/orders')
+@conditional('purchase_orders', 'purchase_order_details', 'suppliers', 'products')
+async def get_purchase_orders(req, cursor):
+    paging = page_args(req.args, repo.PURCHASE_ORDER_SORTS)
+    fields = fields_arg(req.args, repo.PURCHASE_ORDER_FIELDS)
+    result = await repo.list_purchase_orders(cursor, paging, include_arg(req.args), fields,
+                                             **filter_args(req.args, PURCHASE_ORDER_FILTERS))
+    return page_payload(result, paging)
+
+
+@routes.get('/api/purchase/orders/pending')
+@conditional('purchase_orders')
+async def get_pending_purchase_orders(req, cursor):
+    return {'pending_count': await repo.count_pending_purchase_orders(cursor)}
+
+
+@routes.get('/api/purchase/orders/<int:order_id>')
+@conditional('purchase_orders', 'purchase_order_details', 'suppliers', 'products')
+async def get_purchase_order(req, cursor, order_id):
+    fields = fields_arg(req.args, repo.PURCHASE_ORDER_FIELDS)
+    order = await repo.get_purchase_order(cursor, order_id, fields)
+    if not order:
+        return {'error': '采购订单不存在'}, 404
+    return order
+
+
+@routes.get('/api/sales/orders')
+@conditional('sales_orders', 'sales_order_details', 'customers', 'products')
+async def get_sales_orders(req, cursor):
+    paging = page_args(req.args, repo.SALES_ORDER_SORTS)
+    fields = fields_arg(req.args, repo.SALES_ORDER_FIELDS)
+    result = await repo.list_sales_orders(cursor, paging, include_arg(req.args), fields,
+                                          **filter_args(req.args, SALES_ORDER_FILTERS))
+    return page_payload(result, paging)
+
+
+@routes.get('/api/sales/orders/pending')
+@conditional('sales_orders')
+async def get_pending_sales_orders(req, cursor):
+    return {'pending_count': await repo.count_pending_sales_orders(cursor)}
+
+
+@routes.get('/api/sales/orders/<int:order_id>')
+@conditional('sales_orders', 'sales_order_details', 'customers', 'products')
+async def get_sales_order(req, cursor, order_id):
+    fields = fields_arg(req.args, repo.SALES_ORDER_FIELDS)
+    order = await repo.get_sales_order(cursor, order_id, fields)
+    if not order:
+        return {'error': '销售订单不存在'}, 404
+    return order
+
+
+@routes.get('/api/categories')
+@conditional('product_categories')
+@cached('product_categories')
+async def get_categories(req, cursor):
+    return await repo.list_categories(cursor)
+
+
+# ==================== ASGI 应用 ====================
+JSON_HEADERS = [
+    (b'content-type', b'application/json'),
+    (b'access-control-allow-origin', b'*')
+]
+
+
+def json_body(payload):
+    """与 Flask jsonify 相同的序列化结果，两种模式的响应缓存可以共用"""
+    return (flask_app.json.dumps(payload) + '\n').encode('utf-8')
+
+
+async def send_body(send, body, status=200, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': JSON_HEADERS + list(headers) + [(b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, payload, status=200):
+    await send_body(send, json_body(payload), status)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def call_flask(scope, receive, send):
+    """把请求转交给同步的 Flask 应用，在线程池中执行（写接口都走这里）"""
+    body = await read_body(receive)
+    builder = EnvironBuilder(
+        path=scope['path'],
+        method=scope['method'],
+        query_string=scope.get('query_string', b'').decode('latin-1'),
+        headers=[(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope.get('headers', [])],
+        data=body
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    app_iter, status, headers = await asyncio.get_running_loop().run_in_executor(
+        executor, partial(run_wsgi_app, flask_app.wsgi_app, environ, True))
+    await send({
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()]
+    })
+    await send({'type': 'http.response.body', 'body': b''.join(app_iter)})
+
+
+async def pool_stats(req):
+    """异步模式下的连接池指标：异步连接池 + Flask 写请求使用的同步连接池"""
+    stats = async_pools[id(db_backend)].stats()
+    stats['sync'] = db_pool.stats()
+    stats['routing'] = replica_router.stats()
+    return stats
+
+
+async def suggest_products(req):
+    """产品联想：索引有效时不借连接，直接在内存中查询"""
+    q, limit = suggest_args(req.args)
+    if product_index.stale():
+        async with read_cursor(req.client) as cursor:
+            token = product_index.begin_load()
+            product_index.load(await repo.list_product_suggestions(cursor), token)
+    return product_index.search(q, limit)
+
+
+async def warm_product_index():
+    """启动时加载产品联想索引（导入 app 时已加载过则跳过）；失败时记录日志，首次查询时再加载"""
+    if not product_index.stale():
+        return
+    pool = async_pools[id(db_backend)]
+    try:
+        lease = await pool.acquire()
+        try:
+            token = product_index.begin_load()
+            product_index.load(await repo.list_product_suggestions(lease.cursor), token)
+        finally:
+            await pool.release(lease)
+    except Exception as e:
+        flask_app.logger.warning("产品联想索引预加载失败: %s", e)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                for backend in [db_backend] + [r.backend for r in replica_router.replicas]:
+                    pool = async_pool_for(backend)
+                    await pool.start()
+                    async_pools[id(backend)] = pool
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await warm_product_index()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for pool in async_pools.values():
+                await pool.close()
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    req = Request(scope)
+    if req.method == 'GET' and req.path == '/api/system/pool':
+        await send_json(send, await pool_stats(req))
+        return
+    if req.method == 'GET' and req.path == '/api/products/suggest':
+        try:
+            await send_json(send, await suggest_products(req))
+        except Exception as e:
+            await send_json(send, *error_payload(e))
+        return
+
+    handler, kwargs = routes.match(req.method, req.path)
+    if handler is None:
+        await call_flask(scope, receive, send)
+        return
+
+    tables = getattr(handler, 'cache_tables', None)
+    key = cache_key(req.path, req.args)
+    headers = []
+    # @conditional 标记的接口先比较 ETag / Last-Modified（数据版本探针，一条查询），与 Flask 路由的顺序一致；
+    # 探针失败时按普通请求处理
+    etag_tables = getattr(handler, 'etag_tables', None)
+    probe = None
+    if etag_tables:
+        try:
+            async with read_cursor(req.client) as cursor:
+                probe = await repo.data_version(cursor, etag_tables)
+        except Exception:
+            pass
+    if probe is not None:
+        etag, last_modified = validators(key, *probe)
+        headers.append((b'etag', etag.encode('latin-1')))
+        if last_modified is not None:
+            headers.append((b'last-modified', http_date(last_modified).encode('latin-1')))
+        if not_modified(req.headers.get('if-none-match'), req.headers.get('if-modified-since'),
+                        etag, last_modified):
+            await send_body(send, b'', 304, headers)
+            return
+
+    # @cached 标记的接口再查响应缓存（与 Flask 路由共用），命中时不借连接
+    if tables:
+        body = response_cache.get(tables, key)
+        if body is not None:
+            await send_body(send, body, headers=headers + [(b'x-cache', b'HIT')])
+            return
+        version = table_versions.get(tables)
+
+    try:
+        async with read_cursor(req.client) as cursor:
+            result = await handler(req, cursor, **kwargs)
+    except Exception as e:
+        payload, status = error_payload(e)
+        await send_json(send, payload, status)
+        return
+
+    payload, status = result if isinstance(result, tuple) else (result, 200)
+    body = json_body(payload)
+    if status != 200:
+        await send_body(send, body, status)
+    elif tables:
+        response_cache.put(tables, key, body, version, handler.cache_ttl)
+        await send_body(send, body, headers=headers + [(b'x-cache', b'MISS')])
+    else:
+        await send_body(send, body, headers=headers)
@@ -0,0 +1,423 @@
+"""存储后端
+
+mysql:  默认后端，连接 MySQL（mysql-connector-python）
+sqlite: 嵌入式后端（WAL 模式），供单仓库边缘站点、测试和基准环境使用，
+        首次打开时按 schema_sqlite.sql 建表。
+
+两个后端都通过 ConnectionPool 提供连接，连接对象兼容 mysql-connector 的用法：
+cursor(dictionary=True)、%s 占位符、lastrowid、commit()/rollback()。
+方言差异（日期格式化、全文搜索等）由后端方法提供，SQL 本身集中在 repository.py。
+"""
+import os
+import re
+import sqlite3
+from datetime import datetime, timezone
+from functools import lru_cache
+from urllib.parse import unquote, urlparse
+
+from db_pool import ConnectionPool
+
+SQLITE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema_sqlite.sql')
+MYSQL_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '脚本.sql')
+# 旧版 MySQL 库缺少的列：(表, 列, 定义)，升级时在建表之后、建索引和触发器之前补上
+MYSQL_COLUMNS = (
+    ('products', 'version', 'INT NOT NULL DEFAULT 1'),
+    ('purchase_orders', 'version', 'INT NOT NULL DEFAULT 1'),
+    ('purchase_orders', 'updated_at', 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP'),
+    ('sales_orders', 'payment_method', "VARCHAR(20) DEFAULT '现金'"),
+    ('sales_orders', 'version', 'INT NOT NULL DEFAULT 1'),
+    ('sales_orders', 'updated_at', 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP'),
+)
+# 升级时执行的 脚本.sql 语句（只有结构，不含示例数据）
+MYSQL_UPGRADE_STATEMENT = re.compile(
+    r'(CREATE\s+(TABLE|(FULLTEXT\s+)?INDEX|TRIGGER|PROCEDURE|VIEW)|DROP\s+TRIGGER\s+IF\s+EXISTS)\s', re.I)
+# 对象已存在：表/视图、列、索引、存储过程、触发器
+MYSQL_EXISTS_ERRORS = (1050, 1060, 1061, 1304, 1359)
+# 按旧版 schema 建的库每次打开时执行的升级语句（须可重复执行）
+# 旧库缺少的列：(表, 列, 定义)，在 SQLITE_UPGRADES 之前补上
+SQLITE_COLUMNS = (
+    ('products', 'version', 'INT NOT NULL DEFAULT 1'),
+    ('purchase_orders', 'version', 'INT NOT NULL DEFAULT 1'),
+    ('sales_orders', 'version', 'INT NOT NULL DEFAULT 1'),
+)
+
+SQLITE_UPGRADES = (
+    # 销售出库改由应用扣减（Repository.place_sales_order），旧触发器会重复扣减
+    "DROP TRIGGER IF EXISTS before_sale_detail_insert",
+    "DROP TRIGGER IF EXISTS after_sale_detail_insert",
+    """CREATE TABLE IF NOT EXISTS order_sequences (
+        sequence_key VARCHAR(20) PRIMARY KEY,
+        last_value INT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS ledger_spools (
+        spool_key VARCHAR(255) PRIMARY KEY,
+        flushed_seq BIGINT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS ledger_commits (
+        spool_key VARCHAR(255) NOT NULL,
+        seq BIGINT NOT NULL,
+        PRIMARY KEY (spool_key, seq)
+    )""",
+    """CREATE TABLE IF NOT EXISTS idempotency_keys (
+        idempotency_key VARCHAR(255) PRIMARY KEY,
+        fingerprint CHAR(40) NOT NULL,
+        status_code INT,
+        response_body TEXT,
+        expires_at BIGINT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at)",
+    """CREATE TABLE IF NOT EXISTS stock_reservations (
+        transaction_id INT PRIMARY KEY REFERENCES inventory_transactions(transaction_id) ON DELETE CASCADE,
+        product_id INT NOT NULL,
+        quantity INT NOT NULL,
+        reserved_at BIGINT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_reservations_reserved ON stock_reservations(reserved_at)",
+    # 行版本：products_touch_updated_at 换成同时维护 updated_at 和 version 的触发器
+    "DROP TRIGGER IF EXISTS products_touch_updated_at",
+    # products_touch_row 在同一秒内的两次修改时也会触发，换成只在语句没有修改 version 时触发的版本
+    "DROP TRIGGER IF EXISTS products_touch_row",
+    """CREATE TRIGGER IF NOT EXISTS products_bump_version
+    AFTER UPDATE ON products
+    FOR EACH ROW WHEN NEW.version = OLD.version
+    BEGIN
+        UPDATE products SET version = OLD.version + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE product_id = NEW.product_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS purchase_orders_bump_version
+    AFTER UPDATE ON purchase_orders
+    FOR EACH ROW WHEN NEW.version = OLD.version
+    BEGIN
+        UPDATE purchase_orders SET version = OLD.version + 1 WHERE order_id = NEW.order_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS sales_orders_bump_version
+    AFTER UPDATE ON sales_orders
+    FOR EACH ROW WHEN NEW.version = OLD.version
+    BEGIN
+        UPDATE sales_orders SET version = OLD.version + 1 WHERE order_id = NEW.order_id;
+    END""",
+)
+
+
+class MySQLBackend:
+    """MySQL 后端"""
+    name = 'mysql'
+    # ngram 全文索引能匹配的最短搜索词（ngram_token_size，默认 2）
+    min_search_length = 2
+    # 主键冲突时跳过的 INSERT
+    insert_ignore = 'INSERT IGNORE'
+    # 读取最新版本并加行锁（可重复读下普通 SELECT 读的是事务快照）
+    for_update = ' FOR UPDATE'
+
+    def __init__(self, config, pool_config=None):
+        import mysql.connector
+        from mysql.connector import Error
+
+        self.Error = Error
+        self.config = config
+        self.pool = ConnectionPool(lambda: mysql.connector.connect(**config), **(pool_config or {}))
+
+    def upgrade_schema(self):
+        """把主库升级到 脚本.sql 的结构，返回本次新建的表名（可重复执行，多个进程同时执行也安全）
+
+        执行 脚本.sql 中的建表语句，补上 MYSQL_COLUMNS 中缺少的列，再按顺序执行索引、触发器、
+        存储过程和视图语句，已存在的对象跳过（已有对象的定义不会被替换，脚本中先 DROP 的触发器除外）；示例数据不会写入。
+        新建的派生表（库存预警、销售汇总）由调用方按现有数据重建。
+        连接失败时抛出 self.Error；升级语句失败（如账号没有 DDL / TRIGGER 权限）时抛出 RuntimeError。
+        """
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        created = []
+        try:
+            # 建表在前（新库），补列在后，再建依赖新列的索引和触发器
+            script = [statement for statement in _script_statements(MYSQL_SCHEMA)
+                      if MYSQL_UPGRADE_STATEMENT.match(statement)]
+            tables = [statement for statement in script if re.match(r'CREATE\s+TABLE\s', statement, re.I)]
+            statements = tables + [f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+                                   for table, column, definition in MYSQL_COLUMNS]
+            statements += [statement for statement in script if statement not in tables]
+            for statement in statements:
+                try:
+                    cursor.execute(statement)
+                except self.Error as e:
+                    if getattr(e, 'errno', None) in MYSQL_EXISTS_ERRORS:
+                        continue
+                    raise RuntimeError(f'MySQL 库结构升级失败，请用有 ALTER/CREATE/TRIGGER 权限的账号启动一次，'
+                                       f'或手工执行 脚本.sql 中的对应语句：{statement.splitlines()[0]}：{e}')
+                table = re.match(r'CREATE\s+TABLE\s+(\w+)', statement, re.I)
+                if table:
+                    created.append(table.group(1))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        return created
+
+    def month(self, column):
+        """按月分组的表达式，结果形如 2024-03"""
+        return f"DATE_FORMAT({column}, '%Y-%m')"
+
+    def epoch(self, expression):
+        """时间列转为 Unix 时间戳（秒）的表达式"""
+        return f"UNIX_TIMESTAMP({expression})"
+
+    def current_timestamp(self):
+        """应用侧生成的 CURRENT_TIMESTAMP 等价值（会话时区与应用服务器一致）"""
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def upsert_increment(self, table, key_column, value_column):
+        """计数器加 n 的语句（参数：键, n），行不存在时插入 n；行锁持有到事务结束"""
+        return (f"INSERT INTO {table} ({key_column}, {value_column}) VALUES (%s, %s) "
+                f"ON DUPLICATE KEY UPDATE {value_column} = {value_column} + VALUES({value_column})")
+
+    def estimated_count(self, table):
+        """估算表行数的 (SQL, 参数)：InnoDB 表统计信息，不扫描数据"""
+        return ("""
+            SELECT TABLE_ROWS as total FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """, (table,))
+
+    def full_text_join(self, table, id_column, columns, term, ref, limit):
+        """全文搜索的 (JOIN 子句, 参数)：关联别名 fts，提供 search_rank（越大越相关）
+
+        只取相关度最高的 limit 条候选，表再大搜索代价也有上限。columns 须与
+        FULLTEXT 索引的列一致。
+        """
+        match = f"MATCH({', '.join(columns)}) AGAINST (%s IN BOOLEAN MODE)"
+        phrase = '"' + term.replace('"', ' ') + '"'
+        return f"""
+            JOIN (SELECT {id_column} AS fts_id, {match} AS search_rank
+                  FROM {table} WHERE {match}
+                  ORDER BY search_rank DESC LIMIT {int(limit)}) fts ON fts.fts_id = {ref}
+        """, (phrase, phrase)
+
+    def replication_lag(self, cursor):
+        """从库复制延迟（秒）；不是从库时返回 None，复制中断时返回 inf"""
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except self.Error:
+            cursor.execute("SHOW SLAVE STATUS")
+        row = cursor.fetchone()
+        if not row:
+            return None
+        lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+        return float('inf') if lag is None else float(lag)
+
+
+def _script_statements(path):
+    """按语句拆分 MySQL 脚本，支持 DELIMITER；语句之间的注释和空行跳过"""
+    delimiter, lines = ';', []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            stripped = line.strip()
+            if stripped.upper().startswith('DELIMITER '):
+                delimiter = stripped.split()[1]
+                continue
+            if not lines and (not stripped or stripped.startswith('--')):
+                continue
+            lines.append(line.rstrip())
+            if stripped.endswith(delimiter):
+                statement = '\n'.join(lines).rstrip()
+                yield statement[:-len(delimiter)].rstrip()
+                lines = []
+
+
+@lru_cache(maxsize=512)
+def _translate(query):
+    """把 mysql-connector 风格的 %s 占位符转换为 sqlite3 的 ?"""
+    return query.replace('%s', '?')
+
+
+# SQLiteBackend.for_update：SQLite 没有 SELECT ... FOR UPDATE，用注释标记加锁读取
+SQLITE_LOCKING_READ = ' /* FOR UPDATE */'
+
+
+class SQLiteCursor:
+    """sqlite3 游标适配器，dictionary=True 时返回 dict 行"""
+
+    def __init__(self, raw, dictionary=False):
+        self._cur = raw
+        self._dictionary = dictionary
+
+    def execute(self, query, params=()):
+        # 加锁读取：事务还没开始时先 BEGIN IMMEDIATE 拿到写锁（sqlite3 默认在第一条写语句前才开始事务），
+        # 之后读到的就是最新版本，提交前其他连接也不能修改
+        if SQLITE_LOCKING_READ in query and not self._cur.connection.in_transaction:
+            self._cur.execute('BEGIN IMMEDIATE')
+        self._cur.execute(_translate(query), tuple(params or ()))
+        return self
+
+    def executemany(self, query, seq_params):
+        self._cur.executemany(_translate(query), [tuple(p) for p in seq_params])
+        return self
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip([d[0] for d in self._cur.description], row))
+
+    def fetchone(self):
+        return self._row(self._cur.fetchone())
+
+    def fetchall(self):
+        rows = self._cur.fetchall()
+        if not self._dictionary:
+            return rows
+        names = [d[0] for d in self._cur.description]
+        return [dict(zip(names, row)) for row in rows]
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def close(self):
+        self._cur.close()
+
+
+class SQLiteConnection:
+    """sqlite3 连接适配器"""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self._raw.cursor(), dictionary)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def ping(self):
+        self._raw.execute('SELECT 1').fetchone()
+
+    def close(self):
+        self._raw.close()
+
+
+class SQLiteBackend:
+    """嵌入式 SQLite 后端（WAL 模式，多读单写）"""
+    name = 'sqlite'
+    Error = sqlite3.Error
+    # trigram 分词能匹配的最短搜索词
+    min_search_length = 3
+    # 主键冲突时跳过的 INSERT
+    insert_ignore = 'INSERT OR IGNORE'
+    # 不支持行锁；加锁读取在事务开始前先 BEGIN IMMEDIATE，写事务持有整库写锁，事务内读到的就是最新版本
+    for_update = SQLITE_LOCKING_READ
+
+    def __init__(self, path, pool_config=None, busy_timeout=5000):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._init_schema()
+        self.pool = ConnectionPool(self._connect, **(pool_config or {}))
+
+    def _connect(self):
+        # isolation_level='IMMEDIATE'：写语句前直接拿写锁，避免读锁升级时的 SQLITE_BUSY
+        raw = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000,
+                              isolation_level='IMMEDIATE', check_same_thread=False)
+        raw.execute('PRAGMA journal_mode = WAL')
+        raw.execute('PRAGMA synchronous = NORMAL')
+        raw.execute('PRAGMA foreign_keys = ON')
+        raw.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        return SQLiteConnection(raw)
+
+    def upgrade_schema(self):
+        """建库和升级在打开时完成（_init_schema），这里没有要做的"""
+        return []
+
+    def _init_schema(self):
+        """数据库为空时按 schema_sqlite.sql 建表并写入示例数据，已有的库补上 SQLITE_COLUMNS 并执行 SQLITE_UPGRADES"""
+        conn = self._connect()
+        try:
+            exists = conn._raw.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products'"
+            ).fetchone()
+            if not exists:
+                with open(SQLITE_SCHEMA, encoding='utf-8') as f:
+                    conn._raw.executescript(f.read())
+            for table, column, definition in SQLITE_COLUMNS:
+                columns = {row[1] for row in conn._raw.execute(f"PRAGMA table_info({table})")}
+                if column not in columns:
+                    conn._raw.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            for statement in SQLITE_UPGRADES:
+                conn._raw.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def month(self, column):
+        """按月分组的表达式，结果形如 2024-03"""
+        return f"strftime('%Y-%m', {column})"
+
+    def epoch(self, expression):
+        """时间列转为 Unix 时间戳（秒）的表达式；CURRENT_TIMESTAMP 存的是 UTC
+
+        不用 strftime('%s')，%s 会被当成占位符转换。
+        """
+        return f"CAST(ROUND((julianday({expression}) - 2440587.5) * 86400) AS INTEGER)"
+
+    def current_timestamp(self):
+        """应用侧生成的 CURRENT_TIMESTAMP 等价值；SQLite 的 CURRENT_TIMESTAMP 是 UTC"""
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+    def upsert_increment(self, table, key_column, value_column):
+        """计数器加 n 的语句（参数：键, n），行不存在时插入 n"""
+        return (f"INSERT INTO {table} ({key_column}, {value_column}) VALUES (%s, %s) "
+                f"ON CONFLICT ({key_column}) DO UPDATE SET {value_column} = {value_column} + excluded.{value_column}")
+
+    def estimated_count(self, table):
+        """估算表行数的 (SQL, 参数)：最大 rowid，只读 B 树最右端；删除过的行会让估算偏大"""
+        return f"SELECT COALESCE(MAX(rowid), 0) as total FROM {table}", ()
+
+    def full_text_join(self, table, id_column, columns, term, ref, limit):
+        """全文搜索的 (JOIN 子句, 参数)：查询 FTS5 表 {table}_fts，search_rank 为 -bm25"""
+        phrase = '"' + term.replace('"', '""') + '"'
+        return f"""
+            JOIN (SELECT rowid AS fts_id, -bm25({table}_fts) AS search_rank
+                  FROM {table}_fts WHERE {table}_fts MATCH %s
+                  ORDER BY search_rank DESC LIMIT {int(limit)}) fts ON fts.fts_id = {ref}
+        """, (phrase,)
+
+    def replication_lag(self, cursor):
+        """SQLite 没有复制，作为从库替身时视为无延迟"""
+        return None
+
+
+def create_backend(name, mysql_config=None, sqlite_path='factory.db', pool_config=None):
+    """按名称创建存储后端"""
+    if name == 'mysql':
+        return MySQLBackend(mysql_config, pool_config)
+    if name == 'sqlite':
+        return SQLiteBackend(sqlite_path, pool_config)
+    raise ValueError(f'未知的存储后端: {name}')
+
+
+def backend_from_dsn(dsn, pool_config=None):
+    """按 DSN 创建后端
+
+    mysql://root:pw@10.0.0.2:3306/factory
+    sqlite:///replica.db（相对路径）或 sqlite:////data/replica.db（绝对路径）
+    """
+    url = urlparse(dsn)
+    if url.scheme == 'mysql':
+        config = {
+            'host': url.hostname or 'localhost',
+            'user': unquote(url.username or 'root'),
+            'password': unquote(url.password or ''),
+            'database': url.path.lstrip('/') or 'factory',
+            'port': url.port or 3306
+        }
+        return MySQLBackend(config, pool_config)
+    if url.scheme == 'sqlite':
+        return SQLiteBackend(url.path[1:], pool_config)
+    raise ValueError(f'无法识别的数据库 DSN: {dsn}')
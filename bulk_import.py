@@ -0,0 +1,131 @@
+"""批量导入：流式读取 CSV / NDJSON 并逐行校验
+
+读取器按行从请求体流中取数据，不把整个文件读进内存；产出 (行号, 记录, 解析错误)，
+CSV 的行号不含表头，NDJSON 跳过空行但保留原始行号。校验把一条记录转换为
+Repository.PRODUCT_IMPORT_COLUMNS 顺序的参数元组，不合法时抛出 ValueError。
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+# Content-Type -> 格式
+IMPORT_FORMATS = {
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+REQUIRED_FIELDS = ('product_code', 'product_name', 'material_type', 'unit_price')
+# 可选文本字段及默认值
+TEXT_DEFAULTS = {'specification': '', 'unit': '个', 'warehouse_location': ''}
+MATERIAL_TYPES = ('氟胶', '垫片', '其他')
+PRODUCT_STATUSES = ('正常', '停用')
+# 与表结构一致的长度上限，超长时 MySQL 严格模式会让整块失败，先在这里拦下
+TEXT_LIMITS = {'product_code': 20, 'product_name': 100, 'specification': 200, 'unit': 20,
+               'warehouse_location': 100}
+
+
+def read_rows(stream, fmt):
+    """逐行读取请求体，产出 (行号, 记录 dict 或 None, 解析错误或 None)"""
+    # 请求体流（werkzeug LimitedStream）按行迭代时每次只读很少的字节，先套一层缓冲
+    lines = io.TextIOWrapper(io.BufferedReader(stream, 1 << 16), encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row_no, record in enumerate(reader, 1):
+            if None in record:
+                yield row_no, None, '列数多于表头'
+            else:
+                yield row_no, record, None
+        return
+
+    for row_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield row_no, None, '不是合法的 JSON'
+            continue
+        if isinstance(record, dict):
+            yield row_no, record, None
+        else:
+            yield row_no, None, '每行必须是 JSON 对象'
+
+
+def chunked(iterable, size):
+    """按 size 条分块"""
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _value(record, name, default=None):
+    value = record.get(name)
+    if isinstance(value, str):
+        value = value.strip()
+    return default if value is None or value == '' else value
+
+
+def _number(value, name, kind):
+    try:
+        if kind is int and isinstance(value, str):
+            return int(value)
+        if kind is int and not float(value).is_integer():
+            raise ValueError
+        return kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'字段 {name} 必须是{"整数" if kind is int else "数字"}')
+
+
+def product_values(record, category_ids):
+    """一条导入记录 -> 插入参数元组；字段和默认值与 POST /api/products 一致
+
+    category_ids 为已有类别 ID 的集合，外键不满足时整块写入会失败，先逐行校验。
+    """
+    code, name, material_type, unit_price = (_value(record, field) for field in REQUIRED_FIELDS)
+    for field, value in zip(REQUIRED_FIELDS, (code, name, material_type, unit_price)):
+        if value is None:
+            raise ValueError(f'缺少必要字段: {field}')
+
+    text = {field: str(_value(record, field, default)) for field, default in TEXT_DEFAULTS.items()}
+    text['product_code'], text['product_name'] = str(code), str(name)
+    for field, limit in TEXT_LIMITS.items():
+        if len(text[field]) > limit:
+            raise ValueError(f'字段 {field} 超过 {limit} 个字符')
+
+    if material_type not in MATERIAL_TYPES:
+        raise ValueError(f'不支持的材料类型: {material_type}')
+    status = _value(record, 'status', '正常')
+    if status not in PRODUCT_STATUSES:
+        raise ValueError(f'不支持的状态: {status}')
+
+    category_id = _value(record, 'category_id')
+    if category_id is not None:
+        category_id = _number(category_id, 'category_id', int)
+        if category_id not in category_ids:
+            raise ValueError(f'产品类别不存在: {category_id}')
+
+    current_stock = _number(_value(record, 'current_stock', 0), 'current_stock', int)
+    if current_stock < 0:
+        raise ValueError('字段 current_stock 不能为负数')
+
+    return (
+        text['product_code'],
+        text['product_name'],
+        category_id,
+        text['specification'],
+        material_type,
+        text['unit'],
+        _number(unit_price, 'unit_price', float),
+        _number(_value(record, 'min_stock_level', 10), 'min_stock_level', int),
+        _number(_value(record, 'max_stock_level', 1000), 'max_stock_level', int),
+        current_stock,
+        text['warehouse_location'],
+        status
+    )
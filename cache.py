@@ -0,0 +1,143 @@
+"""进程内缓存与写失效
+
+写接口用 @writes('products', ...) 声明会修改的表，请求成功后（app.track_writes）
+递增这些表的版本号；读接口用 @cached('products') 声明响应依赖的表。缓存条目
+记录写入时依赖表的版本，读取时版本变化即视为失效，不需要逐条清理。
+多进程部署时其他进程的写入感知不到，由 TTL 兜底；使用从库时，失效后到从库
+追上之前读到的旧数据可能被缓存，陈旧时间不超过从库允许的最大延迟。
+
+条件请求（@conditional）的 ETag / Last-Modified 不用这些进程内的版本号，而是由数据库中
+依赖表的 MAX(主键) / MAX(updated_at) 等探针算出（Repository.data_version、validators），
+其他进程的写入也能反映出来。
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from werkzeug.http import parse_date
+
+
+def writes(*tables):
+    """标记写接口会修改的表（包括触发器间接修改的表）"""
+    def decorator(fn):
+        fn.write_tables = tables
+        return fn
+    return decorator
+
+
+def cached(*tables, ttl=None):
+    """标记读接口的响应可缓存，tables 为响应依赖的表；ttl 覆盖缓存的默认过期时间"""
+    def decorator(fn):
+        fn.cache_tables = tables
+        fn.cache_ttl = ttl
+        return fn
+    return decorator
+
+
+def conditional(*tables):
+    """标记读接口支持条件请求（ETag / Last-Modified），tables 为响应依赖的表"""
+    def decorator(fn):
+        fn.etag_tables = tables
+        return fn
+    return decorator
+
+
+def make_etag(key, version):
+    """强 ETag：请求键 + 数据版本的摘要"""
+    return '"' + hashlib.sha1(repr((key, version)).encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def not_modified(if_none_match, if_modified_since, etag, last_modified):
+    """条件请求是否可以返回 304：有 If-None-Match 时只比较 ETag，否则比较 If-Modified-Since"""
+    if if_none_match:
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    if if_modified_since and last_modified is not None:
+        since = parse_date(if_modified_since)
+        return since is not None and last_modified <= since.timestamp()
+    return False
+
+
+def cache_key(path, args):
+    """响应缓存键：路径 + 规范化的查询参数（按参数名排序，忽略空值）"""
+    return path, tuple(sorted((name, value) for name, value in args.items(multi=True) if value != ''))
+
+
+def validators(key, version, last_modified, now):
+    """条件请求的 (ETag, Last-Modified 时间戳或 None)，由 Repository.data_version 的结果算出
+
+    修改时间只有秒级精度：最后一次修改还在数据库当前这一秒（now）时，这一秒内的后续写入
+    不会改变版本值，此时 ETag 加上随机数、不给出 Last-Modified，客户端拿不到 304；
+    这一秒过去后 ETag 固定下来，之后的写入一定会改变 MAX(updated_at) 或主键、行数。
+    """
+    if last_modified is not None and last_modified >= now:
+        return make_etag(key, (version, os.urandom(8).hex())), None
+    return make_etag(key, version), last_modified
+
+
+class TableVersions:
+    """每张表的数据版本号，写入成功后递增"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def bump(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def get(self, tables):
+        """返回 tables 的版本元组"""
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+
+class VersionedCache:
+    """按表版本失效的 LRU/TTL 缓存
+
+    键为 (依赖表, 键)，依赖表即失效标签：任一表有写入或超过 ttl 秒后条目失效。
+    用于列表总数（repository）和读接口响应（@cached）。
+    """
+
+    def __init__(self, versions, ttl=30.0, max_entries=1024):
+        self.versions = versions
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (tables, key) -> (版本元组, 过期时间, 值)
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+    def get(self, tables, key):
+        """命中返回缓存值，否则返回 None"""
+        version = self.versions.get(tables)
+        with self._lock:
+            entry = self._entries.get((tables, key))
+            if entry is not None:
+                if entry[0] == version and entry[1] > time.monotonic():
+                    self._entries.move_to_end((tables, key))
+                    self._stats['hits'] += 1
+                    return entry[2]
+                del self._entries[(tables, key)]
+                self._stats['invalidations'] += 1
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, tables, key, value, version, ttl=None):
+        """version 为查询前取得的版本，查询期间发生的写入会让该条目直接失效"""
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[(tables, key)] = (version, expires, value)
+            self._entries.move_to_end((tables, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
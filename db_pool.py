@@ -0,0 +1,247 @@
+"""数据库连接池
+
+替代每个请求都重新 connect() 的做法：连接在请求之间复用，借用时做健康检查，
+超过最大存活时间或空闲过久的连接会被淘汰，借用超时抛出 PoolTimeout。
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """在 borrow_timeout 内没有借到连接（连接池已耗尽）"""
+
+
+class PooledConnection:
+    """连接代理：行为与原始连接一致，但 close() 会把连接归还连接池"""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = created_at
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def close(self):
+        """归还连接（可重复调用）"""
+        if self._returned:
+            return
+        self._returned = True
+        self._pool._release(self._raw, self.created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _default_ping(conn):
+    conn.ping()
+
+
+def _default_reset(conn):
+    # 丢弃未提交的事务，避免下一个借用者继承旧事务的快照或锁
+    conn.rollback()
+
+
+class ConnectionPool:
+    """线程安全的连接池
+
+    creator:        无参函数，返回一个新的原始连接
+    pool_size:      最大连接数（包括借出和空闲）
+    borrow_timeout: 借用连接的最长等待秒数
+    max_lifetime:   连接最长存活秒数，超过后归还时直接关闭
+    idle_timeout:   空闲超过该秒数的连接会被淘汰
+    ping_after:     连接空闲超过该秒数才在借用时 ping，0 表示每次借用都 ping
+    """
+
+    def __init__(self, creator, pool_size=10, borrow_timeout=5.0, max_lifetime=1800,
+                 idle_timeout=300, ping_after=0.5, ping=_default_ping, reset=_default_reset):
+        if pool_size < 1:
+            raise ValueError('pool_size 必须大于 0')
+        self._creator = creator
+        self.pool_size = pool_size
+        self.borrow_timeout = borrow_timeout
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self._ping = ping
+        self._reset = reset
+
+        self._cond = threading.Condition()
+        self._idle = []  # [(raw, created_at, last_used)]，末尾是最近归还的
+        self._open = 0
+        self._in_use = 0
+        self._waiters = 0
+        self._closed = False
+
+        self._stats = {
+            'borrowed': 0,
+            'created': 0,
+            'closed': 0,
+            'ping_failures': 0,
+            'timeouts': 0,
+            'wait_count': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    # ---------- 借用与归还 ----------
+    def acquire(self, timeout=None):
+        """借用一个连接，返回 PooledConnection"""
+        timeout = self.borrow_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+
+        while True:
+            raw = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError('连接池已关闭')
+                self._evict_locked(time.monotonic())
+                while not self._idle and self._open >= self.pool_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f'{timeout:g} 秒内未能获取数据库连接（连接池大小 {self.pool_size}）')
+                    waited = True
+                    self._waiters += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiters -= 1
+                    self._evict_locked(time.monotonic())
+
+                if self._idle:
+                    raw, created_at, last_used = self._idle.pop()
+                else:
+                    self._open += 1
+                    create = True
+                self._in_use += 1
+
+            if create:
+                try:
+                    raw = self._creator()
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
+                with self._cond:
+                    self._stats['created'] += 1
+            elif time.monotonic() - last_used >= self.ping_after and not self._alive(raw):
+                self._discard(raw, in_use=True)
+                continue
+
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self._stats['borrowed'] += 1
+                if waited:
+                    self._stats['wait_count'] += 1
+                    self._stats['wait_time_total'] += elapsed
+                    self._stats['wait_time_max'] = max(self._stats['wait_time_max'], elapsed)
+            return PooledConnection(self, raw, created_at)
+
+    def _release(self, raw, created_at):
+        now = time.monotonic()
+        keep = not self._closed and now - created_at < self.max_lifetime
+        if keep:
+            try:
+                self._reset(raw)
+            except Exception:
+                keep = False
+        if not keep:
+            self._discard(raw, in_use=True)
+            return
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((raw, created_at, now))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """with pool.connection() as conn: ... 退出时无论是否异常都会归还连接"""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # ---------- 维护 ----------
+    def _alive(self, raw):
+        try:
+            self._ping(raw)
+            return True
+        except Exception:
+            with self._cond:
+                self._stats['ping_failures'] += 1
+            return False
+
+    def _discard(self, raw, in_use=False):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._open -= 1
+            if in_use:
+                self._in_use -= 1
+            self._stats['closed'] += 1
+            self._cond.notify()
+
+    def _evict_locked(self, now):
+        """淘汰空闲过久或超过最大存活时间的空闲连接（调用方持有锁）"""
+        keep = []
+        for raw, created_at, last_used in self._idle:
+            if now - last_used >= self.idle_timeout or now - created_at >= self.max_lifetime:
+                try:
+                    raw.close()
+                except Exception:
+                    pass
+                self._open -= 1
+                self._stats['closed'] += 1
+            else:
+                keep.append((raw, created_at, last_used))
+        if len(keep) != len(self._idle):
+            self._idle = keep
+            self._cond.notify_all()
+
+    def close(self):
+        """关闭所有空闲连接，借出的连接归还时关闭"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            for raw, _, _ in idle:
+                try:
+                    raw.close()
+                except Exception:
+                    pass
+                self._open -= 1
+                self._stats['closed'] += 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """连接池指标，用于调整连接池大小"""
+        with self._cond:
+            self._evict_locked(time.monotonic())
+            stats = dict(self._stats)
+            stats.update({
+                'pool_size': self.pool_size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiters': self._waiters,
+            })
+        stats['wait_time_avg'] = (stats['wait_time_total'] / stats['wait_count']) if stats['wait_count'] else 0.0
+        return stats
@@ -0,0 +1,142 @@
+"""热门产品库存扣减合并
+
+热门产品（HOT_PRODUCTS）的库存行在并发下单时是瓶颈：每个订单事务都要排队拿同一行的
+行锁。开启后这些产品的扣减不在订单事务中做，而是交给合并器：同一产品在 window 秒内
+到达的扣减请求攒成一批，由第一个到达的请求（leader）在一个短事务中按到达顺序分配
+（库存够的接受，不够的拒绝），用一条条件 UPDATE 扣减接受的总数，再逐个通知结果。
+一批写入时下一批继续收集，行锁每批只拿一次。
+
+扣减先于订单事务提交。扣减的同一事务中为每个请求写入出库流水并登记预留
+（stock_reservations），订单事务提交时认领；订单事务失败（其他产品库存不足、数据库错误等）
+时由调用方 release() 退回。进程崩溃或退回失败留下的预留由 reclaim 定期退回（start() 启动）。
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _Request:
+    __slots__ = ('quantity', 'done', 'result')
+
+    def __init__(self, quantity):
+        self.quantity = quantity
+        self.done = threading.Event()
+        self.result = None
+
+
+class _Lane:
+    """一个产品的等待队列"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # 上一批写完再写下一批
+        self.pending = []
+        self.collecting = False
+
+
+class StockCoalescer:
+    def __init__(self, product_ids, allocate, release, window=0.002, reclaim=None, reclaim_interval=60.0):
+        """allocate(产品ID, [数量]) 按顺序分配并提交，返回每个请求的预留或 None（库存不足）；
+        release(预留) 退回一个预留；reclaim() 退回过期的预留并返回个数，start() 之后每
+        reclaim_interval 秒在后台线程中执行一次（启动时先执行一次）"""
+        self.product_ids = frozenset(product_ids)
+        self.allocate = allocate
+        self.release_reservation = release
+        self.window = window
+        self._lanes = {product_id: _Lane() for product_id in self.product_ids}
+        self._stats_lock = threading.Lock()
+        self._stats = {'batches': 0, 'requests': 0, 'rejected': 0, 'released': 0, 'reclaimed': 0, 'max_batch': 0}
+        self._reclaim = reclaim
+        self._reclaim_interval = reclaim_interval
+        self._reclaim_thread = None
+
+    def start(self):
+        """启动退回过期预留的后台线程（设置了 reclaim 时），重复调用无效"""
+        if self._reclaim is None or self._reclaim_thread is not None:
+            return
+        self._reclaim_thread = threading.Thread(target=self._run_reclaim, name='hot-stock-reclaim', daemon=True)
+        self._reclaim_thread.start()
+
+    def reserve(self, items):
+        """扣减订单明细 [(产品ID, 数量, 单价)] 中热门产品的库存
+
+        返回 {产品ID: 预留}，没有热门产品时为空；有产品库存不足时退回已扣减的部分并返回 None。
+        """
+        quantities = {}
+        for product_id, quantity, _ in items:
+            if product_id in self.product_ids:
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+        reserved = {}
+        try:
+            for product_id in sorted(quantities):
+                result = self._submit(product_id, quantities[product_id])
+                if result is None:
+                    self.release(reserved)
+                    return None
+                reserved[product_id] = result
+        except Exception:
+            self.release(reserved)
+            raise
+        return reserved
+
+    def release(self, reserved):
+        """退回 reserve() 扣减的库存（订单没有提交时调用）"""
+        for reservation in reserved.values():
+            self.release_reservation(reservation)
+        if reserved:
+            with self._stats_lock:
+                self._stats['released'] += len(reserved)
+
+    def _submit(self, product_id, quantity):
+        lane = self._lanes[product_id]
+        request = _Request(quantity)
+        with lane.lock:
+            lane.pending.append(request)
+            leader = not lane.collecting
+            lane.collecting = True
+
+        if leader:
+            time.sleep(self.window)
+            with lane.write_lock:
+                with lane.lock:
+                    batch, lane.pending = lane.pending, []
+                    lane.collecting = False
+                try:
+                    results = self.allocate(product_id, [r.quantity for r in batch])
+                except Exception as e:
+                    results = [e] * len(batch)
+                for r, result in zip(batch, results):
+                    r.result = result
+                    r.done.set()
+                with self._stats_lock:
+                    self._stats['batches'] += 1
+                    self._stats['requests'] += len(batch)
+                    self._stats['rejected'] += sum(1 for result in results if result is None)
+                    self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+
+        request.done.wait()
+        if isinstance(request.result, Exception):
+            raise request.result
+        return request.result
+
+    def _run_reclaim(self):
+        while True:
+            try:
+                reclaimed = self._reclaim()
+            except Exception as e:
+                logger.warning("退回过期库存预留失败: %s", e)
+            else:
+                if reclaimed:
+                    with self._stats_lock:
+                        self._stats['reclaimed'] += reclaimed
+            time.sleep(self._reclaim_interval)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['products'] = sorted(self.product_ids)
+        stats['avg_batch'] = round(stats['requests'] / stats['batches'], 2) if stats['batches'] else 0.0
+        return stats
@@ -0,0 +1,184 @@
+"""幂等键（Idempotency-Key 请求头）
+
+客户端重试下单、调整库存等写请求时带上同一个 Idempotency-Key，服务端只执行一次：
+第一次请求的响应（状态码 < 500）保存 ttl 秒，之后相同键的请求直接返回保存的响应，
+不再执行事务；第一次请求还在处理时，重复请求等它完成后返回同一个响应。
+第一次请求返回 5xx 时键被释放，重试会重新执行。同一个键用于内容不同的请求时拒绝。
+
+结果默认只保存在进程内；多进程部署时传入 table（IdempotencyTable），键和响应同时
+写入 idempotency_keys 表，其他进程的重复请求轮询该表等待。
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# begin() 的结果
+RUN = 'run'            # 第一次请求，执行后调用 complete() 或 release()
+REPLAY = 'replay'      # 返回保存的响应
+MISMATCH = 'mismatch'  # 键已用于内容不同的请求
+BUSY = 'busy'          # 第一次请求仍在处理，等待超时
+
+
+def idempotent(fn):
+    """标记写接口支持 Idempotency-Key"""
+    fn.idempotent = True
+    return fn
+
+
+def fingerprint(body):
+    """请求体摘要，用于识别同一个键被用于不同的请求"""
+    return hashlib.sha1(body).hexdigest()
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'expires', 'response')
+
+    def __init__(self, fingerprint, expires):
+        self.fingerprint = fingerprint
+        self.expires = expires
+        self.response = None  # (状态码, 响应体)，处理中为 None
+
+
+class IdempotencyStore:
+    def __init__(self, ttl=86400.0, max_entries=10000, wait_timeout=30.0, table=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self.table = table
+        self._cond = threading.Condition()
+        self._entries = OrderedDict()  # 键 -> _Entry
+        self._stats = {'executed': 0, 'replayed': 0, 'waited': 0, 'mismatched': 0, 'busy': 0}
+
+    def begin(self, key, fingerprint):
+        """返回 (结果, 保存的响应)；结果为 RUN 时由调用方执行请求"""
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            while True:
+                self._evict_locked()
+                entry = self._entries.get(key)
+                if entry is None:
+                    self._entries[key] = _Entry(fingerprint, time.monotonic() + self.ttl)
+                    break
+                if entry.fingerprint != fingerprint:
+                    self._stats['mismatched'] += 1
+                    return MISMATCH, None
+                if entry.response is not None:
+                    self._stats['replayed'] += 1
+                    return REPLAY, entry.response
+                # 本进程内的重复请求：等第一次请求完成；它失败释放了键时由本请求执行
+                self._stats['waited'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait_for(
+                        lambda: entry.response is not None or self._entries.get(key) is not entry, remaining):
+                    self._stats['busy'] += 1
+                    return BUSY, None
+
+        if self.table is not None:
+            try:
+                outcome, response = self.table.claim(key, fingerprint, deadline)
+            except Exception:
+                self._forget(key)
+                raise
+            if outcome != RUN:
+                if outcome == REPLAY:
+                    self._finish(key, response)
+                else:
+                    self._forget(key)
+                with self._cond:
+                    self._stats[{REPLAY: 'replayed', MISMATCH: 'mismatched', BUSY: 'busy'}[outcome]] += 1
+                return outcome, response
+
+        with self._cond:
+            self._stats['executed'] += 1
+        return RUN, None
+
+    def complete(self, key, status, body):
+        """保存第一次请求的响应，唤醒等待的重复请求"""
+        self._finish(key, (status, body))
+        if self.table is not None:
+            self.table.complete(key, status, body, self.ttl)
+
+    def release(self, key):
+        """第一次请求失败：删除键，重试会重新执行"""
+        self._forget(key)
+        if self.table is not None:
+            self.table.release(key)
+
+    def _finish(self, key, response):
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.response = response
+            self._cond.notify_all()
+
+    def _forget(self, key):
+        with self._cond:
+            self._entries.pop(key, None)
+            self._cond.notify_all()
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            # 处理中的条目不淘汰
+            if entry.response is None or (entry.expires > now and len(self._entries) <= self.max_entries):
+                break
+            del self._entries[key]
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+
+class IdempotencyTable:
+    """idempotency_keys 表：多进程共享的幂等键，每个操作一个独立的短事务
+
+    处理中的键只占用 lease 秒，进程在处理中崩溃时键到期后可以重新执行；
+    完成后过期时间延长为 ttl。
+    """
+
+    def __init__(self, repo, db_cursor, lease=120.0, poll_interval=0.1, purge_interval=60.0):
+        self.repo = repo
+        self.db_cursor = db_cursor  # app.db_cursor
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._purged_at = time.monotonic()
+
+    def _run(self, method, *args):
+        with self.db_cursor(dictionary=True) as (conn, cursor):
+            try:
+                result = method(cursor, *args)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return result
+
+    def claim(self, key, fingerprint, deadline):
+        """插入键；已被其他进程占用时轮询到它完成或 deadline"""
+        # 过期的键每 purge_interval 秒清理一次
+        if time.monotonic() - self._purged_at > self.purge_interval:
+            self._purged_at = time.monotonic()
+            self._run(self.repo.purge_idempotency_keys, int(time.time()))
+        while True:
+            now = int(time.time())
+            row = self._run(self.repo.claim_idempotency_key, key, fingerprint, now, now + int(self.lease))
+            if row is None:
+                return RUN, None
+            if row['fingerprint'] != fingerprint:
+                return MISMATCH, None
+            if row['status_code'] is not None:
+                return REPLAY, (row['status_code'], row['response_body'])
+            if time.monotonic() >= deadline:
+                return BUSY, None
+            time.sleep(self.poll_interval)
+
+    def complete(self, key, status, body, ttl):
+        self._run(self.repo.complete_idempotency_key, key, status, body, int(time.time() + ttl))
+
+    def release(self, key):
+        self._run(self.repo.release_idempotency_key, key)
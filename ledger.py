@@ -0,0 +1,246 @@
+"""库存流水延迟批量写入（write-behind）
+
+开启后 Repository 中应用写入的流水（手动调整、产品导入、盘点、下单出库、取消恢复库存等，
+经由 add_transaction / _add_transactions）不在请求事务中 INSERT：请求事务提交前，流水先作为
+一组追加到本地 spool 并 fsync，分配一个序号，请求事务中只登记一行 ledger_commits
+(spool_key, 序号)。后台线程攒够 batch_size 条或每隔 flush_interval 秒用多行 INSERT 写入一次。
+
+不经过这里的流水：采购入库由数据库触发器（after_purchase_detail_insert）在订单事务中写入；
+热门产品合并扣减（hot_stock.py）的出库流水须与库存预留在同一事务中落库，也直接写入。
+
+ledger_commits 中的登记行与请求的其他修改一起提交或回滚，是这组流水是否生效的依据：
+批量写入时只写入有登记行的组，并在同一事务中删除登记行、把 ledger_spools 中本 spool 的
+已写入序号（高水位）推进到这一批的最后一个序号。进程崩溃后重启，spool 中序号不大于
+高水位的组直接丢弃，其余按登记行决定写入还是丢弃，重放多少次结果都一样；请求事务提交后
+进程立即崩溃时，流水已在 spool 中，不会丢失。
+
+spool 是一个目录：key 文件记录本 spool 在 ledger_spools 中的键，流水按序号写入多个
+只追加的段文件（{起始序号}.log，每行 [序号, [流水, ...]]），当前段超过 segment_bytes 后
+换新段；旧段中的组全部写入后整个文件删除，不重写 spool。一个 spool 目录只能由一个进程
+使用（lock 文件锁）。
+
+代价：流水最多晚 flush_interval 秒可见；每个写请求多一次 fsync 和一行登记 INSERT。
+数据库不可用时条目留在队列和 spool 中，恢复后补写。
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不加文件锁
+    fcntl = None
+
+
+class LedgerWriter:
+    def __init__(self, path, write, flushed_seq, batch_size=500, flush_interval=1.0,
+                 segment_bytes=4 * 1024 * 1024, fsync=True):
+        """write(spool_key, advance, groups) 在一个事务中写入一批组 [(序号, 流水列表)] 中
+        已登记的流水、把已写入序号加 advance 并提交，返回写入的条数；
+        flushed_seq(spool_key) 返回数据库中已写入的最大序号"""
+        self.path = os.path.abspath(path)
+        self.write = write
+        self.flushed_seq = flushed_seq
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+
+        self._lock = threading.Lock()  # 保护队列和 spool 文件
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()  # 同一时间只有一个线程写库
+        self._queue = []  # [[序号, 流水列表, 请求是否已结束]]，按序号递增
+        self._queued_rows = 0
+        self._db_seq = None  # 数据库中的已写入序号，首次写入前查询
+        self._stopped = False
+        self._stats = {'flushes': 0, 'flushed_rows': 0, 'discarded_rows': 0, 'failures': 0,
+                       'last_error': None, 'replayed': 0,
+                       'flush_ms_last': 0.0, 'flush_ms_max': 0.0, 'flush_ms_total': 0.0}
+
+        os.makedirs(self.path, exist_ok=True)
+        self._lock_file = open(os.path.join(self.path, 'lock'), 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise RuntimeError(f'spool 目录 {self.path} 已被其他进程使用')
+        self._segments = self._load()  # [(起始序号, 最大序号)]，最后一个是当前段
+        self.key = self._load_key()
+        if not self._segments:
+            self._segments.append((self._next_seq, self._next_seq - 1))
+        self._spool = open(self._segment_path(self._segments[-1][0]), 'a', encoding='utf-8')
+
+        self._thread = threading.Thread(target=self._run, name='ledger-writer', daemon=True)
+        self._thread.start()
+
+    # ---------- spool ----------
+    def _segment_path(self, first_seq):
+        return os.path.join(self.path, f'{first_seq:012d}.log')
+
+    def _load(self):
+        """读取各段中的组放回队列（请求都已结束）；崩溃时写了一半的最后一行忽略"""
+        segments = []
+        names = sorted(name for name in os.listdir(self.path) if name.endswith('.log'))
+        for name in names:
+            first_seq = int(name[:-4])
+            last_seq = first_seq - 1
+            with open(os.path.join(self.path, name), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        seq, rows = json.loads(line)
+                    except ValueError:
+                        continue
+                    last_seq = max(last_seq, seq)
+                    self._queue.append([seq, [tuple(row) for row in rows], True])
+                    self._queued_rows += len(rows)
+            segments.append((first_seq, last_seq))
+        self._stats['replayed'] = self._queued_rows
+        # 当前段不会被删除，段名保证重启后序号继续递增
+        self._next_seq = segments[-1][1] + 1 if segments else 1
+        return segments
+
+    def _load_key(self):
+        """本 spool 在 ledger_spools 中的键；新建（或段文件丢失）的 spool 换一个新键，
+        序号从 1 重新开始也不会被旧的高水位跳过"""
+        key_path = os.path.join(self.path, 'key')
+        if self._segments and os.path.exists(key_path):
+            with open(key_path, encoding='utf-8') as f:
+                return f.read().strip()
+        key = f'{socket.gethostname()}:{self.path}:{uuid.uuid4().hex[:12]}'
+        with open(key_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(key)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(key_path + '.tmp', key_path)
+        return key
+
+    def _rotate_locked(self):
+        """当前段超过 segment_bytes 时换新段（以下一个序号命名）"""
+        if self._spool.tell() < self.segment_bytes:
+            return
+        self._spool.close()
+        self._segments.append((self._next_seq, self._next_seq - 1))
+        self._spool = open(self._segment_path(self._next_seq), 'a', encoding='utf-8')
+
+    def _drop_segments_locked(self, flushed):
+        """删除组已全部写入（最大序号不超过 flushed）的旧段，当前段保留"""
+        while len(self._segments) > 1 and self._segments[0][1] <= flushed:
+            first_seq, _ = self._segments.pop(0)
+            os.remove(self._segment_path(first_seq))
+
+    # ---------- 写入 ----------
+    def prepare(self, rows):
+        """请求事务提交前调用：一组流水（add_transaction 的参数 + transaction_date）
+        追加到 spool 并 fsync，返回序号；请求结束后调用 finish"""
+        with self._lock:
+            self._rotate_locked()
+            seq = self._next_seq
+            self._next_seq += 1
+            self._spool.write(json.dumps([seq, rows], ensure_ascii=False) + '\n')
+            self._spool.flush()
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+            first_seq, _ = self._segments[-1]
+            self._segments[-1] = (first_seq, seq)
+            self._queue.append([seq, list(rows), False])
+            self._queued_rows += len(rows)
+        return seq
+
+    def finish(self, *seqs):
+        """请求已结束（事务提交或回滚），这些组可以写入：是否生效由登记行决定"""
+        if not seqs:
+            return
+        seqs = set(seqs)
+        with self._lock:
+            for entry in self._queue:
+                if entry[0] in seqs:
+                    entry[2] = True
+            if self._queued_rows >= self.batch_size:
+                self._wakeup.notify()
+
+    def _take_batch_locked(self):
+        """队首连续的、请求已结束的组，约 batch_size 条（至少一组）"""
+        batch, count = [], 0
+        for seq, rows, finished in self._queue:
+            if not finished or (batch and count + len(rows) > self.batch_size):
+                break
+            batch.append((seq, rows))
+            count += len(rows)
+        return batch
+
+    def flush(self):
+        """写入一批，返回处理的条数（写入的和回滚丢弃的）；失败时条目留在队列中"""
+        with self._flush_lock:
+            started = time.monotonic()
+            try:
+                if self._db_seq is None:
+                    # 崩溃前已写入数据库、还没删除段文件的组直接丢弃
+                    self._db_seq = self.flushed_seq(self.key)
+                    with self._lock:
+                        while self._queue and self._queue[0][0] <= self._db_seq:
+                            self._queued_rows -= len(self._queue.pop(0)[1])
+                with self._lock:
+                    batch = self._take_batch_locked()
+                if not batch:
+                    return 0
+                last_seq = batch[-1][0]
+                written = self.write(self.key, last_seq - self._db_seq, batch)
+            except Exception as e:
+                self._stats['failures'] += 1
+                self._stats['last_error'] = str(e)
+                return 0
+            self._db_seq = last_seq
+            elapsed = (time.monotonic() - started) * 1000
+            count = sum(len(rows) for _, rows in batch)
+
+            with self._lock:
+                del self._queue[:len(batch)]
+                self._queued_rows -= count
+                self._drop_segments_locked(last_seq)
+                self._stats['flushes'] += 1
+                self._stats['flushed_rows'] += written
+                self._stats['discarded_rows'] += count - written
+                self._stats['flush_ms_last'] = elapsed
+                self._stats['flush_ms_max'] = max(self._stats['flush_ms_max'], elapsed)
+                self._stats['flush_ms_total'] += elapsed
+            return count
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._wakeup.wait_for(lambda: self._stopped or self._queued_rows >= self.batch_size,
+                                      timeout=self.flush_interval)
+                if self._stopped:
+                    return
+            # 积压超过一批时连续写入
+            while self.flush() >= self.batch_size:
+                pass
+
+    def close(self):
+        """停止后台线程并尽量写完队列；写不完的留在 spool 中，下次启动时重放"""
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify()
+        self._thread.join()
+        while self.flush():
+            pass
+        with self._lock:
+            self._spool.close()
+        self._lock_file.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queue_depth'] = self._queued_rows
+            stats['in_flight'] = sum(1 for entry in self._queue if not entry[2])
+            stats['segments'] = len(self._segments)
+            stats['spool_bytes'] = sum(os.path.getsize(self._segment_path(first_seq))
+                                       for first_seq, _ in self._segments)
+        total = stats.pop('flush_ms_total')
+        stats['flush_ms_avg'] = round(total / stats['flushes'], 2) if stats['flushes'] else 0.0
+        stats['flush_ms_last'] = round(stats['flush_ms_last'], 2)
+        stats['flush_ms_max'] = round(stats['flush_ms_max'], 2)
+        return stats
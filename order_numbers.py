@@ -0,0 +1,29 @@
+"""单号分配：前缀 + 日期 + 当天序号，如 SO-20240315-000123
+
+每个进程从 order_sequences 计数表一次预留 block_size 个序号（一个短事务），之后在
+内存中逐个发放，不需要每张订单访问数据库。预留语句对计数行加锁递增，不同进程、
+不同节点拿到的号段不会重叠。进程退出时没用完的序号作废，所以单号可能有空缺，
+多进程之间也不保证严格按时间递增。
+"""
+import threading
+from datetime import datetime
+
+
+class OrderNumberAllocator:
+    def __init__(self, reserve, block_size=100):
+        self.reserve = reserve  # reserve(序列键, 数量) -> 号段的第一个序号
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {}  # 前缀 -> [序列键, 下一个序号, 号段结束（不含）]
+
+    def next(self, prefix, now=None):
+        """分配一个单号；当前号段用完或日期变化时预留新号段"""
+        key = f"{prefix}-{(now or datetime.now()).strftime('%Y%m%d')}"
+        with self._lock:
+            block = self._blocks.get(prefix)
+            if block is None or block[0] != key or block[1] >= block[2]:
+                first = self.reserve(key, self.block_size)
+                block = self._blocks[prefix] = [key, first, first + self.block_size]
+            number = block[1]
+            block[1] += 1
+        return f'{key}-{number:06d}'
@@ -0,0 +1,41 @@
+"""订单状态机：声明采购订单、销售订单允许的状态转换
+
+Repository.transition_orders 先用一条条件 UPDATE（WHERE order_id IN (...) AND status IN
+(允许的当前状态)）转换能转换的订单，有订单没有生效时才读取这些订单的状态和版本，
+交给 error() 构造错误。
+"""
+
+
+class StateMachine:
+    def __init__(self, table, label, transitions):
+        self.table = table
+        self.label = label  # 错误提示中的实体名称
+        self.transitions = transitions  # 动作 -> (目标状态, 允许的当前状态, 动作名称)
+
+    def target(self, action):
+        return self.transitions[action][0]
+
+    def sources(self, action):
+        return self.transitions[action][1]
+
+    def error(self, action, row, expected_version=None):
+        """转换没有生效时的 (返回内容, 状态码)；row 为订单当前的 status 和 version，不存在时为 None"""
+        if row is None:
+            return {'error': f'{self.label}不存在'}, 404
+        if expected_version is not None and row['version'] != expected_version:
+            return {'error': f'{self.label}已被修改，请刷新后重试', 'version': row['version']}, 409
+        if row['status'] not in self.sources(action):
+            return {'error': f'订单当前状态为{row["status"]}，无法{self.transitions[action][2]}'}, 400
+        # 状态和版本都满足时不会调用到这里
+        return {'error': f'{self.label}已被修改，请刷新后重试', 'version': row['version']}, 409
+
+
+PURCHASE_ORDER_STATES = StateMachine('purchase_orders', '采购订单', {
+    'approve': ('已批准', ('待审核',), '审核'),
+    'cancel': ('已取消', ('待审核', '已批准', '已发货'), '取消'),
+})
+
+SALES_ORDER_STATES = StateMachine('sales_orders', '销售订单', {
+    'confirm': ('已确认', ('待处理',), '确认'),
+    'cancel': ('已取消', ('待处理', '已确认', '发货中'), '取消'),
+})
@@ -0,0 +1,71 @@
+"""分页：页码分页（LIMIT/OFFSET）和游标分页（keyset）
+
+游标是 (排序键, 主键) 的不透明编码。翻页条件写成
+
+    sort_col < %s OR (sort_col = %s AND id < %s)
+
+数据库可以直接在 (sort_col, id) 索引上定位，不需要扫描并丢弃前面的行；
+翻页期间有新行插入也不会导致重复或遗漏。查询本身见 Repository._page。
+"""
+import base64
+import json
+from datetime import date, datetime
+
+
+class Paging:
+    """分页参数：page/limit 为页码分页，after/before 为游标分页（已解码的 (排序键, 主键)）
+
+    count 为总数策略：exact（精确，按筛选条件缓存）、estimate（无筛选时用表统计估算）、none（不统计）
+    """
+    __slots__ = ('page', 'limit', 'sort', 'descending', 'after', 'before', 'count')
+
+    def __init__(self, page=1, limit=20, sort='id', descending=True, after=None, before=None, count='exact'):
+        self.page = page
+        self.limit = limit
+        self.sort = sort
+        self.descending = descending
+        self.after = after
+        self.before = before
+        self.count = count
+
+    @property
+    def keyset(self):
+        return self.after is not None or self.before is not None
+
+
+class Page:
+    """一页查询结果；total_type 为 exact / estimated / none（total 为 None）"""
+    __slots__ = ('rows', 'total', 'total_type', 'next_cursor', 'prev_cursor')
+
+    def __init__(self, rows, total, total_type='exact', next_cursor=None, prev_cursor=None):
+        self.rows = rows
+        self.total = total
+        self.total_type = total_type
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(paging, key, row_id):
+    """把 (排序方式, 排序键, 主键) 编码为不透明的游标字符串"""
+    raw = json.dumps([paging.sort, paging.descending, _plain(key), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, sort, descending):
+    """解码游标，返回 (排序键, 主键)；游标无效或与当前排序方式不一致时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        token_sort, token_desc, key, row_id = json.loads(raw)
+    except Exception:
+        raise ValueError('无效的分页游标')
+    if token_sort != sort or token_desc != descending:
+        raise ValueError('分页游标与当前排序方式不一致')
+    return key, row_id
@@ -0,0 +1,137 @@
+"""读写分离
+
+只读请求路由到从库，写请求和"刚写过数据的客户端"路由到主库：
+- 从库复制延迟超过 max_lag 或不可用时回退主库；延迟每 lag_check_interval 秒检查一次
+- 客户端写入成功后 read_your_writes 秒内的读请求仍走主库，保证读到自己的写入
+"""
+import threading
+import time
+
+
+class ReplicaState:
+    """单个从库的健康状态"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lag = None
+        self.healthy = True
+        self.checked_at = 0.0
+        self.reads = 0
+        self.error = None
+
+
+class ReplicaRouter:
+    def __init__(self, primary, replicas=(), max_lag=5.0, lag_check_interval=2.0, read_your_writes=5.0):
+        self.primary = primary
+        self.replicas = [ReplicaState(backend) for backend in replicas]
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.read_your_writes = read_your_writes
+
+        self._lock = threading.Lock()
+        self._writers = {}  # 客户端标识 -> 主库读窗口截止时间
+        self._next = 0
+        self._stats = {'fallback_reads': 0, 'sticky_reads': 0}
+
+    # ---------- 读你所写 ----------
+    def mark_write(self, client):
+        """记录客户端刚写入数据"""
+        if not client or self.read_your_writes <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._writers[client] = now + self.read_your_writes
+            if len(self._writers) > 10000:
+                self._writers = {k: v for k, v in self._writers.items() if v > now}
+
+    def _sticky(self, client):
+        if not client:
+            return False
+        with self._lock:
+            until = self._writers.get(client)
+            if until is None:
+                return False
+            if until <= time.monotonic():
+                del self._writers[client]
+                return False
+            return True
+
+    # ---------- 从库选择 ----------
+    def _check(self, replica):
+        """检查从库延迟（由选择逻辑按间隔调用）"""
+        try:
+            with replica.backend.pool.connection(timeout=1) as conn:
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    lag = replica.backend.replication_lag(cursor)
+                finally:
+                    cursor.close()
+            if lag == float('inf'):
+                replica.lag = None
+                replica.healthy = False
+                replica.error = '复制已中断'
+            else:
+                replica.lag = lag
+                replica.healthy = lag is None or lag <= self.max_lag
+                replica.error = None
+        except Exception as e:
+            replica.healthy = False
+            replica.error = str(e)
+        replica.checked_at = time.monotonic()
+
+    def _usable(self, replica):
+        now = time.monotonic()
+        if now - replica.checked_at >= self.lag_check_interval:
+            with self._lock:
+                due = now - replica.checked_at >= self.lag_check_interval
+                if due:
+                    # 先占位，避免并发请求同时检查同一个从库
+                    replica.checked_at = now
+            if due:
+                self._check(replica)
+        return replica.healthy
+
+    def read_backend(self, client=None):
+        """为只读请求选择后端：可用从库（轮询）或主库"""
+        if not self.replicas:
+            return self.primary
+        if self._sticky(client):
+            with self._lock:
+                self._stats['sticky_reads'] += 1
+            return self.primary
+
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if self._usable(replica):
+                with self._lock:
+                    replica.reads += 1
+                return replica.backend
+
+        with self._lock:
+            self._stats['fallback_reads'] += 1
+        return self.primary
+
+    def mark_unhealthy(self, backend, error):
+        """从库借连接失败时调用，下次检查前不再使用"""
+        for replica in self.replicas:
+            if replica.backend is backend:
+                replica.healthy = False
+                replica.error = str(error)
+                replica.checked_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['read_your_writes_clients'] = len(self._writers)
+        stats['replicas'] = [{
+            'backend': replica.backend.name,
+            'healthy': replica.healthy,
+            'lag': replica.lag,
+            'reads': replica.reads,
+            'error': replica.error,
+            'pool': replica.backend.pool.stats()
+        } for replica in self.replicas]
+        return stats
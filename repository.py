@@ -0,0 +1,1340 @@
+"""数据访问层
+
+产品、客户、供应商、订单和库存流水的查询集中在这里，路由只负责参数解析和
+响应格式。方言差异通过 backend 提供（见 backends.py），同一套 SQL 可在 MySQL
+和 SQLite 上运行。
+
+仓储方法写成生成器：每条语句通过 yield fetch_one()/fetch_all()/execute() 交给
+执行器，由 @sql_method 根据传入的游标决定执行方式。同步游标（Flask 路由）直接
+返回结果，异步游标（asgi.py）返回协程，两种服务模式共用同一份查询逻辑：
+
+    product = repo.get_product(cursor, 1)           # 同步
+    product = await repo.get_product(acursor, 1)    # 异步
+"""
+import inspect
+from functools import wraps
+
+from pagination import Page, encode_cursor
+
+
+class Statement:
+    """交给执行器的一条 SQL；mode 为 one / all / execute / many（params 为参数序列）"""
+    __slots__ = ('sql', 'params', 'mode')
+
+    def __init__(self, sql, params, mode):
+        self.sql = sql
+        self.params = tuple(params or ())
+        self.mode = mode
+
+
+class ExecuteResult:
+    """execute() 语句的结果"""
+    __slots__ = ('rowcount', 'lastrowid')
+
+    def __init__(self, rowcount, lastrowid):
+        self.rowcount = rowcount
+        self.lastrowid = lastrowid
+
+
+def fetch_one(sql, params=()):
+    return Statement(sql, params, 'one')
+
+
+def fetch_all(sql, params=()):
+    return Statement(sql, params, 'all')
+
+
+def execute(sql, params=()):
+    return Statement(sql, params, 'execute')
+
+
+def execute_many(sql, seq_params):
+    """同一条语句批量执行；mysql-connector 会把 INSERT 合并为多行 VALUES"""
+    return Statement(sql, seq_params, 'many')
+
+
+def _run_sync(cursor, gen):
+    try:
+        stmt = next(gen)
+        while True:
+            # 没有参数时传 None，避免驱动对 SQL 中的 % 做格式化
+            if stmt.mode == 'many':
+                cursor.executemany(stmt.sql, stmt.params)
+            else:
+                cursor.execute(stmt.sql, stmt.params or None)
+            if stmt.mode == 'one':
+                result = cursor.fetchone()
+            elif stmt.mode == 'all':
+                result = cursor.fetchall()
+            else:
+                result = ExecuteResult(cursor.rowcount, cursor.lastrowid)
+            stmt = gen.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _run_async(cursor, gen):
+    try:
+        stmt = next(gen)
+        while True:
+            if stmt.mode == 'many':
+                await cursor.executemany(stmt.sql, stmt.params)
+            else:
+                await cursor.execute(stmt.sql, stmt.params or None)
+            if stmt.mode == 'one':
+                result = await cursor.fetchone()
+            elif stmt.mode == 'all':
+                result = await cursor.fetchall()
+            else:
+                result = ExecuteResult(cursor.rowcount, cursor.lastrowid)
+            stmt = gen.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+def sql_method(fn):
+    """把生成器形式的仓储方法包装成 method(cursor, *args)，按游标类型同步或异步执行"""
+    @wraps(fn)
+    def wrapper(self, cursor, *args, **kwargs):
+        gen = fn(self, *args, **kwargs)
+        if inspect.iscoroutinefunction(cursor.execute):
+            return _run_async(cursor, gen)
+        return _run_sync(cursor, gen)
+    return wrapper
+
+
+def _item_quantities(items):
+    """订单明细 [(产品ID, 数量, 单价)] -> {产品ID: 合计数量}"""
+    quantities = {}
+    for product_id, quantity, _ in items:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def _field_map(alias, columns, **joined):
+    """fields 参数可选的字段名 -> SQL 列；joined 为关联表中的列"""
+    fields = {column: f'{alias}.{column}' if alias else column for column in columns}
+    fields.update(joined)
+    return fields
+
+
+class Repository:
+    # 各列表支持的排序方式（sort 参数）-> 排序列；每个排序列都有 (排序列, 主键) 索引，
+    # relevance 为搜索相关度，只在带 search 参数时可用
+    PRODUCT_SORTS = {'id': 'product_id', 'updated_at': 'updated_at'}
+    CUSTOMER_SORTS = {'id': 'customer_id', 'relevance': 'fts.search_rank'}
+    SUPPLIER_SORTS = {'id': 'supplier_id', 'relevance': 'fts.search_rank'}
+    PURCHASE_ORDER_SORTS = {'id': 'po.order_id', 'order_date': 'po.order_date', 'updated_at': 'po.updated_at',
+                            'relevance': 'fts.search_rank'}
+    SALES_ORDER_SORTS = {'id': 'so.order_id', 'order_date': 'so.order_date', 'updated_at': 'so.updated_at',
+                         'relevance': 'fts.search_rank'}
+
+    # 产品联想（/api/products/suggest）返回的字段
+    PRODUCT_SUGGEST_FIELDS = ('product_id', 'product_code', 'product_name', 'specification', 'unit',
+                              'unit_price', 'status')
+
+    # 批量导入（POST /api/products/import）写入的列，bulk_import.product_values 按此顺序产出
+    PRODUCT_IMPORT_COLUMNS = ('product_code', 'product_name', 'category_id', 'specification', 'material_type',
+                              'unit', 'unit_price', 'min_stock_level', 'max_stock_level', 'current_stock',
+                              'warehouse_location', 'status')
+
+    # 创建销售订单（place_sales_order）写入的列
+    SALES_ORDER_COLUMNS = ('order_number', 'customer_id', 'order_date', 'delivery_date', 'total_amount',
+                           'status', 'payment_status', 'payment_method', 'notes', 'created_by')
+
+    # 盘点按键批量读取库存时每条 IN 查询的键数
+    STOCKTAKE_LOOKUP_SIZE = 1000
+    # 盘点按 CASE 批量更新库存时每条 UPDATE 的产品数
+    STOCKTAKE_UPDATE_SIZE = 500
+
+    # 条件请求的数据版本探针：表 -> (主键, 修改时间列, 是否统计行数)
+    # 都是索引上的 MAX 或小表的 COUNT，不需要执行完整查询；只追加不删除的表不统计行数，
+    # 不修改的表没有修改时间列（明细随订单一起写入，由订单的修改时间覆盖）
+    VERSION_PROBES = {
+        'products': ('product_id', 'updated_at', True),
+        'product_categories': ('category_id', None, False),
+        'customers': ('customer_id', None, False),
+        'suppliers': ('supplier_id', None, False),
+        'purchase_orders': ('order_id', 'updated_at', False),
+        'purchase_order_details': ('detail_id', None, False),
+        'sales_orders': ('order_id', 'updated_at', False),
+        'sales_order_details': ('detail_id', None, False),
+        'inventory_transactions': ('transaction_id', 'transaction_date', False),
+    }
+
+    # search 参数匹配的列（与全文索引的列一致）
+    CUSTOMER_SEARCH = ('customer_name', 'customer_code', 'contact_person')
+    SUPPLIER_SEARCH = ('supplier_name', 'supplier_code', 'contact_person')
+    ORDER_SEARCH = ('order_number',)
+
+    # 各实体 fields 参数可选的字段（稀疏字段集，下推到 SELECT 列清单）
+    PRODUCT_FIELDS = _field_map('', (
+        'product_id', 'product_code', 'product_name', 'category_id', 'specification', 'material_type',
+        'unit', 'unit_price', 'min_stock_level', 'max_stock_level', 'current_stock',
+        'warehouse_location', 'status', 'version', 'created_at', 'updated_at'))
+    CUSTOMER_FIELDS = _field_map('', (
+        'customer_id', 'customer_code', 'customer_name', 'contact_person', 'phone', 'email', 'address',
+        'customer_type', 'credit_level', 'status', 'created_at'))
+    SUPPLIER_FIELDS = _field_map('', (
+        'supplier_id', 'supplier_code', 'supplier_name', 'contact_person', 'phone', 'email', 'address',
+        'rating', 'status', 'created_at'))
+    PURCHASE_ORDER_FIELDS = _field_map('po', (
+        'order_id', 'order_number', 'supplier_id', 'order_date', 'expected_delivery_date',
+        'actual_delivery_date', 'total_amount', 'status', 'notes', 'created_by', 'version', 'created_at',
+        'updated_at'),
+        supplier_name='s.supplier_name', supplier_code='s.supplier_code')
+    SALES_ORDER_FIELDS = _field_map('so', (
+        'order_id', 'order_number', 'customer_id', 'order_date', 'delivery_date', 'total_amount', 'status',
+        'payment_status', 'payment_method', 'notes', 'created_by', 'version', 'created_at', 'updated_at'),
+        customer_name='c.customer_name', customer_code='c.customer_code')
+
+    def __init__(self, backend, count_cache=None, search_limit=1000, ledger=None):
+        self.backend = backend
+        self.count_cache = count_cache
+        self.search_limit = search_limit
+        # ledger(rows)：设置后 add_transaction 的流水交给它延迟批量写入（见 ledger.py），
+        # 返回 (spool_key, 序号) 时在本事务中登记，返回 None 时照常直接写库
+        self.ledger = ledger
+
+    # ---------- 通用 ----------
+    @staticmethod
+    def _columns(field_map, fields, *required):
+        """fields 对应的 SQL 列清单；required 中的字段（主键、排序列）总会选出
+
+        不在 field_map 中的 required 字段（搜索相关度 search_rank）由调用方自行追加。
+        """
+        names = dict.fromkeys(required + tuple(fields))
+        return ', '.join(field_map[name] for name in names if name in field_map)
+
+    @staticmethod
+    def _sort_field(sorts, paging):
+        return sorts[paging.sort].rsplit('.', 1)[-1]
+
+    def _search(self, table, alias, id_column, columns, term):
+        """search 参数对应的 (JOIN 子句, 参数)，关联别名 fts，提供 search_rank
+
+        搜索词不短于后端 min_search_length 时走全文索引，按相关度取前 search_limit 条；
+        更短的词分词器匹配不到，退回 LIKE，同样最多取 search_limit 条，相关度记为 0。
+        """
+        ref = f"{alias}.{id_column}"
+        if len(term) >= self.backend.min_search_length:
+            join, params = self.backend.full_text_join(table, id_column, columns, term, ref, self.search_limit)
+            return join, list(params)
+        like = ' OR '.join(f"{column} LIKE %s" for column in columns)
+        return f"""
+            JOIN (SELECT {id_column} AS fts_id, 0 AS search_rank FROM {table}
+                  WHERE {like} LIMIT {int(self.search_limit)}) fts ON fts.fts_id = {ref}
+        """, [f'%{term}%'] * len(columns)
+
+    def _count(self, table, from_where, params, strategy):
+        """列表总数，返回 (总数, 类型)；策略见 Paging.count"""
+        if strategy == 'none':
+            return None, 'none'
+        if strategy == 'estimate' and not params:
+            row = yield fetch_one(*self.backend.estimated_count(table))
+            return (row['total'] or 0) if row else 0, 'estimated'
+
+        tables = (table,)
+        key = (' '.join(from_where.split()), tuple(params))
+        if self.count_cache:
+            total = self.count_cache.get(tables, key)
+            if total is not None:
+                return total, 'exact'
+            version = self.count_cache.versions.get(tables)
+        row = yield fetch_one(f"SELECT COUNT(*) as total {from_where}", params)
+        total = row['total']
+        if self.count_cache:
+            self.count_cache.put(tables, key, total, version)
+        return total, 'exact'
+
+    def _page(self, table, columns, from_where, params, id_column, sort_column, paging):
+        """分页查询，返回 Page；供其他仓储方法 yield from
+
+        页码分页用 LIMIT/OFFSET，带 after/before 游标时按 (sort_column, id_column)
+        定位。总数按筛选条件统计，不受游标影响；table 为主表，用于估算和缓存失效。
+        """
+        total, total_type = yield from self._count(table, from_where, params, paging.count)
+
+        # before 翻页时反向扫描，取到数据后再倒序
+        reverse = paging.before is not None
+        scan_desc = paging.descending != reverse
+        direction = 'DESC' if scan_desc else 'ASC'
+        single_key = sort_column == id_column
+        if single_key:
+            order_by = f"{id_column} {direction}"
+        else:
+            order_by = f"{sort_column} {direction}, {id_column} {direction}"
+
+        where = from_where
+        params = list(params)
+        if paging.keyset:
+            key, row_id = paging.before if reverse else paging.after
+            op = '<' if scan_desc else '>'
+            if single_key:
+                where += f" AND {id_column} {op} %s"
+                params.append(row_id)
+            else:
+                where += f" AND ({sort_column} {op} %s OR ({sort_column} = %s AND {id_column} {op} %s))"
+                params.extend([key, key, row_id])
+            rows = yield fetch_all(f"SELECT {columns} {where} ORDER BY {order_by} LIMIT %s",
+                                   params + [paging.limit + 1])
+            has_earlier = True
+        else:
+            offset = (paging.page - 1) * paging.limit
+            rows = yield fetch_all(f"SELECT {columns} {where} ORDER BY {order_by} LIMIT %s OFFSET %s",
+                                   params + [paging.limit + 1, offset])
+            has_earlier = offset > 0
+
+        # 多取一行用于判断后面是否还有数据
+        has_more = len(rows) > paging.limit
+        rows = rows[:paging.limit]
+        if reverse:
+            rows.reverse()
+            has_more, has_earlier = has_earlier, has_more
+
+        sort_field = sort_column.rsplit('.', 1)[-1]
+        id_field = id_column.rsplit('.', 1)[-1]
+        next_cursor = prev_cursor = None
+        if rows and has_more:
+            next_cursor = encode_cursor(paging, rows[-1][sort_field], rows[-1][id_field])
+        if rows and has_earlier:
+            prev_cursor = encode_cursor(paging, rows[0][sort_field], rows[0][id_field])
+        return Page(rows, total, total_type, next_cursor, prev_cursor)
+
+    def _attach_items(self, orders, detail_table, include):
+        """一次查询取出整页订单的明细，按订单分组挂到 items 或 items_summary 上
+
+        include 为 items（明细行）、summary（行数/数量/金额合计）或 none（不查明细）。
+        """
+        if include == 'none' or not orders:
+            return
+        order_ids = [order['order_id'] for order in orders]
+        placeholders = ', '.join(['%s'] * len(order_ids))
+
+        if include == 'summary':
+            rows = yield fetch_all(f"""
+                SELECT order_id, COUNT(*) as line_count,
+                       COALESCE(SUM(quantity), 0) as total_quantity,
+                       COALESCE(SUM(total_price), 0) as total_price
+                FROM {detail_table}
+                WHERE order_id IN ({placeholders})
+                GROUP BY order_id
+            """, order_ids)
+            summaries = {row.pop('order_id'): row for row in rows}
+            for order in orders:
+                order['items_summary'] = summaries.get(
+                    order['order_id'], {'line_count': 0, 'total_quantity': 0, 'total_price': 0})
+            return
+
+        rows = yield fetch_all(f"""
+            SELECT d.*, p.product_code, p.product_name
+            FROM {detail_table} d
+            JOIN products p ON d.product_id = p.product_id
+            WHERE d.order_id IN ({placeholders})
+            ORDER BY d.order_id, d.detail_id
+        """, order_ids)
+        items = {order_id: [] for order_id in order_ids}
+        for row in rows:
+            items[row['order_id']].append(row)
+        for order in orders:
+            order['items'] = items[order['order_id']]
+
+    @sql_method
+    def data_version(self, tables):
+        """tables 的数据版本，一次查询完成
+
+        返回 (版本值元组, 最后修改时间戳或 None, 数据库当前时间戳)。每次修改都会更新
+        updated_at，但它只有秒级精度，同一秒内的两次修改版本值相同，由调用方用数据库
+        当前时间判断（见 cache.validators）。
+        """
+        probes, modified = [], []
+        for table in tables:
+            id_column, modified_column, count = self.VERSION_PROBES[table]
+            if count:
+                probes.append(f"(SELECT COUNT(*) FROM {table})")
+            probes.append(f"(SELECT MAX({id_column}) FROM {table})")
+            if modified_column:
+                probes.append(f"(SELECT {self.backend.epoch(f'MAX({modified_column})')} FROM {table})")
+                modified.append(len(probes) - 1)
+        probes.append(self.backend.epoch('CURRENT_TIMESTAMP'))
+
+        row = yield fetch_one("SELECT " + ", ".join(f"{probe} as v{i}" for i, probe in enumerate(probes)))
+        values = tuple(row[f'v{i}'] for i in range(len(probes)))
+        stamps = [int(values[i]) for i in modified if values[i] is not None]
+        return values[:-1], max(stamps) if stamps else None, int(values[-1])
+
+    # ---------- 产品 ----------
+    @sql_method
+    def list_products(self, paging, fields=None, material_type='', status=''):
+        from_where = "FROM products WHERE 1=1"
+        params = []
+
+        if material_type:
+            from_where += " AND material_type = %s"
+            params.append(material_type)
+        if status:
+            from_where += " AND status = %s"
+            params.append(status)
+
+        columns = "*"
+        if fields:
+            columns = self._columns(self.PRODUCT_FIELDS, fields, 'product_id',
+                                    self._sort_field(self.PRODUCT_SORTS, paging))
+        return (yield from self._page('products', columns, from_where, params, "product_id",
+                                      self.PRODUCT_SORTS[paging.sort], paging))
+
+    @sql_method
+    def get_product(self, product_id, fields=None):
+        columns = self._columns(self.PRODUCT_FIELDS, fields, 'product_id') if fields else "*"
+        return (yield fetch_one(f"SELECT {columns} FROM products WHERE product_id = %s", (product_id,)))
+
+    @sql_method
+    def update_product(self, product_id, changes, expected_version=None):
+        """按 changes {列: 值} 更新产品，返回新的行版本；产品不存在或版本不符时返回 None（调用方回滚）
+
+        一条 UPDATE ... WHERE product_id = %s [AND version = %s] 完成，版本检查在数据库中进行。
+        修改库存时先在同一事务中用 INSERT ... SELECT 写流水，修改前的库存由数据库读出
+        （MySQL 加 FOR UPDATE 锁住该行，SQLite 的写事务从这条语句开始），不单独读取。
+        流水延迟写入（ledger）时无法 INSERT ... SELECT，先读出库存和版本，再以读到的版本为条件更新。
+        未带期望版本时 UPDATE 之后读取新版本（行已被本事务锁住）。
+        """
+        sets = ', '.join(f"{column} = %s" for column in changes)
+        values = list(changes.values())
+        version = expected_version
+        stock = changes.get('current_stock')
+
+        if stock is not None and self.ledger is not None:
+            row = yield fetch_one(
+                f"SELECT current_stock, version FROM products WHERE product_id = %s{self.backend.for_update}",
+                (product_id,))
+            if row is None or (version is not None and row['version'] != version):
+                return None
+            version = row['version']
+            if stock != row['current_stock']:
+                yield from self._add_transaction(product_id, '库存调整', stock - row['current_stock'],
+                                                 row['current_stock'], stock, '手动调整库存')
+        elif stock is not None:
+            yield execute(f"""
+                INSERT INTO inventory_transactions (
+                    product_id, transaction_type, quantity_change, quantity_before, quantity_after, notes
+                )
+                SELECT product_id, '库存调整', %s - current_stock, current_stock, %s, '手动调整库存'
+                FROM products
+                WHERE product_id = %s AND current_stock <> %s{' AND version = %s' if version is not None else ''}
+                {self.backend.for_update}
+            """, [stock, stock, product_id, stock] + ([version] if version is not None else []))
+
+        condition = ' AND version = %s' if version is not None else ''
+        updated = yield execute(f"""
+            UPDATE products SET {sets + ', ' if sets else ''}version = version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE product_id = %s{condition}
+        """, values + [product_id] + ([version] if version is not None else []))
+        if updated.rowcount != 1:
+            return None
+        if version is None:
+            return (yield from self._row_version('products', 'product_id', product_id))
+        return version + 1
+
+    @sql_method
+    def row_version(self, table, key, key_value):
+        """行的当前版本，行不存在时返回 None；条件更新失败后用于区分 404 和 409"""
+        return (yield from self._row_version(table, key, key_value))
+
+    def _row_version(self, table, key, key_value):
+        row = yield fetch_one(f"SELECT version FROM {table} WHERE {key} = %s", (key_value,))
+        return row['version'] if row else None
+
+    @sql_method
+    def list_product_suggestions(self):
+        """联想索引的全量数据（只取 PRODUCT_SUGGEST_FIELDS）"""
+        return (yield fetch_all(f"SELECT {', '.join(self.PRODUCT_SUGGEST_FIELDS)} FROM products"))
+
+    @sql_method
+    def existing_product_codes(self, codes):
+        """codes 中已存在的产品编码（唯一索引上的一次 IN 查询）"""
+        placeholders = ', '.join(['%s'] * len(codes))
+        rows = yield fetch_all(f"SELECT product_code FROM products WHERE product_code IN ({placeholders})", codes)
+        return {row['product_code'] for row in rows}
+
+    @sql_method
+    def insert_products(self, rows):
+        """批量插入产品并为初始库存写流水（与调用方处于同一事务），返回 {产品编码: 产品ID}
+
+        rows 为按 PRODUCT_IMPORT_COLUMNS 排列的元组，编码须已确认不存在。
+        """
+        columns = self.PRODUCT_IMPORT_COLUMNS
+        yield execute_many(f"""
+            INSERT INTO products ({', '.join(columns)})
+            VALUES ({', '.join(['%s'] * len(columns))})
+        """, rows)
+
+        # 多行 INSERT 分配的自增 ID 不保证连续，按编码取回
+        codes = [row[0] for row in rows]
+        placeholders = ', '.join(['%s'] * len(codes))
+        found = yield fetch_all(
+            f"SELECT product_id, product_code FROM products WHERE product_code IN ({placeholders})", codes)
+        ids = {row['product_code']: row['product_id'] for row in found}
+
+        stock = columns.index('current_stock')
+        ledger = [(ids[row[0]], '库存调整', None, None, row[stock], 0, row[stock], '初始库存', None)
+                  for row in rows if row[stock] > 0]
+        if ledger:
+            yield from self._add_transactions(ledger)
+        return ids
+
+    @sql_method
+    def stock_alerts(self):
+        """库存低于下限或高于上限的产品"""
+        return (yield from self._stock_alerts())
+
+    def _stock_alerts(self, limit=None):
+        """读取触发器维护的 stock_alerts 表（只含预警中的产品），按主键回表取产品信息"""
+        query = """
+            SELECT
+                p.product_id,
+                p.product_code,
+                p.product_name,
+                p.current_stock,
+                p.min_stock_level,
+                p.max_stock_level,
+                a.alert_type,
+                a.alert_value
+            FROM stock_alerts a
+            JOIN products p ON p.product_id = a.product_id
+            ORDER BY a.alert_type, a.severity DESC
+        """
+        if limit:
+            return (yield fetch_all(query + " LIMIT %s", (limit,)))
+        return (yield fetch_all(query))
+
+    @sql_method
+    def rebuild_stock_alerts(self):
+        """按当前库存全量重建 stock_alerts（与调用方处于同一事务），返回预警数"""
+        yield execute("DELETE FROM stock_alerts")
+        result = yield execute("""
+            INSERT INTO stock_alerts (product_id, alert_type, alert_value, severity)
+            SELECT
+                product_id,
+                CASE WHEN current_stock < min_stock_level THEN '库存不足' ELSE '库存过剩' END,
+                CASE
+                    WHEN current_stock < min_stock_level THEN min_stock_level - current_stock
+                    ELSE current_stock - max_stock_level
+                END,
+                ABS(current_stock - min_stock_level)
+            FROM products
+            WHERE current_stock < min_stock_level OR current_stock > max_stock_level
+        """)
+        return result.rowcount
+
+    # ---------- 库存流水 ----------
+    @sql_method
+    def list_inventory_transactions(self, limit, product_id=None):
+        query = """
+            SELECT
+                it.*,
+                p.product_name,
+                p.product_code
+            FROM inventory_transactions it
+            JOIN products p ON it.product_id = p.product_id
+            WHERE 1=1
+        """
+        params = []
+
+        if product_id:
+            query += " AND it.product_id = %s"
+            params.append(product_id)
+
+        query += " ORDER BY it.transaction_date DESC LIMIT %s"
+        params.append(limit)
+
+        return (yield fetch_all(query, params))
+
+    @sql_method
+    def add_transaction(self, *args, **kwargs):
+        """写入一条库存变动记录（与调用方处于同一事务）；设置了 ledger 时交给它延迟写入"""
+        yield from self._add_transaction(*args, **kwargs)
+
+    def _add_transaction(self, product_id, transaction_type, quantity_change,
+                         quantity_before, quantity_after, notes, reference_id=None,
+                         reference_type=None, created_by=None):
+        row = (
+            product_id,
+            transaction_type,
+            reference_id,
+            reference_type,
+            quantity_change,
+            quantity_before,
+            quantity_after,
+            notes,
+            created_by
+        )
+        yield from self._add_transactions([row])
+
+    def _add_transactions(self, rows):
+        """批量写入 add_transaction 参数顺序的流水，一条多行 INSERT"""
+        deferred = self.ledger(rows) if self.ledger is not None else None
+        if deferred is not None:
+            yield execute("INSERT INTO ledger_commits (spool_key, seq) VALUES (%s, %s)", deferred)
+            return
+        yield execute_many("""
+            INSERT INTO inventory_transactions (
+                product_id, transaction_type, reference_id, reference_type,
+                quantity_change, quantity_before, quantity_after, notes, created_by
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, rows)
+
+    @sql_method
+    def write_ledger(self, spool_key, advance, groups):
+        """批量写入延迟的库存流水：groups 为 [(序号, 流水列表)]，流水为 add_transaction 的参数
+        + transaction_date。只写入在 ledger_commits 中登记过（请求事务已提交）的组并删除登记，
+        同一事务中把 spool_key 的已写入序号加 advance；返回写入的条数
+
+        写入前产品已被删除的流水跳过（删除产品时流水本来也会级联删除）。
+        """
+        seqs = [seq for seq, _ in groups]
+        found = yield fetch_all(f"""
+            SELECT seq FROM ledger_commits
+            WHERE spool_key = %s AND seq IN ({', '.join(['%s'] * len(seqs))})
+        """, [spool_key] + seqs)
+        committed = {row['seq'] for row in found}
+        rows = [row for seq, group in groups if seq in committed for row in group]
+        if rows:
+            product_ids = sorted({row[0] for row in rows})
+            found = yield fetch_all(f"""
+                SELECT product_id FROM products WHERE product_id IN ({', '.join(['%s'] * len(product_ids))})
+            """, product_ids)
+            existing = {row['product_id'] for row in found}
+            rows = [row for row in rows if row[0] in existing]
+        if rows:
+            yield execute_many("""
+                INSERT INTO inventory_transactions (
+                    product_id, transaction_type, reference_id, reference_type,
+                    quantity_change, quantity_before, quantity_after, notes, created_by, transaction_date
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, rows)
+        if committed:
+            yield execute(f"""
+                DELETE FROM ledger_commits
+                WHERE spool_key = %s AND seq IN ({', '.join(['%s'] * len(committed))})
+            """, [spool_key] + sorted(committed))
+        yield execute(self.backend.upsert_increment('ledger_spools', 'spool_key', 'flushed_seq'),
+                      (spool_key, advance))
+        return len(rows)
+
+    @sql_method
+    def ledger_flushed_seq(self, spool_key):
+        """spool_key 已写入数据库的最大序号"""
+        row = yield fetch_one("SELECT flushed_seq FROM ledger_spools WHERE spool_key = %s", (spool_key,))
+        return row['flushed_seq'] if row else 0
+
+    # ---------- 盘点 ----------
+    @sql_method
+    def stock_levels(self, product_ids, product_codes):
+        """按产品 ID 和编码批量读取账面库存，每 STOCKTAKE_LOOKUP_SIZE 个键一条 IN 查询"""
+        rows = []
+        for column, keys in (('product_id', list(product_ids)), ('product_code', list(product_codes))):
+            for start in range(0, len(keys), self.STOCKTAKE_LOOKUP_SIZE):
+                batch = keys[start:start + self.STOCKTAKE_LOOKUP_SIZE]
+                rows.extend((yield fetch_all(f"""
+                    SELECT product_id, product_code, product_name, unit_price, current_stock
+                    FROM products
+                    WHERE {column} IN ({', '.join(['%s'] * len(batch))})
+                """, batch)))
+        return rows
+
+    @sql_method
+    def apply_stocktake(self, lines, notes, created_by=None):
+        """按实盘数量更新库存并批量写入 '盘点' 流水（与调用方处于同一事务）
+
+        lines 为有差异的 [(产品ID, 账面库存, 实盘数量)]。每 STOCKTAKE_UPDATE_SIZE 个产品一条
+        UPDATE，用 CASE 设置各自的实盘数量，并以账面库存为条件（与 _deduct_stock 相同的写法），
+        读取之后库存被其他事务改动过的产品不会被覆盖；返回 False 时调用方应回滚。
+        """
+        lines = sorted(lines)
+        for start in range(0, len(lines), self.STOCKTAKE_UPDATE_SIZE):
+            batch = lines[start:start + self.STOCKTAKE_UPDATE_SIZE]
+            case = 'CASE product_id ' + ' '.join(['WHEN %s THEN %s'] * len(batch)) + ' END'
+            updated = yield execute(f"""
+                UPDATE products
+                SET current_stock = {case},
+                    version = version + 1,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE product_id IN ({', '.join(['%s'] * len(batch))})
+                  AND current_stock = {case}
+            """, [value for product_id, _, counted in batch for value in (product_id, counted)]
+                + [product_id for product_id, _, _ in batch]
+                + [value for product_id, book, _ in batch for value in (product_id, book)])
+            if updated.rowcount != len(batch):
+                return False
+
+        yield from self._add_transactions([(product_id, '盘点', None, None, counted - book, book, counted, notes, created_by)
+                                           for product_id, book, counted in lines])
+        return True
+
+    # ---------- 销售统计 ----------
+    @sql_method
+    def sales_statistics(self):
+        """返回 (月度统计, 材料类别统计, 客户排名)"""
+        return (yield from self._sales_statistics())
+
+    def _sales_statistics(self):
+        """读取触发器增量维护的汇总表（sales_*_summary），只有几行到几十行，
+        耗时与订单历史长度无关。
+        """
+        monthly_stats = yield fetch_all("""
+            SELECT
+                month,
+                order_count,
+                ROUND(total_amount, 2) as total_amount,
+                ROUND(total_amount / order_count, 2) as avg_order_amount
+            FROM sales_monthly_summary
+            WHERE order_count > 0
+            ORDER BY month DESC
+            LIMIT 12
+        """)
+
+        category_stats = yield fetch_all("""
+            SELECT
+                material_type,
+                total_quantity,
+                ROUND(total_amount, 2) as total_amount,
+                order_count
+            FROM sales_material_summary
+            WHERE order_count > 0
+            ORDER BY total_amount DESC
+        """)
+
+        customer_stats = yield fetch_all("""
+            SELECT
+                c.customer_name,
+                c.customer_type,
+                s.order_count,
+                ROUND(s.total_amount, 2) as total_amount
+            FROM sales_customer_summary s
+            JOIN customers c ON c.customer_id = s.customer_id
+            WHERE s.order_count > 0
+            ORDER BY s.total_amount DESC
+            LIMIT 10
+        """)
+
+        return monthly_stats, category_stats, customer_stats
+
+    @sql_method
+    def rebuild_sales_summary(self):
+        """按已完成订单全量重建销售汇总表（与调用方处于同一事务），返回各表行数"""
+        for table in ('sales_monthly_summary', 'sales_material_summary', 'sales_customer_summary'):
+            yield execute(f"DELETE FROM {table}")
+
+        month = self.backend.month('order_date')
+        monthly = yield execute(f"""
+            INSERT INTO sales_monthly_summary (month, order_count, total_amount)
+            SELECT {month}, COUNT(*), COALESCE(SUM(total_amount), 0)
+            FROM sales_orders
+            WHERE status = '已完成'
+            GROUP BY {month}
+        """)
+
+        material = yield execute("""
+            INSERT INTO sales_material_summary (material_type, order_count, total_quantity, total_amount)
+            SELECT p.material_type, COUNT(DISTINCT so.order_id), SUM(sod.quantity), SUM(sod.total_price)
+            FROM sales_orders so
+            JOIN sales_order_details sod ON sod.order_id = so.order_id
+            JOIN products p ON p.product_id = sod.product_id
+            WHERE so.status = '已完成'
+            GROUP BY p.material_type
+        """)
+
+        customer = yield execute("""
+            INSERT INTO sales_customer_summary (customer_id, order_count, total_amount)
+            SELECT customer_id, COUNT(*), COALESCE(SUM(total_amount), 0)
+            FROM sales_orders
+            WHERE status = '已完成' AND customer_id IS NOT NULL
+            GROUP BY customer_id
+        """)
+
+        return {
+            'sales_monthly_summary': monthly.rowcount,
+            'sales_material_summary': material.rowcount,
+            'sales_customer_summary': customer.rowcount
+        }
+
+    # ---------- 仪表盘 ----------
+    @sql_method
+    def dashboard(self, alert_limit=5):
+        """仪表盘指标，返回 (按材料类别的库存汇总, 计数, 前 alert_limit 条预警, 销售统计)
+
+        库存汇总是对 products 的一次聚合，预警和销售统计读取触发器维护的表，
+        四条语句在调用方的同一个连接上依次执行。
+        """
+        inventory = yield fetch_all("""
+            SELECT
+                material_type,
+                COUNT(*) as product_count,
+                COALESCE(SUM(current_stock), 0) as total_items,
+                COALESCE(SUM(current_stock * unit_price), 0) as total_value
+            FROM products
+            GROUP BY material_type
+        """)
+
+        counts = yield fetch_one("""
+            SELECT
+                (SELECT COUNT(*) FROM stock_alerts WHERE alert_type = '库存不足') as low_stock,
+                (SELECT COUNT(*) FROM stock_alerts WHERE alert_type = '库存过剩') as overstock,
+                (SELECT COUNT(*) FROM purchase_orders
+                 WHERE status IN ('待审核', '已批准', '已发货')) as pending_purchase,
+                (SELECT COUNT(*) FROM sales_orders
+                 WHERE status IN ('待处理', '已确认', '发货中')) as pending_sales
+        """)
+
+        alerts = yield from self._stock_alerts(alert_limit)
+        sales = yield from self._sales_statistics()
+        return inventory, counts, alerts, sales
+
+    # ---------- 客户 ----------
+    @sql_method
+    def list_customers(self, paging, fields=None, customer_type='', status='', search=''):
+        columns = "customers.*"
+        if fields:
+            columns = self._columns(self.CUSTOMER_FIELDS, fields, 'customer_id',
+                                    self._sort_field(self.CUSTOMER_SORTS, paging))
+
+        from_where = "FROM customers"
+        params = []
+        if search:
+            join, params = self._search('customers', 'customers', 'customer_id', self.CUSTOMER_SEARCH, search)
+            from_where += join
+            columns += ", fts.search_rank"
+        from_where += " WHERE 1=1"
+
+        if customer_type:
+            from_where += " AND customer_type = %s"
+            params.append(customer_type)
+        if status:
+            from_where += " AND status = %s"
+            params.append(status)
+
+        return (yield from self._page('customers', columns, from_where, params, "customers.customer_id",
+                                      self.CUSTOMER_SORTS[paging.sort], paging))
+
+    @sql_method
+    def get_customer(self, customer_id, fields=None):
+        columns = self._columns(self.CUSTOMER_FIELDS, fields, 'customer_id') if fields else "*"
+        return (yield fetch_one(f"SELECT {columns} FROM customers WHERE customer_id = %s", (customer_id,)))
+
+    # ---------- 供应商 ----------
+    @sql_method
+    def list_suppliers(self, paging, fields=None, rating='', status='', search=''):
+        columns = "suppliers.*"
+        if fields:
+            columns = self._columns(self.SUPPLIER_FIELDS, fields, 'supplier_id',
+                                    self._sort_field(self.SUPPLIER_SORTS, paging))
+
+        from_where = "FROM suppliers"
+        params = []
+        if search:
+            join, params = self._search('suppliers', 'suppliers', 'supplier_id', self.SUPPLIER_SEARCH, search)
+            from_where += join
+            columns += ", fts.search_rank"
+        from_where += " WHERE 1=1"
+
+        if rating:
+            from_where += " AND rating = %s"
+            params.append(rating)
+        if status:
+            from_where += " AND status = %s"
+            params.append(status)
+
+        return (yield from self._page('suppliers', columns, from_where, params, "suppliers.supplier_id",
+                                      self.SUPPLIER_SORTS[paging.sort], paging))
+
+    @sql_method
+    def get_supplier(self, supplier_id, fields=None):
+        columns = self._columns(self.SUPPLIER_FIELDS, fields, 'supplier_id') if fields else "*"
+        return (yield fetch_one(f"SELECT {columns} FROM suppliers WHERE supplier_id = %s", (supplier_id,)))
+
+    # ---------- 采购订单 ----------
+    @sql_method
+    def list_purchase_orders(self, paging, include='items', fields=None, status='', supplier_id='', search=''):
+        columns = "po.*, s.supplier_name"
+        join = True
+        if fields:
+            columns = self._columns(self.PURCHASE_ORDER_FIELDS, fields, 'order_id',
+                                    self._sort_field(self.PURCHASE_ORDER_SORTS, paging))
+            # 没有请求供应商字段时不关联 suppliers
+            join = 'supplier_name' in fields or 'supplier_code' in fields
+
+        from_where = "FROM purchase_orders po"
+        if join:
+            from_where += " LEFT JOIN suppliers s ON po.supplier_id = s.supplier_id"
+        params = []
+        if search:
+            search_join, params = self._search('purchase_orders', 'po', 'order_id', self.ORDER_SEARCH, search)
+            from_where += search_join
+            columns += ", fts.search_rank"
+        from_where += " WHERE 1=1"
+
+        if status:
+            from_where += " AND po.status = %s"
+            params.append(status)
+        if supplier_id:
+            from_where += " AND po.supplier_id = %s"
+            params.append(supplier_id)
+
+        result = yield from self._page('purchase_orders', columns, from_where, params,
+                                       "po.order_id", self.PURCHASE_ORDER_SORTS[paging.sort], paging)
+
+        yield from self._attach_items(result.rows, 'purchase_order_details', include)
+
+        return result
+
+    @sql_method
+    def get_purchase_order(self, order_id, fields=None):
+        columns = "po.*, s.supplier_name, s.supplier_code"
+        if fields:
+            columns = self._columns(self.PURCHASE_ORDER_FIELDS, fields, 'order_id')
+        order = yield fetch_one(f"""
+            SELECT {columns}
+            FROM purchase_orders po
+            LEFT JOIN suppliers s ON po.supplier_id = s.supplier_id
+            WHERE po.order_id = %s
+        """, (order_id,))
+        if not order:
+            return None
+
+        order['items'] = yield fetch_all("""
+            SELECT pod.*, p.product_code, p.product_name, p.specification
+            FROM purchase_order_details pod
+            JOIN products p ON pod.product_id = p.product_id
+            WHERE pod.order_id = %s
+        """, (order_id,))
+        return order
+
+    @sql_method
+    def count_pending_purchase_orders(self):
+        result = yield fetch_one("""
+            SELECT COUNT(*) as count
+            FROM purchase_orders
+            WHERE status IN ('待审核', '已批准', '已发货')
+        """)
+        return result['count'] if result else 0
+
+    # ---------- 销售订单 ----------
+    @sql_method
+    def list_sales_orders(self, paging, include='items', fields=None, status='', customer_id='',
+                          payment_status='', search=''):
+        columns = "so.*, c.customer_name"
+        join = True
+        if fields:
+            columns = self._columns(self.SALES_ORDER_FIELDS, fields, 'order_id',
+                                    self._sort_field(self.SALES_ORDER_SORTS, paging))
+            # 没有请求客户字段时不关联 customers
+            join = 'customer_name' in fields or 'customer_code' in fields
+
+        from_where = "FROM sales_orders so"
+        if join:
+            from_where += " LEFT JOIN customers c ON so.customer_id = c.customer_id"
+        params = []
+        if search:
+            search_join, params = self._search('sales_orders', 'so', 'order_id', self.ORDER_SEARCH, search)
+            from_where += search_join
+            columns += ", fts.search_rank"
+        from_where += " WHERE 1=1"
+
+        if status:
+            from_where += " AND so.status = %s"
+            params.append(status)
+        if customer_id:
+            from_where += " AND so.customer_id = %s"
+            params.append(customer_id)
+        if payment_status:
+            from_where += " AND so.payment_status = %s"
+            params.append(payment_status)
+
+        result = yield from self._page('sales_orders', columns, from_where, params,
+                                       "so.order_id", self.SALES_ORDER_SORTS[paging.sort], paging)
+
+        yield from self._attach_items(result.rows, 'sales_order_details', include)
+
+        return result
+
+    @sql_method
+    def get_sales_order(self, order_id, fields=None):
+        columns = "so.*, c.customer_name, c.customer_code"
+        if fields:
+            columns = self._columns(self.SALES_ORDER_FIELDS, fields, 'order_id')
+        order = yield fetch_one(f"""
+            SELECT {columns}
+            FROM sales_orders so
+            LEFT JOIN customers c ON so.customer_id = c.customer_id
+            WHERE so.order_id = %s
+        """, (order_id,))
+        if not order:
+            return None
+
+        order['items'] = yield fetch_all("""
+            SELECT sod.*, p.product_code, p.product_name, p.specification
+            FROM sales_order_details sod
+            JOIN products p ON sod.product_id = p.product_id
+            WHERE sod.order_id = %s
+        """, (order_id,))
+        return order
+
+    @sql_method
+    def count_pending_sales_orders(self):
+        result = yield fetch_one("""
+            SELECT COUNT(*) as count
+            FROM sales_orders
+            WHERE status IN ('待处理', '已确认', '发货中')
+        """)
+        return result['count'] if result else 0
+
+    @sql_method
+    def place_sales_order(self, order, items, reserved=None):
+        """写入销售订单和明细、扣减库存并记录出库流水，语句条数与明细行数无关
+
+        order 为 SALES_ORDER_COLUMNS 顺序的值，items 为 [(产品ID, 数量, 单价)]。
+        reserved 为已由合并器扣减的热门产品 {产品ID: (流水ID, 扣减前, 扣减后)}（见 hot_stock.py），
+        这些产品的出库流水已在预留时写入，这里认领预留并把流水关联到订单。返回订单 ID；有产品库存不足时返回 None，调用方应回滚。
+        """
+        reserved = reserved or {}
+        result = yield execute(f"""
+            INSERT INTO sales_orders ({', '.join(self.SALES_ORDER_COLUMNS)})
+            VALUES ({', '.join(['%s'] * len(self.SALES_ORDER_COLUMNS))})
+        """, order)
+        order_id = result.lastrowid
+
+        yield execute_many("""
+            INSERT INTO sales_order_details (order_id, product_id, quantity, unit_price)
+            VALUES (%s, %s, %s, %s)
+        """, [(order_id, product_id, quantity, unit_price) for product_id, quantity, unit_price in items])
+
+        # 库存行锁放在最后取，热门产品的锁只持有到提交
+        quantities = {product_id: quantity for product_id, quantity in _item_quantities(items).items()
+                      if product_id not in reserved}
+        if quantities and not (yield from self._deduct_stock(quantities)):
+            return None
+
+        # 扣减后的库存即 quantity_after，同一产品的多行明细合并为一条流水
+        notes, created_by = f'销售订单: {order[0]}', order[-1]
+        if quantities and self.ledger is not None:
+            # 流水延迟写入：读出扣减后的库存（行已被本事务锁住）交给 ledger
+            product_ids = sorted(quantities)
+            rows = yield fetch_all(f"""
+                SELECT product_id, current_stock FROM products
+                WHERE product_id IN ({', '.join(['%s'] * len(product_ids))})
+            """, product_ids)
+            yield from self._add_transactions([
+                (row['product_id'], '销售出库', order_id, '销售订单', -quantities[row['product_id']],
+                 row['current_stock'] + quantities[row['product_id']], row['current_stock'], notes, created_by)
+                for row in rows])
+        elif quantities:
+            product_ids = sorted(quantities)
+            yield execute(f"""
+                INSERT INTO inventory_transactions (
+                    product_id, transaction_type, reference_id, reference_type,
+                    quantity_change, quantity_before, quantity_after, notes, created_by
+                )
+                SELECT p.product_id, '销售出库', d.order_id, '销售订单',
+                       -d.quantity, p.current_stock + d.quantity, p.current_stock, %s, %s
+                FROM (
+                    SELECT order_id, product_id, SUM(quantity) AS quantity
+                    FROM sales_order_details
+                    WHERE order_id = %s AND product_id IN ({', '.join(['%s'] * len(product_ids))})
+                    GROUP BY order_id, product_id
+                ) d
+                JOIN products p ON p.product_id = d.product_id
+            """, [notes, created_by, order_id] + product_ids)
+        if reserved:
+            # 认领预留：预留时写入的出库流水关联到订单；预留已被退回（超时回收）时整单回滚
+            transaction_ids = sorted(transaction_id for transaction_id, _, _ in reserved.values())
+            placeholders = ', '.join(['%s'] * len(transaction_ids))
+            claimed = yield execute(f"DELETE FROM stock_reservations WHERE transaction_id IN ({placeholders})",
+                                    transaction_ids)
+            if claimed.rowcount != len(transaction_ids):
+                raise RuntimeError('热门产品库存预留已超时退回，请重新下单')
+            yield execute(f"""
+                UPDATE inventory_transactions
+                SET reference_id = %s, reference_type = '销售订单', notes = %s, created_by = %s
+                WHERE transaction_id IN ({placeholders})
+            """, [order_id, notes, created_by] + transaction_ids)
+        return order_id
+
+    @sql_method
+    def allocate_stock(self, product_id, quantities, reserved_at):
+        """按顺序为一批扣减请求分配一个产品的库存：够的接受，不够的拒绝
+
+        返回每个请求的预留 (流水ID, 扣减前, 扣减后) 或 None。加锁读取库存后用一条 UPDATE
+        扣减接受的总数；同一事务中用一条多行 INSERT 为每个接受的请求写出库流水（此时还没有订单，
+        reference_id 为空）并在 stock_reservations 中登记，订单提交时认领（place_sales_order），
+        订单没有提交时退回（release_reservation）。预留在这个事务中落库，不走延迟写入的 ledger。
+        """
+        row = yield fetch_one(f"SELECT current_stock FROM products WHERE product_id = %s{self.backend.for_update}",
+                              (product_id,))
+        if row is None:
+            return [None] * len(quantities)
+        stock = remaining = row['current_stock']
+        accepted = []
+        for quantity in quantities:
+            if remaining >= quantity:
+                accepted.append((remaining, remaining - quantity))
+                remaining -= quantity
+            else:
+                accepted.append(None)
+        if remaining == stock:
+            return accepted
+
+        yield execute("""
+            UPDATE products SET current_stock = %s, version = version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE product_id = %s
+        """, (remaining, product_id))
+        # 多行 INSERT 分配的自增 ID 不保证连续，按插入前的最大流水 ID 取回；
+        # 同一产品的预留流水只在持有产品行锁时写入，取回的就是这一条 INSERT 写入的
+        row = yield fetch_one("""
+            SELECT COALESCE(MAX(transaction_id), 0) as last_id FROM inventory_transactions WHERE product_id = %s
+        """, (product_id,))
+        allocations = [allocation for allocation in accepted if allocation is not None]
+        yield execute_many("""
+            INSERT INTO inventory_transactions (
+                product_id, transaction_type, quantity_change, quantity_before, quantity_after, notes
+            ) VALUES (%s, '销售出库', %s, %s, %s, '热门产品库存预留')
+        """, [(product_id, after - before, before, after) for before, after in allocations])
+        found = yield fetch_all("""
+            SELECT transaction_id FROM inventory_transactions
+            WHERE product_id = %s AND transaction_id > %s AND notes = '热门产品库存预留'
+            ORDER BY transaction_id
+        """, (product_id, row['last_id']))
+        reservations = iter([(found_row['transaction_id'], before, after)
+                             for found_row, (before, after) in zip(found, allocations)])
+        results = [None if allocation is None else next(reservations) for allocation in accepted]
+        yield execute_many("""
+            INSERT INTO stock_reservations (transaction_id, product_id, quantity, reserved_at)
+            VALUES (%s, %s, %s, %s)
+        """, [(transaction_id, product_id, before - after, int(reserved_at))
+              for transaction_id, before, after in filter(None, results)])
+        return results
+
+    @sql_method
+    def release_reservation(self, transaction_id):
+        """退回一个没有被订单认领的预留：恢复库存并写一条调整流水；已认领或已退回时返回 False"""
+        return (yield from self._release_reservation(transaction_id))
+
+    def _release_reservation(self, transaction_id):
+        row = yield fetch_one(f"""
+            SELECT product_id, quantity FROM stock_reservations WHERE transaction_id = %s{self.backend.for_update}
+        """, (transaction_id,))
+        if row is None:
+            return False
+        yield execute("DELETE FROM stock_reservations WHERE transaction_id = %s", (transaction_id,))
+        yield execute("""
+            INSERT INTO inventory_transactions (
+                product_id, transaction_type, quantity_change, quantity_before, quantity_after, notes
+            )
+            SELECT product_id, '库存调整', %s, current_stock, current_stock + %s, %s
+            FROM products WHERE product_id = %s
+        """, (row['quantity'], row['quantity'], f'热门产品库存预留退回: {transaction_id}', row['product_id']))
+        yield execute("""
+            UPDATE products SET current_stock = current_stock + %s, version = version + 1,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE product_id = %s
+        """, (row['quantity'], row['product_id']))
+        return True
+
+    @sql_method
+    def release_expired_reservations(self, reserved_before, limit=100):
+        """退回 reserved_before（Unix 时间戳）之前登记、仍未被认领的预留（进程崩溃或退回失败时留下），
+        返回退回的个数"""
+        rows = yield fetch_all("""
+            SELECT transaction_id FROM stock_reservations WHERE reserved_at < %s
+            ORDER BY transaction_id LIMIT %s
+        """, (int(reserved_before), limit))
+        released = 0
+        for row in rows:
+            if (yield from self._release_reservation(row['transaction_id'])):
+                released += 1
+        return released
+
+    def _deduct_stock(self, quantities):
+        """一条 UPDATE 按条件扣减多个产品的库存：{产品ID: 数量}，全部充足时返回 True
+
+        库存检查在 UPDATE 的 WHERE 中完成，没有先读后写的超卖窗口。InnoDB 按主键升序
+        扫描 IN 列表加锁，并发订单的加锁顺序一致，不会互相死锁。
+        """
+        product_ids = sorted(quantities)
+        case = 'CASE product_id ' + ' '.join(['WHEN %s THEN %s'] * len(product_ids)) + ' END'
+        pairs = [value for product_id in product_ids for value in (product_id, quantities[product_id])]
+        result = yield execute(f"""
+            UPDATE products
+            SET current_stock = current_stock - {case},
+                version = version + 1,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE product_id IN ({', '.join(['%s'] * len(product_ids))})
+              AND current_stock >= {case}
+        """, pairs + product_ids + pairs)
+        return result.rowcount == len(product_ids)
+
+    @sql_method
+    def stock_shortages(self, items):
+        """订单明细 [(产品ID, 数量, 单价)] 中库存不足或不存在的产品，用于库存不足时的错误提示"""
+        quantities = _item_quantities(items)
+        product_ids = sorted(quantities)
+        rows = yield fetch_all(f"""
+            SELECT product_id, current_stock FROM products
+            WHERE product_id IN ({', '.join(['%s'] * len(product_ids))})
+        """, product_ids)
+        stock = {row['product_id']: row['current_stock'] for row in rows}
+        return [{'product_id': product_id, 'requested': quantities[product_id], 'available': stock.get(product_id)}
+                for product_id in product_ids
+                if stock.get(product_id) is None or stock[product_id] < quantities[product_id]]
+
+    @sql_method
+    def restore_sales_order_stock(self, order_ids):
+        """取消销售订单时恢复明细扣减的库存并记录 '库存调整' 流水（与调用方处于同一事务）
+
+        语句条数与订单数、明细行数无关：一次读取明细（按订单、产品合并），一条 UPDATE
+        按 CASE 加回各产品的合计数量，再读取加回后的库存（已持有行锁，是准确值）推出
+        每条流水的前后库存，同一产品的多个订单按订单 ID 顺序衔接，最后一条多行 INSERT。
+        不用 UPDATE ... JOIN 明细：多表 UPDATE 的加锁顺序由优化器选择的连接顺序决定，
+        按主键升序的 IN 列表与 _deduct_stock 加锁顺序一致，并发的下单和取消不会互相死锁。
+        """
+        order_ids = sorted(order_ids)
+        lines = yield fetch_all(f"""
+            SELECT order_id, product_id, SUM(quantity) AS quantity
+            FROM sales_order_details
+            WHERE order_id IN ({', '.join(['%s'] * len(order_ids))})
+            GROUP BY order_id, product_id
+            ORDER BY order_id, product_id
+        """, order_ids)
+        if not lines:
+            return
+
+        totals = {}
+        for line in lines:
+            totals[line['product_id']] = totals.get(line['product_id'], 0) + int(line['quantity'])
+        product_ids = sorted(totals)
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        case = 'CASE product_id ' + ' '.join(['WHEN %s THEN %s'] * len(product_ids)) + ' END'
+        pairs = [value for product_id in product_ids for value in (product_id, totals[product_id])]
+        yield execute(f"""
+            UPDATE products
+            SET current_stock = current_stock + {case},
+                version = version + 1,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE product_id IN ({placeholders})
+        """, pairs + product_ids)
+
+        rows = yield fetch_all(f"SELECT product_id, current_stock FROM products WHERE product_id IN ({placeholders})",
+                               product_ids)
+        # 每个产品从加回前的库存开始，按订单顺序累加
+        stock = {row['product_id']: row['current_stock'] - totals[row['product_id']] for row in rows}
+        entries = []
+        for line in lines:
+            product_id, quantity = line['product_id'], int(line['quantity'])
+            if product_id not in stock:  # 产品已删除
+                continue
+            before = stock[product_id]
+            stock[product_id] = before + quantity
+            entries.append((product_id, '库存调整', line['order_id'], '销售订单', quantity, before, before + quantity,
+                            f'销售订单取消恢复库存: {line["order_id"]}', None))
+        if entries:
+            yield from self._add_transactions(entries)
+
+    # ---------- 订单状态 ----------
+    @sql_method
+    def transition_orders(self, machine, order_ids, action, expected_version=None):
+        """按状态机（order_states.py）把订单转换到 action 的目标状态
+
+        返回 (生效的订单 ID, {订单ID: 当前 status 和 version})，后者用于为没有生效的订单构造错误。
+        先用一条 UPDATE ... WHERE order_id IN (...) AND status IN (...) 转换可以转换的订单，
+        不预先读取；影响行数等于订单数时全部生效，否则再读取（不加锁）订单当前的状态和版本，
+        没有处于目标状态的就是没有生效的。批量请求中有订单原本就处于目标状态、从影响行数
+        分不出哪些是这次转换的时，回到 UPDATE 之前的保存点逐个转换。
+        与调用方处于同一事务。expected_version 为单个订单的 If-Match 版本。
+        """
+        order_ids = sorted(order_ids)
+        bulk = len(order_ids) > 1
+        if bulk:
+            yield execute("SAVEPOINT transition_orders")
+        updated = yield from self._transition(machine, order_ids, action, expected_version)
+        if updated == len(order_ids):
+            return order_ids, {}
+
+        rows = yield from self._order_states(machine, order_ids)
+        if updated == 0:
+            return [], rows
+        target = machine.target(action)
+        changed = [order_id for order_id, row in rows.items() if row['status'] == target]
+        if len(changed) != updated:
+            yield execute("ROLLBACK TO SAVEPOINT transition_orders")
+            changed = []
+            for order_id in order_ids:
+                if (yield from self._transition(machine, [order_id], action, expected_version)):
+                    changed.append(order_id)
+        return changed, rows
+
+    def _transition(self, machine, order_ids, action, expected_version):
+        """一条条件 UPDATE 转换订单，返回生效的行数"""
+        sources = machine.sources(action)
+        condition = f"status IN ({', '.join(['%s'] * len(sources))})"
+        params = list(sources)
+        if expected_version is not None:
+            condition += " AND version = %s"
+            params.append(expected_version)
+        result = yield execute(f"""
+            UPDATE {machine.table}
+            SET status = %s, version = version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE order_id IN ({', '.join(['%s'] * len(order_ids))}) AND {condition}
+        """, [machine.target(action)] + list(order_ids) + params)
+        return result.rowcount
+
+    def _order_states(self, machine, order_ids):
+        """订单当前的状态和版本 {订单ID: 行}"""
+        rows = yield fetch_all(f"""
+            SELECT order_id, status, version FROM {machine.table}
+            WHERE order_id IN ({', '.join(['%s'] * len(order_ids))})
+        """, list(order_ids))
+        return {row['order_id']: row for row in rows}
+
+    # ---------- 产品类别 ----------
+    @sql_method
+    def list_categories(self):
+        return (yield fetch_all("SELECT * FROM product_categories ORDER BY category_id"))
+
+    # ---------- 单号序列 ----------
+    @sql_method
+    def reserve_sequence(self, key, count):
+        """为序列 key 预留 count 个序号，返回第一个；须在单独的短事务中调用并立即提交"""
+        yield execute(self.backend.upsert_increment('order_sequences', 'sequence_key', 'last_value'),
+                      (key, count))
+        row = yield fetch_one("SELECT last_value FROM order_sequences WHERE sequence_key = %s", (key,))
+        return row['last_value'] - count + 1
+
+    # ---------- 幂等键 ----------
+    @sql_method
+    def claim_idempotency_key(self, key, fingerprint, now, expires_at):
+        """占用幂等键（已过期的先删除）；成功返回 None，已被占用时返回已有的记录"""
+        yield execute("DELETE FROM idempotency_keys WHERE idempotency_key = %s AND expires_at < %s", (key, now))
+        result = yield execute(f"""
+            {self.backend.insert_ignore} INTO idempotency_keys (idempotency_key, fingerprint, expires_at)
+            VALUES (%s, %s, %s)
+        """, (key, fingerprint, expires_at))
+        if result.rowcount == 1:
+            return None
+        return (yield fetch_one("""
+            SELECT fingerprint, status_code, response_body FROM idempotency_keys WHERE idempotency_key = %s
+        """, (key,)))
+
+    @sql_method
+    def complete_idempotency_key(self, key, status_code, response_body, expires_at):
+        yield execute("""
+            UPDATE idempotency_keys SET status_code = %s, response_body = %s, expires_at = %s
+            WHERE idempotency_key = %s
+        """, (status_code, response_body, expires_at, key))
+
+    @sql_method
+    def release_idempotency_key(self, key):
+        yield execute("DELETE FROM idempotency_keys WHERE idempotency_key = %s AND status_code IS NULL", (key,))
+
+    @sql_method
+    def purge_idempotency_keys(self, now):
+        result = yield execute("DELETE FROM idempotency_keys WHERE expires_at < %s", (now,))
+        return result.rowcount
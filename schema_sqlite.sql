@@ -0,0 +1,625 @@
+-- 工厂氟胶垫片库存交易系统数据库脚本（SQLite 版）
+-- 由 脚本.sql 移植：ENUM 改为 CHECK 约束，ON UPDATE CURRENT_TIMESTAMP 和
+-- 库存触发器改写为 SQLite 触发器，DATE_FORMAT 改为 strftime。
+-- 存储过程 GetStockAlerts 在 SQLite 中没有对应物，应用直接查询触发器维护的 stock_alerts。
+
+--  1.产品类别表
+CREATE TABLE IF NOT EXISTS product_categories (
+    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category_name VARCHAR(50) NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 2. 产品表
+CREATE TABLE IF NOT EXISTS products (
+    product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_code VARCHAR(20) UNIQUE NOT NULL,
+    product_name VARCHAR(100) NOT NULL,
+    category_id INT REFERENCES product_categories(category_id) ON DELETE SET NULL,
+    specification VARCHAR(200),
+    material_type TEXT NOT NULL CHECK (material_type IN ('氟胶', '垫片', '其他')),
+    unit VARCHAR(20) DEFAULT '个',
+    unit_price DECIMAL(10, 2) NOT NULL,
+    min_stock_level INT DEFAULT 10,
+    max_stock_level INT DEFAULT 1000,
+    current_stock INT DEFAULT 0,
+    warehouse_location VARCHAR(100),
+    status TEXT DEFAULT '正常' CHECK (status IN ('正常', '停用')),
+    version INT NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 3. 供应商表
+CREATE TABLE IF NOT EXISTS suppliers (
+    supplier_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    supplier_code VARCHAR(20) UNIQUE NOT NULL,
+    supplier_name VARCHAR(100) NOT NULL,
+    contact_person VARCHAR(50),
+    phone VARCHAR(20),
+    email VARCHAR(100),
+    address VARCHAR(200),
+    rating TEXT DEFAULT 'B' CHECK (rating IN ('A', 'B', 'C', 'D')),
+    status TEXT DEFAULT '合作中' CHECK (status IN ('合作中', '已终止')),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 4. 客户表
+CREATE TABLE IF NOT EXISTS customers (
+    customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    customer_code VARCHAR(20) UNIQUE NOT NULL,
+    customer_name VARCHAR(100) NOT NULL,
+    contact_person VARCHAR(50),
+    phone VARCHAR(20),
+    email VARCHAR(100),
+    address VARCHAR(200),
+    customer_type TEXT DEFAULT '终端客户' CHECK (customer_type IN ('代理商', '终端客户', '经销商')),
+    credit_level TEXT DEFAULT '中' CHECK (credit_level IN ('高', '中', '低')),
+    status TEXT DEFAULT '活跃' CHECK (status IN ('活跃', '休眠', '终止')),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 5. 采购订单表
+CREATE TABLE IF NOT EXISTS purchase_orders (
+    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_number VARCHAR(30) UNIQUE NOT NULL,
+    supplier_id INT REFERENCES suppliers(supplier_id) ON DELETE SET NULL,
+    order_date DATE NOT NULL,
+    expected_delivery_date DATE,
+    actual_delivery_date DATE,
+    total_amount DECIMAL(12, 2) DEFAULT 0,
+    status TEXT DEFAULT '待审核' CHECK (status IN ('待审核', '已批准', '已发货', '已完成', '已取消')),
+    notes TEXT,
+    created_by VARCHAR(50),
+    version INT NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 6. 采购订单明细表
+CREATE TABLE IF NOT EXISTS purchase_order_details (
+    detail_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INT REFERENCES purchase_orders(order_id) ON DELETE CASCADE,
+    product_id INT REFERENCES products(product_id) ON DELETE CASCADE,
+    quantity INT NOT NULL,
+    unit_price DECIMAL(10, 2) NOT NULL,
+    total_price DECIMAL(12, 2) GENERATED ALWAYS AS (quantity * unit_price) STORED,
+    received_quantity INT DEFAULT 0
+);
+
+-- 7. 销售订单表
+CREATE TABLE IF NOT EXISTS sales_orders (
+    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_number VARCHAR(30) UNIQUE NOT NULL,
+    customer_id INT REFERENCES customers(customer_id) ON DELETE SET NULL,
+    order_date DATE NOT NULL,
+    delivery_date DATE,
+    total_amount DECIMAL(12, 2) DEFAULT 0,
+    status TEXT DEFAULT '待处理' CHECK (status IN ('待处理', '已确认', '发货中', '已完成', '已取消')),
+    payment_status TEXT DEFAULT '未支付' CHECK (payment_status IN ('未支付', '部分支付', '已支付')),
+    payment_method VARCHAR(20) DEFAULT '现金',
+    notes TEXT,
+    created_by VARCHAR(50),
+    version INT NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 8. 销售订单明细表
+CREATE TABLE IF NOT EXISTS sales_order_details (
+    detail_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INT REFERENCES sales_orders(order_id) ON DELETE CASCADE,
+    product_id INT REFERENCES products(product_id) ON DELETE CASCADE,
+    quantity INT NOT NULL,
+    unit_price DECIMAL(10, 2) NOT NULL,
+    total_price DECIMAL(12, 2) GENERATED ALWAYS AS (quantity * unit_price) STORED,
+    shipped_quantity INT DEFAULT 0
+);
+
+-- 9. 库存变动记录表
+CREATE TABLE IF NOT EXISTS inventory_transactions (
+    transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INT REFERENCES products(product_id) ON DELETE CASCADE,
+    transaction_type TEXT NOT NULL CHECK (transaction_type IN ('采购入库', '销售出库', '库存调整', '盘点')),
+    reference_id INT,  -- 关联的订单ID
+    reference_type TEXT CHECK (reference_type IN ('采购订单', '销售订单', '调整单')),  -- 关联单据类型
+    quantity_change INT NOT NULL,  -- 正数表示入库，负数表示出库
+    quantity_before INT NOT NULL,
+    quantity_after INT NOT NULL,
+    transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    notes VARCHAR(200),
+    created_by VARCHAR(50)
+);
+
+-- 10. 用户表（用于系统登录）
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(50) UNIQUE NOT NULL,
+    password_hash VARCHAR(255) NOT NULL,
+    full_name VARCHAR(100),
+    role TEXT DEFAULT '库存管理员' CHECK (role IN ('管理员', '采购员', '销售员', '库存管理员')),
+    email VARCHAR(100),
+    phone VARCHAR(20),
+    status TEXT DEFAULT '活跃' CHECK (status IN ('活跃', '停用')),
+    last_login TIMESTAMP NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 11. 单号序列表：每个序列键（如 SO-20240315）已发出的最大序号。应用每次预留一段序号
+-- 在内存中发放（order_numbers.py），不需要每张订单访问这张表
+CREATE TABLE IF NOT EXISTS order_sequences (
+    sequence_key VARCHAR(20) PRIMARY KEY,
+    last_value INT NOT NULL
+);
+
+-- 12. 库存流水 spool 表：延迟批量写入（ledger.py）时每个 spool 已写入数据库的最大序号，
+-- 与批量写入的流水在同一事务中更新，进程重启重放 spool 时据此跳过已写入的条目；
+-- ledger_commits 为请求事务中登记的 spool 条目，已提交的才写入，写入时删除
+CREATE TABLE IF NOT EXISTS ledger_spools (
+    spool_key VARCHAR(255) PRIMARY KEY,
+    flushed_seq BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ledger_commits (
+    spool_key VARCHAR(255) NOT NULL,
+    seq BIGINT NOT NULL,
+    PRIMARY KEY (spool_key, seq)
+);
+
+-- 13. 幂等键表：Idempotency-Key 请求的结果（idempotency.py），多进程部署时共享；
+-- status_code 为 NULL 表示第一次请求仍在处理，expires_at 为过期时间（Unix 秒）
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    fingerprint CHAR(40) NOT NULL,
+    status_code INT,
+    response_body TEXT,
+    expires_at BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at);
+
+-- 14. 热门产品库存预留表（hot_stock.py）：合并扣减时写入的出库流水，订单提交时认领（删除），
+-- reserved_at 为登记时间（Unix 秒），超时仍未认领的由后台线程退回库存
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    transaction_id INT PRIMARY KEY REFERENCES inventory_transactions(transaction_id) ON DELETE CASCADE,
+    product_id INT NOT NULL,
+    quantity INT NOT NULL,
+    reserved_at BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reservations_reserved ON stock_reservations(reserved_at);
+
+
+-- 插入示例数据
+-- 插入产品类别
+INSERT INTO product_categories (category_name, description) VALUES
+('密封件', '各种密封用氟胶制品'),
+('垫片', '工业用垫片系列'),
+('O型圈', '标准及非标O型圈'),
+('其他配件', '其他相关配件');
+
+-- 插入供应商
+INSERT INTO suppliers (supplier_code, supplier_name, contact_person, phone, email, address, rating) VALUES
+('SUP001', '华东氟胶有限公司', '张经理', '13800138000', 'sales@eastfluor.com', '上海市浦东新区', 'A'),
+('SUP002', '华南密封件厂', '李主管', '13900139000', 'info@sealing.com', '广东省深圳市', 'B'),
+('SUP003', '北方垫片制造', '王总', '13600136000', 'north@gasket.com', '北京市朝阳区', 'A');
+
+-- 插入客户
+INSERT INTO customers (customer_code, customer_name, contact_person, phone, email, address, customer_type) VALUES
+('CUST001', '华润机械制造', '陈工', '13700137000', 'chen@huarun.com', '江苏省苏州市', '终端客户'),
+('CUST002', '东方化工集团', '刘经理', '13500135000', 'liu@eastchem.com', '浙江省杭州市', '终端客户'),
+('CUST003', '永信贸易公司', '赵总', '13300133000', 'zhao@yongxin.com', '广东省广州市', '代理商');
+
+-- 插入产品
+INSERT INTO products (product_code, product_name, category_id, specification, material_type, unit, unit_price, min_stock_level, max_stock_level, current_stock, warehouse_location) VALUES
+('P001', '氟胶O型圈-10mm', 3, '内径10mm,截面2mm,耐高温250°C', '氟胶', '个', 5.50, 100, 1000, 500, 'A区-01架'),
+('P002', '氟胶O型圈-15mm', 3, '内径15mm,截面2.5mm,耐油', '氟胶', '个', 6.80, 80, 800, 320, 'A区-02架'),
+('P003', '金属缠绕垫片', 2, 'DN50,304不锈钢+石墨', '垫片', '片', 25.00, 50, 500, 150, 'B区-01架'),
+('P004', '石棉垫片', 2, '3mm厚,耐压10MPa', '垫片', '片', 8.50, 200, 2000, 850, 'B区-03架'),
+('P005', '氟胶平垫片', 1, 'Φ30×Φ15×2mm,耐酸碱', '氟胶', '个', 3.20, 300, 3000, 1200, 'C区-01架');
+
+-- 插入用户
+INSERT INTO users (username, password_hash, full_name, role, email) VALUES
+('admin', '$2y$10$YourHashedPasswordHere', '系统管理员', '管理员', 'admin@factory.com'),
+('purchase1', '$2y$10$YourHashedPasswordHere', '采购员张三', '采购员', 'purchase@factory.com'),
+('sales1', '$2y$10$YourHashedPasswordHere', '销售员李四', '销售员', 'sales@factory.com');
+
+-- 创建索引以提高查询性能
+CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id);
+CREATE INDEX IF NOT EXISTS idx_products_material ON products(material_type);
+CREATE INDEX IF NOT EXISTS idx_purchase_supplier ON purchase_orders(supplier_id);
+CREATE INDEX IF NOT EXISTS idx_purchase_status ON purchase_orders(status);
+CREATE INDEX IF NOT EXISTS idx_sales_customer ON sales_orders(customer_id);
+CREATE INDEX IF NOT EXISTS idx_sales_status ON sales_orders(status);
+CREATE INDEX IF NOT EXISTS idx_transactions_product ON inventory_transactions(product_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_date ON inventory_transactions(transaction_date);
+CREATE INDEX IF NOT EXISTS idx_purchase_details_order ON purchase_order_details(order_id);
+CREATE INDEX IF NOT EXISTS idx_sales_details_order ON sales_order_details(order_id);
+-- 列表游标分页（sort=updated_at / order_date）使用的 (排序列, 主键) 索引
+CREATE INDEX IF NOT EXISTS idx_products_updated ON products(updated_at, product_id);
+CREATE INDEX IF NOT EXISTS idx_purchase_date ON purchase_orders(order_date, order_id);
+CREATE INDEX IF NOT EXISTS idx_purchase_updated ON purchase_orders(updated_at, order_id);
+CREATE INDEX IF NOT EXISTS idx_sales_date ON sales_orders(order_date, order_id);
+CREATE INDEX IF NOT EXISTS idx_sales_updated ON sales_orders(updated_at, order_id);
+
+
+-- 触发器：products 的行版本和 updated_at，对应 MySQL 的 products_bump_version 和 ON UPDATE CURRENT_TIMESTAMP。
+-- 应用的 UPDATE 都显式设置 version = version + 1 和 updated_at，不会触发；只在语句没有修改 version 时
+-- （手工执行的 SQL 等）补上（触发器中的 UPDATE 不会再次触发）
+CREATE TRIGGER IF NOT EXISTS products_bump_version
+AFTER UPDATE ON products
+FOR EACH ROW WHEN NEW.version = OLD.version
+BEGIN
+    UPDATE products SET version = OLD.version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE product_id = NEW.product_id;
+END;
+
+-- 触发器：订单的行版本，任何修改都把 version 加 1
+CREATE TRIGGER IF NOT EXISTS purchase_orders_bump_version
+AFTER UPDATE ON purchase_orders
+FOR EACH ROW WHEN NEW.version = OLD.version
+BEGIN
+    UPDATE purchase_orders SET version = OLD.version + 1 WHERE order_id = NEW.order_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS sales_orders_bump_version
+AFTER UPDATE ON sales_orders
+FOR EACH ROW WHEN NEW.version = OLD.version
+BEGIN
+    UPDATE sales_orders SET version = OLD.version + 1 WHERE order_id = NEW.order_id;
+END;
+
+-- 触发器：采购订单明细插入时更新库存（先记流水再加库存，quantity_before 为变动前库存）
+CREATE TRIGGER IF NOT EXISTS after_purchase_detail_insert
+AFTER INSERT ON purchase_order_details
+FOR EACH ROW
+BEGIN
+    INSERT INTO inventory_transactions (
+        product_id, transaction_type, reference_id, reference_type,
+        quantity_change, quantity_before, quantity_after, notes, created_by
+    )
+    SELECT
+        NEW.product_id,
+        '采购入库',
+        NEW.order_id,
+        '采购订单',
+        NEW.quantity,
+        p.current_stock,
+        p.current_stock + NEW.quantity,
+        '采购订单: ' || po.order_number,
+        po.created_by
+    FROM products p
+    JOIN purchase_orders po ON po.order_id = NEW.order_id
+    WHERE p.product_id = NEW.product_id;
+
+    UPDATE products
+    SET current_stock = current_stock + NEW.quantity,
+        version = version + 1,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE product_id = NEW.product_id;
+END;
+
+-- 销售出库不用触发器：创建销售订单时由应用按条件一次扣减整单库存并批量写流水
+-- （Repository.place_sales_order），库存不足时整单回滚
+
+
+-- 创建视图：销售统计
+CREATE VIEW IF NOT EXISTS sales_summary AS
+SELECT
+    strftime('%Y-%m', so.order_date) as month,
+    p.material_type,
+    p.category_id,
+    c.category_name,
+    COUNT(DISTINCT so.order_id) as order_count,
+    SUM(sod.quantity) as total_quantity,
+    SUM(sod.total_price) as total_amount,
+    AVG(sod.unit_price) as avg_price
+FROM sales_orders so
+JOIN sales_order_details sod ON so.order_id = sod.order_id
+JOIN products p ON sod.product_id = p.product_id
+JOIN product_categories c ON p.category_id = c.category_id
+WHERE so.status = '已完成'
+GROUP BY strftime('%Y-%m', so.order_date), p.material_type, p.category_id;
+
+
+
+-- 销售统计汇总表：订单进入'已完成'状态时由触发器累加，离开时扣回（符号相反的同一组语句），
+-- 统计接口只读这几张小表。历史数据或手工改过的数据用 flask --app app rebuild-sales-summary 重建
+CREATE TABLE IF NOT EXISTS sales_monthly_summary (
+    month CHAR(7) PRIMARY KEY,
+    order_count INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS sales_material_summary (
+    material_type TEXT PRIMARY KEY,
+    order_count INT NOT NULL DEFAULT 0,
+    total_quantity INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS sales_customer_summary (
+    customer_id INT PRIMARY KEY,
+    order_count INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_customer_summary_amount ON sales_customer_summary(total_amount);
+
+CREATE TRIGGER IF NOT EXISTS sales_summary_order_insert
+AFTER INSERT ON sales_orders
+FOR EACH ROW WHEN NEW.status = '已完成'
+BEGIN
+    INSERT INTO sales_monthly_summary (month, order_count, total_amount)
+    SELECT strftime('%Y-%m', NEW.order_date), 1, NEW.total_amount
+    ON CONFLICT(month) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                     total_amount = total_amount + excluded.total_amount;
+
+    INSERT INTO sales_customer_summary (customer_id, order_count, total_amount)
+    SELECT NEW.customer_id, 1, NEW.total_amount
+    WHERE NEW.customer_id IS NOT NULL
+    ON CONFLICT(customer_id) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                           total_amount = total_amount + excluded.total_amount;
+
+    INSERT INTO sales_material_summary (material_type, order_count, total_quantity, total_amount)
+    SELECT p.material_type, 1, SUM(sod.quantity), SUM(sod.total_price)
+    FROM sales_order_details sod
+    JOIN products p ON p.product_id = sod.product_id
+    WHERE sod.order_id = NEW.order_id
+    GROUP BY p.material_type
+    ON CONFLICT(material_type) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                             total_quantity = total_quantity + excluded.total_quantity,
+                                             total_amount = total_amount + excluded.total_amount;
+END;
+
+-- 状态、日期、客户或金额变化时先扣回旧值再累加新值
+CREATE TRIGGER IF NOT EXISTS sales_summary_order_update
+AFTER UPDATE OF status, order_date, customer_id, total_amount ON sales_orders
+FOR EACH ROW WHEN OLD.status = '已完成' OR NEW.status = '已完成'
+BEGIN
+    INSERT INTO sales_monthly_summary (month, order_count, total_amount)
+    SELECT strftime('%Y-%m', OLD.order_date), -1, -OLD.total_amount
+    WHERE OLD.status = '已完成'
+    ON CONFLICT(month) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                     total_amount = total_amount + excluded.total_amount;
+
+    INSERT INTO sales_customer_summary (customer_id, order_count, total_amount)
+    SELECT OLD.customer_id, -1, -OLD.total_amount
+    WHERE OLD.status = '已完成' AND OLD.customer_id IS NOT NULL
+    ON CONFLICT(customer_id) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                           total_amount = total_amount + excluded.total_amount;
+
+    INSERT INTO sales_material_summary (material_type, order_count, total_quantity, total_amount)
+    SELECT p.material_type, -1, -SUM(sod.quantity), -SUM(sod.total_price)
+    FROM sales_order_details sod
+    JOIN products p ON p.product_id = sod.product_id
+    WHERE sod.order_id = OLD.order_id AND OLD.status = '已完成'
+    GROUP BY p.material_type
+    ON CONFLICT(material_type) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                             total_quantity = total_quantity + excluded.total_quantity,
+                                             total_amount = total_amount + excluded.total_amount;
+
+    INSERT INTO sales_monthly_summary (month, order_count, total_amount)
+    SELECT strftime('%Y-%m', NEW.order_date), 1, NEW.total_amount
+    WHERE NEW.status = '已完成'
+    ON CONFLICT(month) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                     total_amount = total_amount + excluded.total_amount;
+
+    INSERT INTO sales_customer_summary (customer_id, order_count, total_amount)
+    SELECT NEW.customer_id, 1, NEW.total_amount
+    WHERE NEW.status = '已完成' AND NEW.customer_id IS NOT NULL
+    ON CONFLICT(customer_id) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                           total_amount = total_amount + excluded.total_amount;
+
+    INSERT INTO sales_material_summary (material_type, order_count, total_quantity, total_amount)
+    SELECT p.material_type, 1, SUM(sod.quantity), SUM(sod.total_price)
+    FROM sales_order_details sod
+    JOIN products p ON p.product_id = sod.product_id
+    WHERE sod.order_id = NEW.order_id AND NEW.status = '已完成'
+    GROUP BY p.material_type
+    ON CONFLICT(material_type) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                             total_quantity = total_quantity + excluded.total_quantity,
+                                             total_amount = total_amount + excluded.total_amount;
+END;
+
+-- BEFORE：明细随订单级联删除前扣回
+CREATE TRIGGER IF NOT EXISTS sales_summary_order_delete
+BEFORE DELETE ON sales_orders
+FOR EACH ROW WHEN OLD.status = '已完成'
+BEGIN
+    INSERT INTO sales_monthly_summary (month, order_count, total_amount)
+    SELECT strftime('%Y-%m', OLD.order_date), -1, -OLD.total_amount
+    ON CONFLICT(month) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                     total_amount = total_amount + excluded.total_amount;
+
+    INSERT INTO sales_customer_summary (customer_id, order_count, total_amount)
+    SELECT OLD.customer_id, -1, -OLD.total_amount
+    WHERE OLD.customer_id IS NOT NULL
+    ON CONFLICT(customer_id) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                           total_amount = total_amount + excluded.total_amount;
+
+    INSERT INTO sales_material_summary (material_type, order_count, total_quantity, total_amount)
+    SELECT p.material_type, -1, -SUM(sod.quantity), -SUM(sod.total_price)
+    FROM sales_order_details sod
+    JOIN products p ON p.product_id = sod.product_id
+    WHERE sod.order_id = OLD.order_id
+    GROUP BY p.material_type
+    ON CONFLICT(material_type) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                             total_quantity = total_quantity + excluded.total_quantity,
+                                             total_amount = total_amount + excluded.total_amount;
+END;
+
+-- 已完成订单增删明细时调整材料类别汇总；订单数只在该类别第一条/最后一条明细变化时增减
+CREATE TRIGGER IF NOT EXISTS sales_summary_detail_insert
+AFTER INSERT ON sales_order_details
+FOR EACH ROW WHEN (SELECT status FROM sales_orders WHERE order_id = NEW.order_id) = '已完成'
+BEGIN
+    INSERT INTO sales_material_summary (material_type, order_count, total_quantity, total_amount)
+    SELECT p.material_type,
+           NOT EXISTS (SELECT 1 FROM sales_order_details d JOIN products dp ON dp.product_id = d.product_id
+                       WHERE d.order_id = NEW.order_id AND d.detail_id <> NEW.detail_id
+                         AND dp.material_type = p.material_type),
+           NEW.quantity, NEW.total_price
+    FROM products p
+    WHERE p.product_id = NEW.product_id
+    ON CONFLICT(material_type) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                             total_quantity = total_quantity + excluded.total_quantity,
+                                             total_amount = total_amount + excluded.total_amount;
+END;
+
+CREATE TRIGGER IF NOT EXISTS sales_summary_detail_delete
+AFTER DELETE ON sales_order_details
+FOR EACH ROW WHEN (SELECT status FROM sales_orders WHERE order_id = OLD.order_id) = '已完成'
+BEGIN
+    UPDATE sales_material_summary
+    SET order_count = order_count - NOT EXISTS (
+            SELECT 1 FROM sales_order_details d JOIN products dp ON dp.product_id = d.product_id
+            WHERE d.order_id = OLD.order_id AND dp.material_type = sales_material_summary.material_type),
+        total_quantity = total_quantity - OLD.quantity,
+        total_amount = total_amount - OLD.total_price
+    WHERE material_type = (SELECT material_type FROM products WHERE product_id = OLD.product_id);
+END;
+
+
+-- 库存预警表：只存处于预警状态的产品，由 products 上的触发器在库存或上下限变化时维护，
+-- 所有改库存的路径（调整、销售、取消、采购触发器、修改产品）都经过这里。
+-- 预警查询只读这张表，耗时与预警数量成正比而不是与产品总数成正比
+CREATE TABLE IF NOT EXISTS stock_alerts (
+    product_id INTEGER PRIMARY KEY REFERENCES products(product_id) ON DELETE CASCADE,
+    alert_type TEXT NOT NULL CHECK (alert_type IN ('库存不足', '库存过剩')),
+    alert_value INT NOT NULL,
+    severity INT NOT NULL  -- ABS(current_stock - min_stock_level)，预警列表的排序键
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_alerts_order ON stock_alerts(alert_type, severity DESC);
+
+CREATE TRIGGER IF NOT EXISTS stock_alerts_product_insert
+AFTER INSERT ON products
+FOR EACH ROW WHEN NEW.current_stock < NEW.min_stock_level OR NEW.current_stock > NEW.max_stock_level
+BEGIN
+    INSERT INTO stock_alerts (product_id, alert_type, alert_value, severity)
+    SELECT NEW.product_id,
+           CASE WHEN NEW.current_stock < NEW.min_stock_level THEN '库存不足' ELSE '库存过剩' END,
+           CASE WHEN NEW.current_stock < NEW.min_stock_level THEN NEW.min_stock_level - NEW.current_stock
+                ELSE NEW.current_stock - NEW.max_stock_level END,
+           ABS(NEW.current_stock - NEW.min_stock_level)
+    WHERE NEW.current_stock < NEW.min_stock_level OR NEW.current_stock > NEW.max_stock_level;
+END;
+
+-- 变化前后都不在预警状态的产品（绝大多数）不做任何事
+CREATE TRIGGER IF NOT EXISTS stock_alerts_product_update
+AFTER UPDATE OF current_stock, min_stock_level, max_stock_level ON products
+FOR EACH ROW WHEN OLD.current_stock < OLD.min_stock_level OR OLD.current_stock > OLD.max_stock_level
+               OR NEW.current_stock < NEW.min_stock_level OR NEW.current_stock > NEW.max_stock_level
+BEGIN
+    DELETE FROM stock_alerts WHERE product_id = OLD.product_id;
+    INSERT INTO stock_alerts (product_id, alert_type, alert_value, severity)
+    SELECT NEW.product_id,
+           CASE WHEN NEW.current_stock < NEW.min_stock_level THEN '库存不足' ELSE '库存过剩' END,
+           CASE WHEN NEW.current_stock < NEW.min_stock_level THEN NEW.min_stock_level - NEW.current_stock
+                ELSE NEW.current_stock - NEW.max_stock_level END,
+           ABS(NEW.current_stock - NEW.min_stock_level)
+    WHERE NEW.current_stock < NEW.min_stock_level OR NEW.current_stock > NEW.max_stock_level;
+END;
+
+INSERT INTO stock_alerts (product_id, alert_type, alert_value, severity)
+SELECT product_id,
+       CASE WHEN current_stock < min_stock_level THEN '库存不足' ELSE '库存过剩' END,
+       CASE WHEN current_stock < min_stock_level THEN min_stock_level - current_stock
+            ELSE current_stock - max_stock_level END,
+       ABS(current_stock - min_stock_level)
+FROM products
+WHERE current_stock < min_stock_level OR current_stock > max_stock_level;
+
+-- 全文搜索：FTS5 trigram 分词（按三字符切分，中文名称同样适用），外部内容表由触发器同步
+
+CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5(
+    customer_name, customer_code, contact_person,
+    content='customers', content_rowid='customer_id', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS customers_fts_insert AFTER INSERT ON customers
+BEGIN
+    INSERT INTO customers_fts(rowid, customer_name, customer_code, contact_person) VALUES (NEW.customer_id, NEW.customer_name, NEW.customer_code, NEW.contact_person);
+END;
+
+CREATE TRIGGER IF NOT EXISTS customers_fts_delete AFTER DELETE ON customers
+BEGIN
+    INSERT INTO customers_fts(customers_fts, rowid, customer_name, customer_code, contact_person) VALUES ('delete', OLD.customer_id, OLD.customer_name, OLD.customer_code, OLD.contact_person);
+END;
+
+CREATE TRIGGER IF NOT EXISTS customers_fts_update AFTER UPDATE OF customer_name, customer_code, contact_person ON customers
+BEGIN
+    INSERT INTO customers_fts(customers_fts, rowid, customer_name, customer_code, contact_person) VALUES ('delete', OLD.customer_id, OLD.customer_name, OLD.customer_code, OLD.contact_person);
+    INSERT INTO customers_fts(rowid, customer_name, customer_code, contact_person) VALUES (NEW.customer_id, NEW.customer_name, NEW.customer_code, NEW.contact_person);
+END;
+
+INSERT INTO customers_fts(customers_fts) VALUES ('rebuild');
+
+CREATE VIRTUAL TABLE IF NOT EXISTS suppliers_fts USING fts5(
+    supplier_name, supplier_code, contact_person,
+    content='suppliers', content_rowid='supplier_id', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS suppliers_fts_insert AFTER INSERT ON suppliers
+BEGIN
+    INSERT INTO suppliers_fts(rowid, supplier_name, supplier_code, contact_person) VALUES (NEW.supplier_id, NEW.supplier_name, NEW.supplier_code, NEW.contact_person);
+END;
+
+CREATE TRIGGER IF NOT EXISTS suppliers_fts_delete AFTER DELETE ON suppliers
+BEGIN
+    INSERT INTO suppliers_fts(suppliers_fts, rowid, supplier_name, supplier_code, contact_person) VALUES ('delete', OLD.supplier_id, OLD.supplier_name, OLD.supplier_code, OLD.contact_person);
+END;
+
+CREATE TRIGGER IF NOT EXISTS suppliers_fts_update AFTER UPDATE OF supplier_name, supplier_code, contact_person ON suppliers
+BEGIN
+    INSERT INTO suppliers_fts(suppliers_fts, rowid, supplier_name, supplier_code, contact_person) VALUES ('delete', OLD.supplier_id, OLD.supplier_name, OLD.supplier_code, OLD.contact_person);
+    INSERT INTO suppliers_fts(rowid, supplier_name, supplier_code, contact_person) VALUES (NEW.supplier_id, NEW.supplier_name, NEW.supplier_code, NEW.contact_person);
+END;
+
+INSERT INTO suppliers_fts(suppliers_fts) VALUES ('rebuild');
+
+CREATE VIRTUAL TABLE IF NOT EXISTS purchase_orders_fts USING fts5(
+    order_number,
+    content='purchase_orders', content_rowid='order_id', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS purchase_orders_fts_insert AFTER INSERT ON purchase_orders
+BEGIN
+    INSERT INTO purchase_orders_fts(rowid, order_number) VALUES (NEW.order_id, NEW.order_number);
+END;
+
+CREATE TRIGGER IF NOT EXISTS purchase_orders_fts_delete AFTER DELETE ON purchase_orders
+BEGIN
+    INSERT INTO purchase_orders_fts(purchase_orders_fts, rowid, order_number) VALUES ('delete', OLD.order_id, OLD.order_number);
+END;
+
+CREATE TRIGGER IF NOT EXISTS purchase_orders_fts_update AFTER UPDATE OF order_number ON purchase_orders
+BEGIN
+    INSERT INTO purchase_orders_fts(purchase_orders_fts, rowid, order_number) VALUES ('delete', OLD.order_id, OLD.order_number);
+    INSERT INTO purchase_orders_fts(rowid, order_number) VALUES (NEW.order_id, NEW.order_number);
+END;
+
+INSERT INTO purchase_orders_fts(purchase_orders_fts) VALUES ('rebuild');
+
+CREATE VIRTUAL TABLE IF NOT EXISTS sales_orders_fts USING fts5(
+    order_number,
+    content='sales_orders', content_rowid='order_id', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS sales_orders_fts_insert AFTER INSERT ON sales_orders
+BEGIN
+    INSERT INTO sales_orders_fts(rowid, order_number) VALUES (NEW.order_id, NEW.order_number);
+END;
+
+CREATE TRIGGER IF NOT EXISTS sales_orders_fts_delete AFTER DELETE ON sales_orders
+BEGIN
+    INSERT INTO sales_orders_fts(sales_orders_fts, rowid, order_number) VALUES ('delete', OLD.order_id, OLD.order_number);
+END;
+
+CREATE TRIGGER IF NOT EXISTS sales_orders_fts_update AFTER UPDATE OF order_number ON sales_orders
+BEGIN
+    INSERT INTO sales_orders_fts(sales_orders_fts, rowid, order_number) VALUES ('delete', OLD.order_id, OLD.order_number);
+    INSERT INTO sales_orders_fts(rowid, order_number) VALUES (NEW.order_id, NEW.order_number);
+END;
+
+INSERT INTO sales_orders_fts(sales_orders_fts) VALUES ('rebuild');
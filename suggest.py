@@ -0,0 +1,145 @@
+"""产品联想（typeahead）前缀索引
+
+进程内按字段各维护一个有序数组 [(关键字, 产品ID)]，查询时二分定位前缀，
+耗时与目录大小无关。关键字取自字段文本从每个"词起点"开始的后缀（见 index_keys），
+所以 "O型"、"型圈" 也能联想到 "氟胶O型圈-10mm"。
+
+索引在应用启动时加载（启动时加载失败则在首次查询时加载），产品新增/修改/删除后由路由增量更新；
+超过 max_age 秒重新加载一次，覆盖其他进程的写入。
+"""
+import bisect
+import threading
+import time
+
+_SEPARATORS = frozenset(' \t\r\n-_/\\,，、;；:：()（）[]【】')
+
+
+def _is_cjk(ch):
+    return '\u4e00' <= ch <= '\u9fff'
+
+
+def index_keys(text):
+    """文本的联想关键字：从每个词起点开始的后缀（小写）
+
+    词起点为开头、分隔符之后、字母数字串的开头；中文没有词边界，每个汉字都是起点。
+    """
+    text = (text or '').strip().lower()
+    keys = set()
+    prev = None
+    for i, ch in enumerate(text):
+        if ch in _SEPARATORS:
+            prev = None
+            continue
+        if prev is None or _is_cjk(ch) or _is_cjk(prev):
+            keys.add(text[i:])
+        prev = ch
+    return keys
+
+
+class PrefixIndex:
+    def __init__(self, id_field, key_fields, max_age=300.0):
+        self.id_field = id_field
+        self.key_fields = key_fields  # 按优先级排列，靠前字段的匹配先返回
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._records = {}  # 产品ID -> 记录
+        self._entries = {}  # 产品ID -> [(字段序号, 关键字)]
+        self._arrays = [[] for _ in key_fields]
+        self._generation = 0  # 每次增量更新递增，用于识别加载期间发生的写入
+        self.loaded_at = None
+
+    # ---------- 加载 ----------
+    def stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+
+    def begin_load(self):
+        """开始加载前调用，返回的标记交给 load()"""
+        with self._lock:
+            return self._generation
+
+    def load(self, rows, token):
+        """用全量数据重建索引；加载期间有增量更新时数据可能已过期，下次查询前重新加载"""
+        arrays = [[] for _ in self.key_fields]
+        records, entries = {}, {}
+        for row in rows:
+            row_id = row[self.id_field]
+            records[row_id] = dict(row)
+            entries[row_id] = self._keys_of(row)
+            for field_no, key in entries[row_id]:
+                arrays[field_no].append((key, row_id))
+        for array in arrays:
+            array.sort()
+
+        with self._lock:
+            self._records, self._entries, self._arrays = records, entries, arrays
+            self.loaded_at = time.monotonic() if token == self._generation else None
+
+    def _keys_of(self, record):
+        return [(field_no, key)
+                for field_no, field in enumerate(self.key_fields)
+                for key in index_keys(record.get(field))]
+
+    # ---------- 增量更新 ----------
+    def upsert(self, row_id, changes):
+        """新增或修改一条记录；changes 为变化的字段，修改时与已有记录合并"""
+        with self._lock:
+            self._generation += 1
+            if self.loaded_at is None:
+                return
+            record = dict(self._records.get(row_id, {self.id_field: row_id}))
+            record.update(changes)
+            self._remove_locked(row_id)
+            self._records[row_id] = record
+            self._entries[row_id] = self._keys_of(record)
+            for field_no, key in self._entries[row_id]:
+                bisect.insort(self._arrays[field_no], (key, row_id))
+
+    def invalidate(self):
+        """批量写入后调用：下次查询前重新加载，比逐条增量更新快"""
+        with self._lock:
+            self._generation += 1
+            self.loaded_at = None
+
+    def remove(self, row_id):
+        with self._lock:
+            self._generation += 1
+            if self.loaded_at is not None:
+                self._remove_locked(row_id)
+
+    def _remove_locked(self, row_id):
+        self._records.pop(row_id, None)
+        for field_no, key in self._entries.pop(row_id, ()):
+            array = self._arrays[field_no]
+            i = bisect.bisect_left(array, (key, row_id))
+            if i < len(array) and array[i] == (key, row_id):
+                del array[i]
+
+    # ---------- 查询 ----------
+    def search(self, prefix, limit=10):
+        """前缀匹配的记录，最多 limit 条；按字段优先级、再按关键字顺序排列"""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        found = {}
+        with self._lock:
+            for array in self._arrays:
+                i = bisect.bisect_left(array, (prefix,))
+                while i < len(array) and len(found) < limit:
+                    key, row_id = array[i]
+                    if not key.startswith(prefix):
+                        break
+                    if row_id not in found:
+                        found[row_id] = self._records[row_id]
+                    i += 1
+                if len(found) >= limit:
+                    break
+        return list(found.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'records': len(self._records),
+                'keys': sum(len(array) for array in self._arrays),
+                'age': None if self.loaded_at is None else round(time.monotonic() - self.loaded_at, 1)
+            }
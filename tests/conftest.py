@@ -0,0 +1,69 @@
+"""测试在临时目录的 SQLite 库上运行整个 Flask 应用（DB_BACKEND=sqlite），不需要 MySQL
+
+app.py 在导入时读取环境变量并建库，所以在 session 级 fixture 中先设置环境变量再导入。
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    db_dir = tmp_path_factory.mktemp('db')
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['SQLITE_PATH'] = str(db_dir / 'inventory.db')
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def statements(monkeypatch):
+    """记录 SQLite 游标执行的语句"""
+    executed = []
+    execute = backends.SQLiteCursor.execute
+
+    def counting(self, query, params=()):
+        executed.append(query)
+        return execute(self, query, params)
+    monkeypatch.setattr(backends.SQLiteCursor, 'execute', counting)
+    return executed
+
+
+@pytest.fixture
+def customer_id(client):
+    return client.get('/api/customers?limit=1').get_json()['data'][0]['customer_id']
+
+
+@pytest.fixture
+def supplier_id(client):
+    return client.get('/api/suppliers?limit=1').get_json()['data'][0]['supplier_id']
+
+
+@pytest.fixture
+def product(client):
+    """每个测试新建一个库存为 100 的产品，互不影响"""
+    create = client.post('/api/products', json={
+        'product_code': f'T{os.urandom(4).hex()}', 'product_name': '测试产品', 'material_type': '其他',
+        'unit_price': 2.5, 'current_stock': 100})
+    assert create.status_code == 201, create.get_json()
+    return client.get(f"/api/products/{create.get_json()['product_id']}").get_json()
+
+
+def stock(client, product_id):
+    return client.get(f'/api/products/{product_id}').get_json()['current_stock']
+
+
+def latest_transaction(client, product_id):
+    """产品最新的一条库存流水；同一秒内的流水按 transaction_id 区分先后"""
+    rows = client.get(f'/api/inventory/transactions?product_id={product_id}&limit=100').get_json()
+    return max(rows, key=lambda row: row['transaction_id'])
@@ -0,0 +1,114 @@
+"""异步服务模式：GET 由协程处理且与 Flask 路由结果一致，其余请求转交 Flask"""
+import asyncio
+import json
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def asgi(app_module):
+    """导入 asgi 并完成 lifespan startup；整个模块共用一个事件循环"""
+    import asgi
+    loop = asyncio.new_event_loop()
+    messages = asyncio.Queue()
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def startup():
+        await messages.put({'type': 'lifespan.startup'})
+        task = asyncio.ensure_future(asgi.lifespan(messages.get, send))
+        while not sent:
+            await asyncio.sleep(0.01)
+        return task
+
+    task = loop.run_until_complete(startup())
+    assert sent == [{'type': 'lifespan.startup.complete'}]
+    asgi.loop = loop
+    yield asgi
+    task.cancel()
+    loop.close()
+
+
+def call(asgi, method, path, query=b'', payload=None, headers=()):
+    body = json.dumps(payload).encode() if payload is not None else b''
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+             'headers': [(b'content-type', b'application/json')] + list(headers), 'client': ('127.0.0.1', 1)}
+    messages = [{'type': 'http.request', 'body': body}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        await asgi.application(scope, receive, send)
+        return sent[0]['status'], json.loads(sent[1]['body']) if sent[1]['body'] else None
+    return run()
+
+
+def request(asgi, *args, **kwargs):
+    return asgi.loop.run_until_complete(call(asgi, *args, **kwargs))
+
+
+def test_get_matches_flask(asgi, client):
+    status, body = request(asgi, 'GET', '/api/products', b'limit=3')
+    assert status == 200
+    assert body == client.get('/api/products?limit=3').get_json()
+
+    status, body = request(asgi, 'GET', '/api/products/999999')
+    assert (status, body) == (404, {'error': '产品不存在'})
+
+
+def test_writes_go_through_flask(asgi, client):
+    status, body = request(asgi, 'POST', '/api/customers', payload={
+        'customer_code': 'ASGI01', 'customer_name': '异步客户'})
+    assert status == 201
+    status, customer = request(asgi, 'GET', f"/api/customers/{body['customer_id']}")
+    assert (status, customer['customer_name']) == (200, '异步客户')
+
+
+def test_concurrent_reads(asgi):
+    async def many():
+        return await asyncio.gather(*[call(asgi, 'GET', '/api/products/1') for _ in range(100)])
+    results = asgi.loop.run_until_complete(many())
+    assert {status for status, _ in results} == {200}
+
+
+def test_lifespan_warms_suggest_index(asgi, monkeypatch):
+    monkeypatch.setattr(asgi.product_index, 'loaded_at', None)
+    asgi.loop.run_until_complete(asgi.warm_product_index())
+    assert not asgi.product_index.stale()
+
+
+def test_conditional_get(asgi, client, product, monkeypatch):
+    """异步模式的 ETag 与 Flask 路由一致，来自同一个数据版本探针"""
+    validators, shift = asgi.validators, {'seconds': 5}
+    monkeypatch.setattr(asgi, 'validators', lambda key, version, last_modified, now:
+                        validators(key, version, last_modified, now + shift['seconds']))
+    path = f"/api/products/{product['product_id']}"
+
+    async def etag_of():
+        sent = []
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': [],
+                 'client': ('127.0.0.1', 1)}
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            sent.append(message)
+        await asgi.application(scope, receive, send)
+        return dict(sent[0]['headers'])[b'etag']
+
+    etag = asgi.loop.run_until_complete(etag_of())
+    assert request(asgi, 'GET', path, headers=[(b'if-none-match', etag)]) == (304, None)
+
+    # 同一秒内的写入之后不能再得到 304
+    client.put(path, json={'unit_price': 9})
+    shift['seconds'] = 0
+    status, body = request(asgi, 'GET', path, headers=[(b'if-none-match', etag)])
+    assert (status, body['unit_price']) == (200, 9)
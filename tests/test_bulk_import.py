@@ -0,0 +1,55 @@
+"""批量导入：CSV / NDJSON 流式读取，逐行报告结果，编码查重，分块事务"""
+import json
+
+from conftest import latest_transaction, stock
+
+CSV_HEADER = 'product_code,product_name,material_type,unit_price,current_stock\n'
+
+
+def post_import(client, body, content_type):
+    return client.post('/api/products/import', data=body.encode('utf-8'), content_type=content_type)
+
+
+def test_csv_import(client):
+    body = CSV_HEADER + 'IMP-C1,导入垫片,垫片,1.2,30\nIMP-C2,导入圈,氟胶,0.8,\n'
+    response = post_import(client, body, 'text/csv')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert (result['total'], result['created'], result['failed']) == (2, 2, 0)
+
+    first = result['results'][0]
+    assert stock(client, first['product_id']) == 30
+    assert latest_transaction(client, first['product_id'])['quantity_after'] == 30
+    assert client.get(f"/api/products/{result['results'][1]['product_id']}").get_json()['current_stock'] == 0
+
+
+def test_ndjson_row_errors(client, product):
+    lines = [
+        {'product_code': 'IMP-N1', 'product_name': '正常行', 'material_type': '其他', 'unit_price': 1},
+        {'product_code': 'IMP-N1', 'product_name': '导入数据中重复', 'material_type': '其他', 'unit_price': 1},
+        {'product_code': product['product_code'], 'product_name': '库中已存在', 'material_type': '其他',
+         'unit_price': 1},
+        {'product_code': 'IMP-N2', 'product_name': '缺单价', 'material_type': '其他'},
+        {'product_code': 'IMP-N3', 'product_name': '材料不对', 'material_type': '金属', 'unit_price': 1},
+    ]
+    body = '\n'.join(json.dumps(line, ensure_ascii=False) for line in lines) + '\n\nnot json\n'
+    result = post_import(client, body, 'application/x-ndjson').get_json()
+
+    statuses = [(row['row'], row['status']) for row in result['results']]
+    assert statuses == [(1, 'created'), (2, 'error'), (3, 'error'), (4, 'error'), (5, 'error'), (7, 'error')]
+    errors = [row.get('error') for row in result['results']]
+    assert errors[2] == '产品编码已存在'
+    assert errors[5] == '不是合法的 JSON'
+
+
+def test_import_in_small_chunks(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'IMPORT_CHUNK_SIZE', 2)
+    rows = ''.join(f'IMP-K{i},分块{i},其他,1,{i}\n' for i in range(5))
+    result = post_import(client, CSV_HEADER + rows, 'text/csv').get_json()
+    assert result['created'] == 5
+    assert [row['row'] for row in result['results']] == [1, 2, 3, 4, 5]
+    assert client.get('/api/products/suggest?q=imp-k').get_json()
+
+
+def test_unsupported_format(client):
+    assert post_import(client, '<xml/>', 'application/xml').status_code == 400
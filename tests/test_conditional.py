@@ -0,0 +1,70 @@
+"""条件 GET：ETag / Last-Modified 来自数据库中的数据版本探针，其他进程的写入也能反映出来"""
+import pytest
+
+
+@pytest.fixture
+def settled(app_module, monkeypatch):
+    """让探针看到的数据库时间晚 5 秒：最后一次修改已不在当前这一秒"""
+    data_version = app_module.repo.data_version
+
+    def later(cursor, tables):
+        version, last_modified, now = data_version(cursor, tables)
+        return version, last_modified, now + 5
+    monkeypatch.setattr(app_module.repo, 'data_version', later)
+
+
+def test_not_modified(client, product, settled):
+    url = f"/api/products/{product['product_id']}"
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.headers['Last-Modified']
+
+    again = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == first.headers['ETag']
+    assert again.data == b''
+
+    since = client.get(url, headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert since.status_code == 304
+
+
+def test_no_304_within_the_modified_second(client, product):
+    """最后一次修改还在数据库当前这一秒：后续写入可能不改变 MAX(updated_at)，不能返回 304"""
+    url = f"/api/products/{product['product_id']}"
+    first = client.get(url)
+    assert 'Last-Modified' not in first.headers
+    assert client.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+
+
+def test_write_from_other_process_changes_etag(app_module, client, product, settled):
+    """不经过本进程的写入（表版本不变）也会改变 ETag"""
+    url = f"/api/products/{product['product_id']}"
+    etag = client.get(url).headers['ETag']
+    with app_module.db_cursor() as (conn, cursor):
+        cursor.execute("""
+            INSERT INTO products (product_code, product_name, material_type, unit_price)
+            VALUES (%s, '其他进程新建', '其他', 1)
+        """, (f"{product['product_code']}-X",))
+        conn.commit()
+
+    after = client.get(url, headers={'If-None-Match': etag})
+    assert after.status_code == 200
+    assert after.headers['ETag'] != etag
+
+
+def test_etag_depends_on_query(client, product, settled):
+    first = client.get('/api/products?limit=5')
+    other = client.get('/api/products?limit=6')
+    assert first.headers['ETag'] != other.headers['ETag']
+    assert client.get('/api/products?limit=6', headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+
+
+def test_list_etag_changes_after_order(client, supplier_id, product, settled):
+    first = client.get('/api/purchase/orders?limit=5')
+    etag = first.headers['ETag']
+    client.post('/api/purchase/orders', json={'supplier_id': supplier_id, 'order_date': '2026-10-18',
+                                              'items': [{'product_id': product['product_id'], 'quantity': 1,
+                                                         'unit_price': 1}]})
+    after = client.get('/api/purchase/orders?limit=5', headers={'If-None-Match': etag})
+    assert after.status_code == 200
+    assert after.headers['ETag'] != etag
@@ -0,0 +1,52 @@
+"""列表总数策略：exact（按筛选条件缓存、写入后失效）、estimate、none"""
+from cache import TableVersions, VersionedCache
+
+
+def test_count_strategies(client, product):
+    exact = client.get('/api/products?limit=1').get_json()
+    assert exact['total_type'] == 'exact'
+    assert exact['total'] >= 1
+
+    estimated = client.get('/api/products?limit=1&count=estimate').get_json()
+    assert estimated['total_type'] == 'estimated'
+    assert estimated['total'] >= exact['total']
+
+    none = client.get('/api/products?limit=1&count=none').get_json()
+    assert (none['total'], none['total_type'], none['total_pages']) == (None, 'none', None)
+
+    # 有筛选条件时无法估算，仍返回精确值
+    filtered = client.get('/api/products?limit=1&count=estimate&material_type=其他').get_json()
+    assert filtered['total_type'] == 'exact'
+
+    assert client.get('/api/products?count=approx').status_code == 400
+
+
+def test_cached_total_invalidated_by_write(client, product):
+    before = client.get('/api/products?limit=1').get_json()['total']
+    client.post('/api/products', json={'product_code': 'COUNT-NEW', 'product_name': '计数',
+                                       'material_type': '其他', 'unit_price': 1})
+    assert client.get('/api/products?limit=1').get_json()['total'] == before + 1
+
+
+def test_count_cache_versions_and_ttl(monkeypatch):
+    import cache
+    now = [100.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    versions = TableVersions()
+    counts = VersionedCache(versions, ttl=10)
+    key = ('FROM products WHERE 1=1', ())
+
+    counts.put(('products',), key, 42, versions.get(('products',)))
+    assert counts.get(('products',), key) == 42
+    versions.bump('customers')
+    assert counts.get(('products',), key) == 42
+
+    # 查询期间发生的写入：用查询前的版本写入的条目直接失效
+    stale = versions.get(('products',))
+    versions.bump('products')
+    counts.put(('products',), key, 42, stale)
+    assert counts.get(('products',), key) is None
+
+    counts.put(('products',), key, 43, versions.get(('products',)))
+    now[0] += 10
+    assert counts.get(('products',), key) is None
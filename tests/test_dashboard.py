@@ -0,0 +1,32 @@
+"""仪表盘：整个目录的库存汇总、预警和待处理订单数，短 TTL 缓存并随写入失效"""
+
+
+def test_dashboard_covers_whole_catalog(client, product):
+    dashboard = client.get('/api/dashboard').get_json()
+    products = client.get('/api/products?limit=100000&count=none').get_json()['data']
+    inventory = dashboard['inventory']
+    assert inventory['total_products'] == len(products)
+    assert inventory['total_items'] == sum(row['current_stock'] for row in products)
+    assert inventory['total_value'] == round(sum(row['current_stock'] * row['unit_price'] for row in products), 2)
+    assert inventory['by_material']['其他']['product_count'] >= 1
+
+    alerts = client.get('/api/inventory/alerts').get_json()
+    assert dashboard['alerts']['low_stock'] == sum(row['alert_type'] == '库存不足' for row in alerts)
+    assert dashboard['alerts']['overstock'] == sum(row['alert_type'] == '库存过剩' for row in alerts)
+    assert len(dashboard['alerts']['top']) <= 5
+
+    pending = client.get('/api/purchase/orders/pending').get_json()['pending_count']
+    assert dashboard['pending']['purchase_orders'] == pending
+    assert set(dashboard['sales']) == set(client.get('/api/statistics/sales').get_json())
+
+
+def test_dashboard_cache_invalidated_by_stock_change(client, product):
+    client.get('/api/dashboard')
+    cached = client.get('/api/dashboard')
+    assert cached.headers['X-Cache'] == 'HIT'
+    total = cached.get_json()['inventory']['total_items']
+
+    client.post('/api/inventory/adjust', json={'product_id': product['product_id'], 'quantity': 130})
+    fresh = client.get('/api/dashboard')
+    assert fresh.headers['X-Cache'] == 'MISS'
+    assert fresh.get_json()['inventory']['total_items'] == total + 30
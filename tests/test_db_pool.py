@@ -0,0 +1,120 @@
+"""连接池：复用、借用时 ping、最大存活时间和空闲淘汰、借用超时"""
+import pytest
+
+import db_pool
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.alive = True
+        self.closed = False
+        self.rollbacks = 0
+
+    def ping(self):
+        if not self.alive:
+            raise OSError('连接已断开')
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(db_pool.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def created():
+    return []
+
+
+def make_pool(created, **options):
+    def creator():
+        created.append(FakeConnection(len(created) + 1))
+        return created[-1]
+    return ConnectionPool(creator, **options)
+
+
+def test_connection_is_reused_and_reset(clock, created):
+    pool = make_pool(created, pool_size=2)
+    with pool.connection() as conn:
+        first = conn.raw
+    with pool.connection() as conn:
+        assert conn.raw is first
+    assert len(created) == 1
+    assert first.rollbacks == 2
+    assert pool.stats()['in_use'] == 0
+
+
+def test_dead_connection_is_replaced_on_borrow(clock, created):
+    pool = make_pool(created, ping_after=0)
+    pool.acquire().close()
+    created[0].alive = False
+
+    conn = pool.acquire()
+    assert conn.raw is created[1]
+    assert created[0].closed
+    assert pool.stats()['ping_failures'] == 1
+
+
+def test_idle_and_expired_connections_are_evicted(clock, created):
+    pool = make_pool(created, pool_size=2, idle_timeout=10, max_lifetime=100)
+    first, second = pool.acquire(), pool.acquire()
+    first.close()
+    clock.now += 11
+    second.close()
+    assert pool.stats()['idle'] == 1
+    assert created[0].closed
+
+    # 超过最大存活时间的连接归还时直接关闭
+    conn = pool.acquire()
+    clock.now += 100
+    conn.close()
+    assert created[1].closed
+    assert pool.stats()['open'] == 0
+
+
+def test_borrow_timeout(clock, created):
+    pool = make_pool(created, pool_size=1, borrow_timeout=0)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+
+    held.close()
+    pool.acquire().close()
+    assert len(created) == 1
+
+
+def test_connection_returned_when_handler_raises(clock, created):
+    pool = make_pool(created, pool_size=1, borrow_timeout=0)
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError
+    assert pool.stats()['in_use'] == 0
+    pool.acquire().close()
+
+
+def test_exhausted_pool_returns_503(app_module, client, clock, created, monkeypatch):
+    pool = make_pool(created, pool_size=1, borrow_timeout=0)
+    monkeypatch.setattr(app_module, 'db_pool', pool)
+    held = pool.acquire()
+
+    response = client.get('/api/categories')
+    assert response.status_code == 503
+    held.close()
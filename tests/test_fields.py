@@ -0,0 +1,37 @@
+"""稀疏字段集：fields= 只返回请求的字段（主键和排序列总会返回），未知字段返回 400"""
+
+
+def test_list_fields(client, product):
+    body = client.get('/api/products?limit=5&fields=product_code,product_name').get_json()
+    assert body['data']
+    assert all(set(row) == {'product_id', 'product_code', 'product_name'} for row in body['data'])
+
+    # 排序列是游标的一部分，总会返回
+    rows = client.get('/api/products?limit=5&fields=product_code&sort=updated_at').get_json()['data']
+    assert set(rows[0]) == {'product_id', 'product_code', 'updated_at'}
+
+
+def test_detail_fields(client, product):
+    pid = product['product_id']
+    body = client.get(f'/api/products/{pid}?fields=current_stock').get_json()
+    assert body == {'product_id': pid, 'current_stock': 100}
+
+
+def test_order_fields_with_joined_columns(client, supplier_id, product):
+    client.post('/api/purchase/orders', json={
+        'supplier_id': supplier_id, 'order_date': '2026-10-18',
+        'items': [{'product_id': product['product_id'], 'quantity': 1, 'unit_price': 1}]})
+    url = '/api/purchase/orders?limit=5&include=none&fields='
+    rows = client.get(url + 'order_number,supplier_name').get_json()['data']
+    assert rows
+    assert all(set(row) == {'order_id', 'order_number', 'supplier_name'} for row in rows)
+
+    # 没有请求关联表字段时不关联供应商表
+    rows = client.get(url + 'status').get_json()['data']
+    assert all(set(row) == {'order_id', 'status'} for row in rows)
+
+
+def test_unknown_field(client):
+    response = client.get('/api/customers?fields=customer_name,password')
+    assert response.status_code == 400
+    assert 'password' in response.get_json()['error']
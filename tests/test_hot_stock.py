@@ -0,0 +1,127 @@
+"""热门产品合并扣减：同一窗口的扣减一批写入，预留在扣减事务中落库，订单提交时认领，失败或超时退回"""
+import threading
+
+import time
+
+import pytest
+
+import backends
+from conftest import latest_transaction, stock
+from hot_stock import StockCoalescer
+
+
+@pytest.fixture
+def coalescer(app_module, product, monkeypatch):
+    coalescer = StockCoalescer([product['product_id']], app_module.allocate_hot_stock,
+                               app_module.release_hot_stock, window=0)
+    monkeypatch.setattr(app_module, 'stock_coalescer', coalescer)
+    return coalescer
+
+
+def test_order_claims_reservation(client, customer_id, product, coalescer):
+    pid = product['product_id']
+    response = client.post('/api/sales/orders', json={
+        'customer_id': customer_id, 'order_date': '2026-10-18',
+        'items': [{'product_id': pid, 'quantity': 6, 'unit_price': 1}]})
+    assert response.status_code == 201
+    assert stock(client, pid) == 94
+
+    ledger = latest_transaction(client, pid)
+    assert ledger['reference_id'] == response.get_json()['order_id']
+    assert (ledger['quantity_before'], ledger['quantity_after']) == (100, 94)
+
+
+def test_failed_order_releases_reservation(client, customer_id, product, coalescer):
+    pid = product['product_id']
+    response = client.post('/api/sales/orders', json={
+        'customer_id': customer_id, 'order_date': '2026-10-18',
+        'items': [{'product_id': pid, 'quantity': 6, 'unit_price': 1},
+                  {'product_id': 1, 'quantity': 10 ** 9, 'unit_price': 1}]})
+    assert response.status_code == 400
+    assert stock(client, pid) == 100
+    assert coalescer.stats()['released'] == 1
+
+
+def test_unclaimed_reservation_is_reclaimed(app_module, client, product, coalescer, monkeypatch):
+    pid = product['product_id']
+    # 预留后进程崩溃：没有订单认领，也没有退回
+    coalescer.reserve([(pid, 9, 1.0)])
+    assert stock(client, pid) == 91
+    assert app_module.reclaim_hot_stock() == 0
+
+    monkeypatch.setattr(app_module, 'HOT_STOCK_RESERVATION_TTL', -1)
+    assert app_module.reclaim_hot_stock() == 1
+    assert stock(client, pid) == 100
+    ledger = latest_transaction(client, pid)
+    assert (ledger['quantity_change'], ledger['quantity_before'], ledger['quantity_after']) == (9, 91, 100)
+
+
+def test_concurrent_requests_share_batches(app_module, client, product):
+    """库存 100，11 个请求各扣 10：接受 10 个、拒绝 1 个，批次数少于请求数"""
+    pid = product['product_id']
+    coalescer = StockCoalescer([pid], app_module.allocate_hot_stock, app_module.release_hot_stock,
+                               window=0.05)
+    results = []
+    lock = threading.Lock()
+
+    def reserve():
+        result = coalescer.reserve([(pid, 10, 1.0)])
+        with lock:
+            results.append(result)
+
+    threads = [threading.Thread(target=reserve) for _ in range(11)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    accepted = sorted(result[pid][1:] for result in results if result is not None)
+    assert accepted == [(before, before - 10) for before in range(10, 101, 10)]
+    assert results.count(None) == 1
+    assert stock(client, pid) == 0
+    stats = coalescer.stats()
+    assert (stats['requests'], stats['rejected']) == (11, 1)
+    assert stats['batches'] < 11
+
+
+def test_batch_ledger_rows_in_one_insert(app_module, client, product, monkeypatch):
+    """一批扣减的出库流水用一条 INSERT 写入（mysql-connector 合并为多行 VALUES），每个预留对应自己的流水"""
+    statements = []
+    for method in ('execute', 'executemany'):
+        def recording(self, query, params=(), _original=getattr(backends.SQLiteCursor, method)):
+            statements.append(query)
+            return _original(self, query, params)
+        monkeypatch.setattr(backends.SQLiteCursor, method, recording)
+    pid = product['product_id']
+    with app_module.db_cursor(dictionary=True) as (conn, cursor):
+        results = app_module.repo.allocate_stock(cursor, pid, [30, 80, 20], 0)
+        conn.commit()
+    assert [result and result[1:] for result in results] == [(100, 70), None, (70, 50)]
+    assert sum('INSERT INTO inventory_transactions' in query for query in statements) == 1
+
+    rows = client.get(f'/api/inventory/transactions?product_id={pid}&limit=100').get_json()
+    by_id = {row['transaction_id']: row for row in rows}
+    for transaction_id, before, after in filter(None, results):
+        assert (by_id[transaction_id]['quantity_before'], by_id[transaction_id]['quantity_after']) == (before, after)
+
+
+def test_reclaim_thread_starts_explicitly(app_module, caplog):
+    """构造时不启动后台线程；start() 之后退回失败记录日志"""
+    attempted = threading.Event()
+
+    def reclaim():
+        attempted.set()
+        raise ConnectionError('数据库不可用')
+    coalescer = StockCoalescer([], app_module.allocate_hot_stock, app_module.release_hot_stock,
+                               reclaim=reclaim, reclaim_interval=60)
+    assert not attempted.wait(0.05)
+
+    with caplog.at_level('WARNING', logger='hot_stock'):
+        coalescer.start()
+        coalescer.start()
+        assert attempted.wait(5)
+        for _ in range(100):
+            if '退回过期库存预留失败' in caplog.text:
+                break
+            time.sleep(0.01)
+    assert '退回过期库存预留失败: 数据库不可用' in caplog.text
@@ -0,0 +1,90 @@
+"""Idempotency-Key：重复的写请求只执行一次，返回第一次的响应"""
+import threading
+
+from conftest import stock
+from idempotency import BUSY, MISMATCH, REPLAY, RUN, IdempotencyStore, IdempotencyTable
+
+
+def place_order(client, customer_id, items, key):
+    return client.post('/api/sales/orders', json={
+        'customer_id': customer_id, 'order_date': '2026-10-18', 'items': items},
+        headers={'Idempotency-Key': key})
+
+
+def test_idempotent_replay(client, customer_id, product):
+    pid = product['product_id']
+    items = [{'product_id': pid, 'quantity': 4, 'unit_price': 1}]
+    first = place_order(client, customer_id, items, f'order-{pid}')
+    second = place_order(client, customer_id, items, f'order-{pid}')
+    assert first.status_code == second.status_code == 201
+    assert second.headers.get('Idempotent-Replayed') == 'true'
+    assert second.get_json() == first.get_json()
+    assert stock(client, pid) == 96
+
+    # 同一个键用于内容不同的请求
+    other = place_order(client, customer_id, items + items, f'order-{pid}')
+    assert other.status_code == 422
+    assert stock(client, pid) == 96
+
+    # 没有带键的请求照常执行
+    client.post('/api/sales/orders', json={'customer_id': customer_id, 'order_date': '2026-10-18',
+                                           'items': items})
+    assert stock(client, pid) == 92
+
+
+def test_key_too_long(client, customer_id, product):
+    items = [{'product_id': product['product_id'], 'quantity': 1, 'unit_price': 1}]
+    assert place_order(client, customer_id, items, 'k' * 201).status_code == 400
+    assert stock(client, product['product_id']) == 100
+
+
+
+def test_store_failure_is_logged(app_module, client, customer_id, product, monkeypatch, caplog):
+    """保存结果失败不影响响应，记录到 app.logger"""
+    def fail(*args):
+        raise ConnectionError('数据库不可用')
+    monkeypatch.setattr(app_module.idempotency, 'complete', fail)
+    items = [{'product_id': product['product_id'], 'quantity': 1, 'unit_price': 1}]
+    with caplog.at_level('WARNING', logger=app_module.app.logger.name):
+        assert place_order(client, customer_id, items, f"log-{product['product_id']}").status_code == 201
+    assert '保存幂等键结果失败: 数据库不可用' in caplog.text
+
+def test_duplicate_waits_for_first():
+    store = IdempotencyStore(wait_timeout=5)
+    assert store.begin('k', 'a') == (RUN, None)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(store.begin('k', 'a')))
+    waiter.start()
+    store.complete('k', 201, '{}')
+    waiter.join()
+    assert results == [(REPLAY, (201, '{}'))]
+
+    # 第一次请求失败释放键后，重试重新执行
+    assert store.begin('r', 'a') == (RUN, None)
+    store.release('r')
+    assert store.begin('r', 'a') == (RUN, None)
+    assert store.begin('r', 'b') == (MISMATCH, None)
+
+
+def test_wait_timeout_is_busy():
+    store = IdempotencyStore(wait_timeout=0.05)
+    assert store.begin('k', 'a') == (RUN, None)
+    assert store.begin('k', 'a') == (BUSY, None)
+
+
+def test_table_shared_between_processes(app_module):
+    """两个进程（两个 IdempotencyStore）通过 idempotency_keys 表共享键"""
+    table = IdempotencyTable(app_module.repo, app_module.db_cursor, poll_interval=0.01)
+    first = IdempotencyStore(table=table)
+    second = IdempotencyStore(table=table, wait_timeout=0.05)
+
+    assert first.begin('shared', 'a') == (RUN, None)
+    assert second.begin('shared', 'a') == (BUSY, None)
+    first.complete('shared', 201, '{"order_id": 1}')
+    assert second.begin('shared', 'a') == (REPLAY, (201, '{"order_id": 1}'))
+    assert second.begin('shared', 'b') == (MISMATCH, None)
+
+    assert first.begin('failed', 'a') == (RUN, None)
+    first.release('failed')
+    assert second.begin('failed', 'a') == (RUN, None)
+    second.release('failed')
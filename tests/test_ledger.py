@@ -0,0 +1,287 @@
+"""库存流水延迟写入：spool 重放、已写入序号、登记行、段文件轮换、写库失败后补写"""
+import json
+import os
+
+import pytest
+
+from ledger import LedgerWriter
+
+
+class FakeDatabase:
+    """write / flushed_seq 的内存实现：commits 为已提交的登记行；fail 为 True 时写入失败"""
+
+    def __init__(self):
+        self.seq = 0
+        self.rows = []
+        self.commits = set()
+        self.fail = False
+
+    def write(self, spool_key, advance, groups):
+        if self.fail:
+            raise ConnectionError('数据库不可用')
+        rows = [row for seq, group in groups if (spool_key, seq) in self.commits for row in group]
+        self.commits -= {(spool_key, seq) for seq, _ in groups}
+        self.rows.extend(rows)
+        self.seq += advance
+        return len(rows)
+
+    def flushed_seq(self, spool_key):
+        return self.seq
+
+
+@pytest.fixture
+def database():
+    return FakeDatabase()
+
+
+def open_writer(tmp_path, database, **options):
+    # 后台线程不会在测试期间自动写入，由测试调用 flush
+    return LedgerWriter(str(tmp_path / 'spool'), database.write, database.flushed_seq,
+                        batch_size=100, flush_interval=60, fsync=False, **options)
+
+
+def row(n):
+    return (n, '库存调整', None, None, n, 0, n, None, None, '2026-10-18 00:00:00')
+
+
+def commit(writer, database, *rows):
+    """模拟一个提交的请求：事务提交前写 spool，事务中登记，请求结束后 finish"""
+    seq = writer.prepare(list(rows))
+    database.commits.add((writer.key, seq))
+    writer.finish(seq)
+    return seq
+
+
+def test_flush_advances_flushed_seq(tmp_path, database):
+    writer = open_writer(tmp_path, database)
+    assert commit(writer, database, row(1), row(2)) == 1
+    assert commit(writer, database, row(3)) == 2
+    assert writer.flush() == 3
+    assert database.rows == [row(1), row(2), row(3)]
+    assert database.seq == 2
+    assert database.commits == set()
+    assert writer.stats()['queue_depth'] == 0
+
+    commit(writer, database, row(4))
+    assert writer.flush() == 1
+    assert database.seq == 3
+    key = writer.key
+    writer.close()
+
+    # 重启后沿用同一个键，序号继续递增；当前段中已写入的组按已写入序号跳过
+    writer = open_writer(tmp_path, database)
+    assert writer.key == key
+    assert commit(writer, database, row(5)) == 4
+    assert writer.flush() == 1
+    assert database.seq == 4
+    assert [r[0] for r in database.rows] == [1, 2, 3, 4, 5]
+    writer.close()
+
+
+def test_rolled_back_entries_are_discarded(tmp_path, database):
+    """请求事务回滚时登记行不存在，spool 中的组丢弃，已写入序号照样推进"""
+    writer = open_writer(tmp_path, database)
+    writer.finish(writer.prepare([row(1)]))
+    commit(writer, database, row(2))
+    assert writer.flush() == 2
+    assert database.rows == [row(2)]
+    assert database.seq == 2
+    assert writer.stats()['discarded_rows'] == 1
+    writer.close()
+
+
+def test_unfinished_request_blocks_later_entries(tmp_path, database):
+    """请求还没结束的组不写入，之后的组也等它结束，已写入序号之前不留未决的组"""
+    writer = open_writer(tmp_path, database)
+    seq = writer.prepare([row(1)])
+    commit(writer, database, row(2))
+    assert writer.flush() == 0
+    assert writer.stats()['in_flight'] == 1
+
+    database.commits.add((writer.key, seq))
+    writer.finish(seq)
+    assert writer.flush() == 2
+    assert database.rows == [row(1), row(2)]
+    writer.close()
+
+
+def test_replay_after_restart(tmp_path, database):
+    """请求事务已提交、流水还没写库时进程退出：重启后按登记行补写，未提交的丢弃"""
+    writer = open_writer(tmp_path, database)
+    commit(writer, database, row(1), row(2))
+    writer.prepare([row(3)])  # 请求事务提交前进程崩溃，没有登记行
+    database.fail = True
+    writer.close()
+    assert database.rows == []
+
+    database.fail = False
+    writer = open_writer(tmp_path, database)
+    assert writer.stats()['replayed'] == 3
+    assert writer.flush() == 3
+    assert database.rows == [row(1), row(2)]
+    assert database.seq == 2
+    writer.close()
+
+    # 再次重启不会重复写入
+    writer = open_writer(tmp_path, database)
+    assert writer.flush() == 0
+    assert database.rows == [row(1), row(2)]
+    writer.close()
+
+
+def test_replay_skips_flushed_entries(tmp_path, database):
+    """写库事务已提交、段文件还没删除时崩溃：重放时跳过序号不大于已写入序号的组"""
+    writer = open_writer(tmp_path, database)
+    key = writer.key
+    writer.close()
+    with open(tmp_path / 'spool' / '000000000001.log', 'w', encoding='utf-8') as f:
+        for n in (1, 2, 3):
+            f.write(json.dumps([n, [row(n)]]) + '\n')
+        f.write('[4, [[4, "库')  # 写了一半的最后一行
+    database.seq = 2
+    database.rows = [row(1), row(2)]
+    database.commits = {(key, 3)}
+
+    writer = open_writer(tmp_path, database)
+    assert writer.key == key
+    assert writer.flush() == 1
+    assert database.rows == [row(1), row(2), row(3)]
+    assert database.seq == 3
+    assert commit(writer, database, row(5)) == 4
+    writer.close()
+
+
+def test_flush_failure_keeps_entries(tmp_path, database):
+    writer = open_writer(tmp_path, database)
+    commit(writer, database, row(1))
+    database.fail = True
+    assert writer.flush() == 0
+    stats = writer.stats()
+    assert (stats['failures'], stats['queue_depth']) == (1, 1)
+    assert stats['last_error'] == '数据库不可用'
+    assert database.seq == 0
+
+    database.fail = False
+    assert writer.flush() == 1
+    assert database.rows == [row(1)]
+    assert database.seq == 1
+    assert writer.stats()['queue_depth'] == 0
+    writer.close()
+
+
+def test_segments_rotate_and_flushed_segments_are_removed(tmp_path, database):
+    """当前段写满后换新段；写入后删除整个旧段文件，当前段保留"""
+    writer = open_writer(tmp_path, database, segment_bytes=1)
+    for n in (1, 2, 3):
+        commit(writer, database, row(n))
+    assert writer.stats()['segments'] == 3
+    assert writer.flush() == 3
+    assert sorted(os.listdir(tmp_path / 'spool')) == ['000000000003.log', 'key', 'lock']
+    assert writer.stats()['segments'] == 1
+    writer.close()
+
+    writer = open_writer(tmp_path, database, segment_bytes=1)
+    assert commit(writer, database, row(4)) == 4
+    writer.close()
+
+
+def test_lost_spool_gets_new_key(tmp_path, database):
+    """段文件丢失后序号从 1 重新开始，换新键，不会被旧键的已写入序号跳过"""
+    writer = open_writer(tmp_path, database)
+    commit(writer, database, row(1))
+    writer.flush()
+    key = writer.key
+    writer.close()
+    os.remove(tmp_path / 'spool' / '000000000001.log')
+
+    writer = open_writer(tmp_path, database)
+    assert writer.key != key
+    assert commit(writer, database, row(2)) == 1
+    database.seq = 0  # 新键在数据库中还没有已写入序号
+    assert writer.flush() == 1
+    assert database.rows == [row(1), row(2)]
+    writer.close()
+
+
+def test_spool_in_use(tmp_path, database):
+    writer = open_writer(tmp_path, database)
+    with pytest.raises(RuntimeError):
+        open_writer(tmp_path, database)
+    writer.close()
+
+
+def register(app_module, spool_key, seq):
+    """在数据库中登记一组流水（相当于请求事务中 _add_transactions 的登记）"""
+    with app_module.db_cursor(dictionary=True) as (conn, cursor):
+        cursor.execute("INSERT INTO ledger_commits (spool_key, seq) VALUES (%s, %s)", (spool_key, seq))
+        conn.commit()
+
+
+def test_write_ledger_batch(app_module, client, product):
+    """只写入登记过的组并删除登记；已写入序号在同一事务中推进；已删除产品的流水跳过"""
+    pid = product['product_id']
+    before = len(client.get(f'/api/inventory/transactions?product_id={pid}&limit=100').get_json())
+    key = f'test:{pid}'
+    entry = (pid, '库存调整', None, None, 5, 100, 105, '延迟写入', None, '2026-10-18 00:00:00')
+    register(app_module, key, 1)
+    register(app_module, key, 3)
+    groups = [(1, [entry, (999999,) + entry[1:]]), (2, [entry]), (3, [entry])]
+    assert app_module.write_ledger_batch(key, 3, groups) == 2
+    assert app_module.ledger_flushed_seq(key) == 3
+
+    # 重复写入同一批（写库后崩溃、重放）不会再写：登记行已删除
+    assert app_module.write_ledger_batch(key, 0, groups) == 0
+    assert app_module.ledger_flushed_seq(key) == 3
+
+    rows = client.get(f'/api/inventory/transactions?product_id={pid}&limit=100').get_json()
+    assert len(rows) == before + 2
+
+
+def test_request_ledger_rows_go_through_spool(app_module, client, product, tmp_path, monkeypatch):
+    """请求中的流水在事务提交前写入 spool 并登记，请求结束后写库"""
+    writer = LedgerWriter(str(tmp_path / 'spool'), app_module.write_ledger_batch, app_module.ledger_flushed_seq,
+                          batch_size=100, flush_interval=60, fsync=False)
+    monkeypatch.setattr(app_module, 'ledger_writer', writer)
+    monkeypatch.setattr(app_module.repo, 'ledger', app_module.defer_ledger_entry)
+    pid = product['product_id']
+    before = len(client.get(f'/api/inventory/transactions?product_id={pid}&limit=100').get_json())
+
+    assert client.post('/api/inventory/stocktake',
+                       json={'items': [{'product_id': pid, 'quantity': 90}]}).status_code == 200
+    with open(tmp_path / 'spool' / '000000000001.log', encoding='utf-8') as f:
+        [(seq, rows)] = [json.loads(line) for line in f]
+    assert (seq, rows[0][0], rows[0][1], rows[0][4]) == (1, pid, '盘点', -10)
+    assert writer.stats()['in_flight'] == 0
+
+    assert writer.flush() == 1
+    writer.close()
+    rows = client.get(f'/api/inventory/transactions?product_id={pid}&limit=100').get_json()
+    assert len(rows) == before + 1
+    assert app_module.ledger_flushed_seq(writer.key) == 1
+
+
+def test_application_ledger_rows_are_deferred(app_module, client, customer_id, product, monkeypatch):
+    """开启延迟写入后，下单出库、盘点、产品导入的流水都交给 ledger，不在请求事务中写入"""
+    deferred = []
+
+    def ledger(rows):
+        deferred.extend(rows)
+        return 'test', len(deferred)
+    monkeypatch.setattr(app_module.repo, 'ledger', ledger)
+    pid = product['product_id']
+    before = len(client.get(f'/api/inventory/transactions?product_id={pid}&limit=100').get_json())
+
+    assert client.post('/api/sales/orders', json={
+        'customer_id': customer_id, 'order_date': '2026-10-18',
+        'items': [{'product_id': pid, 'quantity': 4, 'unit_price': 1}]}).status_code == 201
+    assert client.post('/api/inventory/stocktake',
+                       json={'items': [{'product_id': pid, 'quantity': 90}]}).status_code == 200
+    code = f"{product['product_code']}-L"
+    assert client.post('/api/products/import', content_type='text/csv', data=(
+        'product_code,product_name,material_type,unit_price,current_stock\n'
+        f'{code},延迟流水,其他,1,5\n').encode('utf-8')).status_code == 200
+
+    assert [(row[0], row[1], row[4], row[5], row[6]) for row in deferred[:2]] == [
+        (pid, '销售出库', -4, 100, 96), (pid, '盘点', -6, 96, 90)]
+    assert (deferred[2][1], deferred[2][6]) == ('库存调整', 5)
+    assert len(client.get(f'/api/inventory/transactions?product_id={pid}&limit=100').get_json()) == before
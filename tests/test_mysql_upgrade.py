@@ -0,0 +1,85 @@
+"""MySQL 旧库的启动升级：按 脚本.sql 建表、补列、建索引和触发器，已存在的对象跳过
+
+没有 MySQL 服务器，用记录语句的假连接代替连接池。
+"""
+import pytest
+
+pytest.importorskip('mysql.connector')
+
+import backends  # noqa: E402
+from mysql.connector import Error  # noqa: E402
+
+EXISTING_TABLES = ('products', 'purchase_orders', 'sales_orders')
+
+
+class FakeCursor:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def execute(self, statement):
+        self.executed.append(statement)
+        if statement.startswith('CREATE TABLE') and statement.split()[2] in EXISTING_TABLES:
+            raise Error(msg='Table already exists', errno=1050)
+        if statement.startswith('ALTER TABLE products ADD COLUMN version'):
+            raise Error(msg='Duplicate column name', errno=1060)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.executed = []
+        self.committed = False
+
+    def cursor(self):
+        return FakeCursor(self.executed)
+
+    def commit(self):
+        self.committed = True
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def backend():
+    backend = backends.MySQLBackend({})
+    backend.conn = FakeConnection()
+    backend.pool = type('Pool', (), {'acquire': lambda self: backend.conn})()
+    return backend
+
+
+def test_script_statements():
+    statements = list(backends._script_statements(backends.MYSQL_SCHEMA))
+    assert statements
+    assert not any(statement.rstrip().endswith(';') or statement.lstrip().startswith('--')
+                   for statement in statements)
+    # DELIMITER 之间的触发器整体是一条语句
+    trigger = next(s for s in statements if s.upper().startswith('CREATE TRIGGER') and 'BEGIN' in s.upper())
+    assert trigger.upper().rstrip().endswith('END')
+
+
+def test_upgrade_order_and_existing_objects(backend):
+    created = backend.upgrade_schema()
+    executed = backend.conn.executed
+    assert backend.conn.committed
+
+    first_alter = next(i for i, s in enumerate(executed) if s.startswith('ALTER TABLE'))
+    assert all(s.upper().startswith('CREATE TABLE') for s in executed[:first_alter])
+    assert not any(s.upper().startswith('CREATE TABLE') for s in executed[first_alter:])
+    assert len([s for s in executed if s.startswith('ALTER TABLE')]) == len(backends.MYSQL_COLUMNS)
+    # 示例数据不写入
+    assert not any(s.upper().startswith('INSERT') for s in executed)
+
+    assert 'stock_alerts' in created
+    assert not set(EXISTING_TABLES) & set(created)
+
+
+def test_upgrade_failure_is_reported(backend):
+    def denied(statement):
+        raise Error(msg='access denied', errno=1142)
+    backend.conn.cursor = lambda: type('Cursor', (), {'execute': lambda self, s: denied(s),
+                                                      'close': lambda self: None})()
+    with pytest.raises(RuntimeError):
+        backend.upgrade_schema()
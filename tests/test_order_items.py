@@ -0,0 +1,40 @@
+"""订单列表的明细：整页一次查询加载，include=items|summary|none"""
+import pytest
+
+
+@pytest.fixture
+def purchase_orders(client, supplier_id, product):
+    """三张采购订单，分别有 1、2、3 行明细"""
+    for lines in (1, 2, 3):
+        response = client.post('/api/purchase/orders', json={
+            'supplier_id': supplier_id, 'order_date': '2026-10-18',
+            'items': [{'product_id': product['product_id'], 'quantity': 10 * n, 'unit_price': 1.5}
+                      for n in range(1, lines + 1)]})
+        assert response.status_code == 201
+
+
+def test_items_loaded_in_one_query(client, purchase_orders, statements):
+    client.get('/api/purchase/orders?limit=1&count=none')
+    single = len(statements)
+    statements.clear()
+    body = client.get('/api/purchase/orders?limit=50&count=none').get_json()
+    assert len(body['data']) >= 3
+    # 语句数与本页订单数无关：当前页一条、整页明细一条
+    assert len(statements) == single
+
+    for order in body['data']:
+        detail = client.get(f"/api/purchase/orders/{order['order_id']}").get_json()
+        assert [item['detail_id'] for item in order['items']] == [item['detail_id'] for item in detail['items']]
+
+
+def test_summary_and_none(client, purchase_orders):
+    orders = client.get('/api/purchase/orders?limit=50').get_json()['data']
+    summaries = client.get('/api/purchase/orders?limit=50&include=summary').get_json()['data']
+    for order, summary in zip(orders, summaries):
+        assert 'items' not in summary
+        assert summary['items_summary']['line_count'] == len(order['items'])
+        assert summary['items_summary']['total_quantity'] == sum(item['quantity'] for item in order['items'])
+
+    bare = client.get('/api/sales/orders?limit=50&include=none').get_json()['data']
+    assert all('items' not in order and 'items_summary' not in order for order in bare)
+    assert client.get('/api/sales/orders?include=all').status_code == 400
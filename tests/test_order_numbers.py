@@ -0,0 +1,62 @@
+"""单号分配：按号段预留，多个分配器（进程）之间不重复"""
+import threading
+from datetime import datetime
+
+from order_numbers import OrderNumberAllocator
+
+
+def test_blocks_and_date_change():
+    reserved = []
+
+    def reserve(key, count):
+        first = sum(n for k, n in reserved if k == key) + 1
+        reserved.append((key, count))
+        return first
+
+    allocator = OrderNumberAllocator(reserve, block_size=3)
+    day = datetime(2026, 10, 18)
+    numbers = [allocator.next('SO', day) for _ in range(4)]
+    assert numbers == ['SO-20261018-000001', 'SO-20261018-000002', 'SO-20261018-000003', 'SO-20261018-000004']
+    assert reserved == [('SO-20261018', 3), ('SO-20261018', 3)]
+
+    # 日期变化后换新的序列键，前缀之间互不影响
+    assert allocator.next('SO', datetime(2026, 10, 19)) == 'SO-20261019-000001'
+    assert allocator.next('PO', day) == 'PO-20261018-000001'
+
+
+def test_allocators_share_database_sequence(app_module):
+    """多个分配器共用数据库计数表，号段不重叠"""
+    allocators = [OrderNumberAllocator(app_module.reserve_order_numbers, block_size=7) for _ in range(4)]
+    numbers = []
+    lock = threading.Lock()
+
+    def allocate(allocator):
+        issued = [allocator.next('TS') for _ in range(50)]
+        with lock:
+            numbers.extend(issued)
+
+    threads = [threading.Thread(target=allocate, args=(allocator,)) for allocator in allocators]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(numbers) == len(set(numbers)) == 200
+
+
+def test_order_numbers_unique(client, customer_id, supplier_id, product):
+    pid = product['product_id']
+    sales = [client.post('/api/sales/orders', json={
+        'customer_id': customer_id, 'order_date': '2026-10-18',
+        'items': [{'product_id': pid, 'quantity': 1, 'unit_price': 1}]}).get_json()['order_id']
+        for _ in range(5)]
+    purchases = [client.post('/api/purchase/orders', json={
+        'supplier_id': supplier_id, 'order_date': '2026-10-18',
+        'items': [{'product_id': pid, 'quantity': 1, 'unit_price': 1}]}).get_json()['order_id']
+        for _ in range(5)]
+
+    sales_numbers = [client.get(f'/api/sales/orders/{order_id}').get_json()['order_number'] for order_id in sales]
+    purchase_numbers = [client.get(f'/api/purchase/orders/{order_id}').get_json()['order_number']
+                        for order_id in purchases]
+    assert len(set(sales_numbers)) == len(set(purchase_numbers)) == 5
+    assert all(number.startswith('SO-') for number in sales_numbers)
+    assert all(number.startswith('PO-') for number in purchase_numbers)
@@ -0,0 +1,158 @@
+"""销售订单：下单按条件一次扣减整单库存，库存不足整单回滚；状态转换和批量转换"""
+from conftest import latest_transaction, stock
+
+
+def place_order(client, customer_id, items, headers=None):
+    return client.post('/api/sales/orders', json={
+        'customer_id': customer_id, 'order_date': '2026-10-18', 'items': items}, headers=headers)
+
+
+def test_place_order_decrements_stock(client, customer_id, product):
+    pid = product['product_id']
+    response = place_order(client, customer_id, [{'product_id': pid, 'quantity': 3, 'unit_price': 2.5},
+                                                 {'product_id': pid, 'quantity': 2, 'unit_price': 2.5}])
+    assert response.status_code == 201
+    order = client.get(f"/api/sales/orders/{response.get_json()['order_id']}").get_json()
+    assert len(order['items']) == 2
+    assert stock(client, pid) == 95
+
+    # 同一产品的多行明细合并为一条出库流水
+    ledger = latest_transaction(client, pid)
+    assert ledger['transaction_type'] == '销售出库'
+    assert (ledger['quantity_change'], ledger['quantity_before'], ledger['quantity_after']) == (-5, 100, 95)
+
+
+def test_place_order_shortage_rolls_back(client, customer_id, product):
+    pid = product['product_id']
+    orders = len(client.get('/api/sales/orders?limit=1000&include=none').get_json()['data'])
+    response = place_order(client, customer_id, [{'product_id': pid, 'quantity': 60, 'unit_price': 1},
+                                                 {'product_id': pid, 'quantity': 41, 'unit_price': 1}])
+    assert response.status_code == 400
+    assert response.get_json()['shortages'] == [{'product_id': pid, 'requested': 101, 'available': 100}]
+    assert stock(client, pid) == 100
+    assert latest_transaction(client, pid)['transaction_type'] != '销售出库'
+    assert len(client.get('/api/sales/orders?limit=1000&include=none').get_json()['data']) == orders
+
+
+def test_statements_independent_of_lines(client, customer_id, product, statements):
+    pid = product['product_id']
+    place_order(client, customer_id, [{'product_id': pid, 'quantity': 1, 'unit_price': 1}])
+    single = len(statements)
+    statements.clear()
+    response = place_order(client, customer_id, [{'product_id': pid, 'quantity': 1, 'unit_price': 1}] * 20)
+    assert response.status_code == 201
+    assert len(statements) == single
+    assert stock(client, pid) == 79
+
+
+def test_invalid_items(client, customer_id, product):
+    pid = product['product_id']
+    for items in ([], [{'product_id': pid, 'quantity': 0, 'unit_price': 1}],
+                  [{'product_id': str(pid), 'quantity': 1, 'unit_price': 1}],
+                  [{'product_id': pid, 'quantity': 1, 'unit_price': -1}]):
+        assert place_order(client, customer_id, items).status_code == 400
+    assert stock(client, pid) == 100
+
+
+def test_cancel_restores_stock_once(client, customer_id, product):
+    pid = product['product_id']
+    order_id = place_order(client, customer_id, [{'product_id': pid, 'quantity': 7, 'unit_price': 1}]
+                           ).get_json()['order_id']
+    assert stock(client, pid) == 93
+
+    response = client.put(f'/api/sales/orders/{order_id}/cancel')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == '已取消'
+    assert stock(client, pid) == 100
+
+    # 已取消的订单不能再取消，库存不会恢复两次
+    again = client.put(f'/api/sales/orders/{order_id}/cancel')
+    assert again.status_code == 400
+    assert stock(client, pid) == 100
+    assert client.put('/api/sales/orders/999999/cancel').status_code == 404
+
+
+def test_bulk_cancel_reports_unchanged_orders(client, customer_id, product):
+    pid = product['product_id']
+    order_ids = [place_order(client, customer_id, [{'product_id': pid, 'quantity': 5, 'unit_price': 1}]
+                             ).get_json()['order_id'] for _ in range(3)]
+    client.put(f'/api/sales/orders/{order_ids[0]}/cancel')
+
+    response = client.post('/api/sales/orders/transitions',
+                           json={'action': 'cancel', 'order_ids': order_ids + [999999]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert sorted(body['updated']) == order_ids[1:]
+    assert {f['order_id']: f['status_code'] for f in body['failed']} == {order_ids[0]: 400, 999999: 404}
+    assert stock(client, pid) == 100
+
+
+def test_bulk_approve_purchase_orders(client, supplier_id, product, statements):
+    order_ids = [client.post('/api/purchase/orders', json={
+        'supplier_id': supplier_id, 'order_date': '2026-10-18',
+        'items': [{'product_id': product['product_id'], 'quantity': 1, 'unit_price': 1}]}).get_json()['order_id']
+        for _ in range(3)]
+    statements.clear()
+    body = client.post('/api/purchase/orders/transitions',
+                       json={'action': 'approve', 'order_ids': order_ids}).get_json()
+    assert (sorted(body['updated']), body['failed'], body['status']) == (order_ids, [], '已批准')
+    # 整批订单一条 IN UPDATE，全部生效时不读取订单状态
+    assert sum(1 for query in statements if 'UPDATE purchase_orders' in query) == 1
+    assert not any('SELECT order_id, status, version' in query for query in statements)
+
+    again = client.post('/api/purchase/orders/transitions',
+                        json={'action': 'approve', 'order_ids': order_ids}).get_json()
+    assert again['updated'] == []
+    assert {f['status_code'] for f in again['failed']} == {400}
+
+
+
+def test_single_transition_without_pre_read(client, customer_id, product, statements):
+    """单个订单的转换只有一条条件 UPDATE；没有生效时才读取状态构造错误"""
+    order_id = place_order(client, customer_id, [{'product_id': product['product_id'], 'quantity': 1,
+                                                  'unit_price': 1}]).get_json()['order_id']
+    statements.clear()
+    assert client.put(f'/api/sales/orders/{order_id}/confirm').status_code == 200
+    assert [query for query in statements if 'sales_orders' in query and 'SELECT' in query] == []
+    assert not any('SAVEPOINT' in query for query in statements)
+
+    statements.clear()
+    assert client.put(f'/api/sales/orders/{order_id}/confirm').status_code == 400
+    assert sum(1 for query in statements if 'SELECT order_id, status, version' in query) == 1
+
+def test_invalid_transition(client):
+    assert client.post('/api/sales/orders/transitions',
+                       json={'action': 'approve', 'order_ids': [1]}).status_code == 400
+    assert client.post('/api/sales/orders/transitions',
+                       json={'action': 'cancel', 'order_ids': []}).status_code == 400
+
+
+def restore_statements(statements):
+    """恢复库存执行的语句条数（不含订单状态 UPDATE）"""
+    return sum(1 for query in statements if 'UPDATE sales_orders' not in query)
+
+
+def test_bulk_cancel_restores_stock_in_order(client, customer_id, product, statements):
+    """多个订单共享产品：流水按订单顺序衔接，恢复库存的语句条数与订单数无关"""
+    pid = product['product_id']
+    order_ids = [place_order(client, customer_id, [{'product_id': pid, 'quantity': n, 'unit_price': 1},
+                                                   {'product_id': pid, 'quantity': 1, 'unit_price': 1}]
+                             ).get_json()['order_id'] for n in (1, 2, 3, 4, 5)]
+    assert stock(client, pid) == 80
+
+    statements.clear()
+    client.post('/api/sales/orders/transitions', json={'action': 'cancel', 'order_ids': order_ids[:2]})
+    two = restore_statements(statements)
+    statements.clear()
+    body = client.post('/api/sales/orders/transitions',
+                       json={'action': 'cancel', 'order_ids': order_ids[2:]}).get_json()
+    assert (sorted(body['updated']), body['failed']) == (order_ids[2:], [])
+    assert restore_statements(statements) == two
+    assert stock(client, pid) == 100
+
+    rows = client.get(f'/api/inventory/transactions?product_id={pid}&limit=100').get_json()
+    restores = sorted((row for row in rows if row['transaction_type'] == '库存调整' and row['reference_id']),
+                      key=lambda row: row['transaction_id'])
+    assert [(row['reference_id'], row['quantity_before'], row['quantity_after']) for row in restores] == [
+        (order_ids[0], 80, 82), (order_ids[1], 82, 85),
+        (order_ids[2], 85, 89), (order_ids[3], 89, 94), (order_ids[4], 94, 100)]
@@ -0,0 +1,60 @@
+"""游标分页：after/before 翻页与页码分页结果一致，翻页期间插入新行不重复不遗漏"""
+
+
+def walk(client, url, after=None):
+    """沿 next_cursor 翻完所有页，返回各页的主键"""
+    pages = []
+    body = client.get(f'{url}&after={after}' if after else url).get_json()
+    while True:
+        pages.append([row['product_id'] for row in body['data']])
+        if not body['next_cursor']:
+            return pages
+        body = client.get(f"{url}&after={body['next_cursor']}").get_json()
+
+
+def test_cursor_pages_match_offset_pages(client, product):
+    offset = client.get('/api/products?limit=1000').get_json()
+    ids = [row['product_id'] for row in offset['data']]
+    assert offset['page'] == 1
+
+    pages = walk(client, '/api/products?limit=3')
+    assert sum(pages, []) == ids
+    assert all(len(page) == 3 for page in pages[:-1])
+
+
+def test_insert_while_paging(client, product):
+    first = client.get('/api/products?limit=2&order=asc').get_json()
+    cursor = first['next_cursor']
+    client.post('/api/products', json={'product_code': 'PAGE-NEW', 'product_name': '翻页期间新增',
+                                       'material_type': '其他', 'unit_price': 1})
+    rest = walk(client, '/api/products?limit=2&order=asc', cursor)
+    ids = [row['product_id'] for row in first['data']] + sum(rest, [])
+    assert len(ids) == len(set(ids))
+    assert ids == sorted(ids)
+    assert ids[-1] == client.get('/api/products?limit=1').get_json()['data'][0]['product_id']
+
+
+def test_before_returns_previous_page(client, product):
+    first = client.get('/api/products?limit=2').get_json()
+    second = client.get(f"/api/products?limit=2&after={first['next_cursor']}").get_json()
+    assert 'page' not in second
+    back = client.get(f"/api/products?limit=2&before={second['prev_cursor']}").get_json()
+    assert back['data'] == first['data']
+
+
+def test_sort_by_updated_at(client, product):
+    client.put(f"/api/products/{product['product_id']}", json={'unit_price': 9})
+    rows = client.get('/api/products?limit=1000&sort=updated_at').get_json()['data']
+    assert [row['updated_at'] for row in rows] == sorted((row['updated_at'] for row in rows), reverse=True)
+
+    pages = walk(client, '/api/products?limit=2&sort=updated_at')
+    assert sum(pages, []) == [row['product_id'] for row in rows]
+
+
+def test_invalid_parameters(client):
+    assert client.get('/api/products?after=garbage').status_code == 400
+    assert client.get('/api/products?sort=unknown').status_code == 400
+    token = client.get('/api/products?limit=1').get_json()['next_cursor']
+    # 游标只能用于生成它的排序方式
+    assert client.get(f'/api/products?order=asc&after={token}').status_code == 400
+    assert client.get('/api/products?limit=0').status_code == 400
@@ -0,0 +1,132 @@
+"""产品接口：增删改查、手工调整库存的流水、If-Match / expected_version 乐观并发控制"""
+import backends
+from conftest import latest_transaction, stock
+
+
+def test_create_and_get(client, product):
+    assert product['product_name'] == '测试产品'
+    assert product['current_stock'] == 100
+    ledger = latest_transaction(client, product['product_id'])
+    assert (ledger['transaction_type'], ledger['quantity_after']) == ('库存调整', 100)
+
+
+def test_duplicate_code_rejected(client, product):
+    response = client.post('/api/products', json={
+        'product_code': product['product_code'], 'product_name': '重复', 'material_type': '其他', 'unit_price': 1})
+    assert response.status_code == 400
+
+
+def test_stock_update_writes_ledger(client, product):
+    pid = product['product_id']
+    assert client.put(f'/api/products/{pid}', json={'current_stock': 130}).status_code == 200
+    assert stock(client, pid) == 130
+
+    ledger = latest_transaction(client, pid)
+    assert (ledger['quantity_change'], ledger['quantity_before'], ledger['quantity_after']) == (30, 100, 130)
+
+
+def test_update_with_current_version(client, product):
+    pid, version = product['product_id'], product['version']
+    response = client.put(f'/api/products/{pid}', json={'unit_price': 3}, headers={'If-Match': f'"{version}"'})
+    assert response.status_code == 200
+    assert response.get_json()['version'] == version + 1
+    assert client.get(f'/api/products/{pid}').get_json()['version'] == version + 1
+
+
+def test_update_with_stale_version_conflicts(client, product):
+    pid, version = product['product_id'], product['version']
+    assert client.put(f'/api/products/{pid}', json={'product_name': '新名称'}).status_code == 200
+
+    response = client.put(f'/api/products/{pid}', json={'product_name': '旧名称'},
+                          headers={'If-Match': f'W/"{version}"'})
+    assert response.status_code == 409
+    assert response.get_json()['version'] == version + 1
+    assert client.get(f'/api/products/{pid}').get_json()['product_name'] == '新名称'
+
+    # 版本不符时库存和流水都不变
+    stale = client.put(f'/api/products/{pid}', json={'current_stock': 1, 'expected_version': version})
+    assert stale.status_code == 409
+    assert stock(client, pid) == 100
+    assert latest_transaction(client, pid)['quantity_after'] == 100
+
+
+def test_update_missing_product(client):
+    response = client.put('/api/products/999999', json={'product_name': 'x'}, headers={'If-Match': '"1"'})
+    assert response.status_code == 404
+    assert client.put('/api/products/999999', json={'product_name': 'x'}).status_code == 404
+
+
+def test_invalid_version(client, product):
+    pid = product['product_id']
+    for headers, body in (({'If-Match': '"abc"'}, {}), ({}, {'expected_version': 0}),
+                          ({}, {'expected_version': True})):
+        response = client.put(f'/api/products/{pid}', json=dict(body, product_name='x'), headers=headers)
+        assert response.status_code == 400
+
+
+def test_order_status_with_stale_version(client, customer_id, product):
+    order_id = client.post('/api/sales/orders', json={
+        'customer_id': customer_id, 'order_date': '2026-10-18',
+        'items': [{'product_id': product['product_id'], 'quantity': 1, 'unit_price': 1}]}).get_json()['order_id']
+    version = client.get(f'/api/sales/orders/{order_id}').get_json()['version']
+
+    response = client.put(f'/api/sales/orders/{order_id}/confirm', headers={'If-Match': f'"{version + 1}"'})
+    assert response.status_code == 409
+    response = client.put(f'/api/sales/orders/{order_id}/confirm', headers={'If-Match': f'"{version}"'})
+    assert response.status_code == 200
+    assert response.get_json()['version'] == version + 1
+
+
+def test_adjust_inventory(client, product):
+    pid = product['product_id']
+    response = client.post('/api/inventory/adjust', json={'product_id': pid, 'quantity': 80, 'notes': '盘亏'})
+    assert response.status_code == 200
+    assert response.get_json()['change'] == -20
+    assert stock(client, pid) == 80
+    assert latest_transaction(client, pid)['notes'] == '盘亏'
+
+
+
+def test_adjust_inventory_concurrent_change(app_module, client, product, monkeypatch):
+    """读取库存后、更新前库存被其他请求修改：返回 409，不覆盖，也不写流水"""
+    pid = product['product_id']
+    before = latest_transaction(client, pid)['transaction_id']
+    execute = backends.SQLiteCursor.execute
+
+    def interleaved(self, query, params=()):
+        if query.startswith('UPDATE products SET current_stock') and 'AND current_stock' in query:
+            with app_module.db_cursor() as (conn, cursor):
+                execute(cursor, "UPDATE products SET current_stock = 95 WHERE product_id = %s", (pid,))
+                conn.commit()
+            app_module.table_versions.bump('products')
+        return execute(self, query, params)
+    monkeypatch.setattr(backends.SQLiteCursor, 'execute', interleaved)
+
+    response = client.post('/api/inventory/adjust', json={'product_id': pid, 'quantity': 80})
+    monkeypatch.undo()
+    assert response.status_code == 409
+    assert stock(client, pid) == 95
+    assert latest_transaction(client, pid)['transaction_id'] == before
+
+def test_delete_product(client, product):
+    pid = product['product_id']
+    assert client.delete(f'/api/products/{pid}').status_code == 200
+    assert client.get(f'/api/products/{pid}').status_code == 404
+    assert client.delete(f'/api/products/{pid}').status_code == 404
+
+
+def test_stock_update_without_pre_read(client, product, statements):
+    """修改库存时流水由 INSERT ... SELECT 写入，产品只有一条条件 UPDATE，不先读取"""
+    pid, version = product['product_id'], product['version']
+    assert client.put(f'/api/products/{pid}', json={'current_stock': 120},
+                      headers={'If-Match': f'"{version}"'}).status_code == 200
+    assert sum(1 for query in statements if 'UPDATE products' in query) == 1
+    assert not any('SELECT current_stock, version' in query for query in statements)
+    assert latest_transaction(client, pid)['quantity_change'] == 20
+
+
+def test_every_write_bumps_version_once(client, product):
+    pid, version = product['product_id'], product['version']
+    client.post('/api/inventory/adjust', json={'product_id': pid, 'quantity': 5})
+    client.put(f'/api/products/{pid}', json={'product_name': '同一秒内再次修改'})
+    assert client.get(f'/api/products/{pid}').get_json()['version'] == version + 2
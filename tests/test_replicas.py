@@ -0,0 +1,85 @@
+"""读写分离：GET 走从库，延迟过大或不可用时回退主库，写入后的读你所写窗口"""
+import pytest
+
+from backends import backend_from_dsn
+from replicas import ReplicaRouter
+
+
+class FakeBackend:
+    """只提供 replication_lag 的后端替身，lag 为 Exception 时模拟从库不可用"""
+    name = 'fake'
+
+    def __init__(self, lag=None):
+        self.lag = lag
+        self.pool = self
+
+    def connection(self, timeout=None):
+        if isinstance(self.lag, Exception):
+            raise self.lag
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def cursor(self, dictionary=False):
+        return self
+
+    def close(self):
+        pass
+
+    def replication_lag(self, cursor):
+        return self.lag
+
+    def stats(self):
+        return {}
+
+
+def test_lagging_or_broken_replica_falls_back():
+    primary, lagging, broken = FakeBackend(), FakeBackend(lag=30.0), FakeBackend(lag=OSError('down'))
+    router = ReplicaRouter(primary, [lagging, broken], max_lag=5)
+    assert router.read_backend() is primary
+    assert router.stats()['fallback_reads'] == 1
+
+    ok = FakeBackend(lag=1.0)
+    router = ReplicaRouter(primary, [broken, ok], max_lag=5)
+    assert router.read_backend() is ok
+    assert router.read_backend() is ok
+
+
+def test_read_your_writes_window():
+    primary, replica = FakeBackend(), FakeBackend()
+    router = ReplicaRouter(primary, [replica], read_your_writes=60)
+    router.mark_write('client-a')
+    assert router.read_backend('client-a') is primary
+    assert router.read_backend('client-b') is replica
+    assert router.stats()['sticky_reads'] == 1
+
+
+@pytest.fixture
+def replica(app_module, tmp_path, monkeypatch):
+    """用另一个 SQLite 库充当从库：从库上的数据与主库不同，便于区分读到了哪个库"""
+    backend = backend_from_dsn(f'sqlite:///{tmp_path}/replica.db')
+    with backend.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE customers SET customer_name = %s WHERE customer_id = 1", ('从库',))
+        conn.commit()
+    monkeypatch.setattr(app_module, 'replica_router', ReplicaRouter(app_module.db_backend, [backend]))
+    return backend
+
+
+def customer_name(client, client_id):
+    rows = client.get('/api/customers?limit=1000', headers={'X-Client-Id': client_id}).get_json()['data']
+    return next(row['customer_name'] for row in rows if row['customer_id'] == 1)
+
+
+def test_get_routes_to_replica_until_client_writes(client, replica, product):
+    assert customer_name(client, 'writer') == '从库'
+
+    pid = product['product_id']
+    response = client.put(f'/api/products/{pid}', json={'unit_price': 3}, headers={'X-Client-Id': 'writer'})
+    assert response.status_code == 200
+    assert customer_name(client, 'writer') != '从库'
+    assert customer_name(client, 'reader') == '从库'
@@ -0,0 +1,47 @@
+"""读接口响应缓存：命中时不查库，相关表有写入后失效，按 LRU 淘汰"""
+from cache import TableVersions, VersionedCache
+
+
+def test_hit_and_invalidation(client, product):
+    # product fixture 建好产品后已读取过一次
+    url = f"/api/products/{product['product_id']}"
+    hit = client.get(url)
+    assert hit.headers['X-Cache'] == 'HIT'
+    assert hit.get_json() == product
+
+    client.post('/api/inventory/adjust', json={'product_id': product['product_id'], 'quantity': 60})
+    after = client.get(url)
+    assert after.headers['X-Cache'] == 'MISS'
+    assert after.get_json()['current_stock'] == 60
+
+
+def test_query_args_are_normalized(client):
+    assert client.get('/api/categories?b=2&a=1').headers['X-Cache'] in ('HIT', 'MISS')
+    assert client.get('/api/categories?a=1&b=2&c=').headers['X-Cache'] == 'HIT'
+
+
+def test_uncached_endpoints_and_errors(client):
+    assert 'X-Cache' not in client.get('/api/products?limit=1').headers
+    missing = client.get('/api/products/999999')
+    assert missing.status_code == 404
+    assert client.get('/api/products/999999').headers.get('X-Cache') != 'HIT'
+
+
+def test_lru_eviction_and_stats():
+    versions = TableVersions()
+    cache = VersionedCache(versions, max_entries=2)
+    for key in ('a', 'b'):
+        cache.put(('products',), key, key.upper(), versions.get(('products',)))
+    assert cache.get(('products',), 'a') == 'A'
+    cache.put(('products',), 'c', 'C', versions.get(('products',)))
+    assert cache.get(('products',), 'b') is None
+    assert cache.get(('products',), 'a') == 'A'
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['entries']) == (2, 1, 1, 2)
+
+
+def test_stats_endpoint(client):
+    stats = client.get('/api/system/cache').get_json()
+    assert {'responses', 'counts', 'product_index'} <= set(stats)
+    assert stats['responses']['hits'] >= 1
@@ -0,0 +1,51 @@
+"""销售统计汇总表：订单进入或离开"已完成"时由触发器增量维护，与全量重建结果一致"""
+import pytest
+
+
+def summaries(app_module):
+    with app_module.db_cursor(dictionary=True) as (conn, cursor):
+        return app_module.repo.sales_statistics(cursor)
+
+
+def set_status(app_module, order_id, status):
+    with app_module.db_cursor() as (conn, cursor):
+        cursor.execute("UPDATE sales_orders SET status = %s WHERE order_id = %s", (status, order_id))
+        conn.commit()
+
+
+@pytest.fixture
+def order(client, customer_id, product):
+    response = client.post('/api/sales/orders', json={
+        'customer_id': customer_id, 'order_date': '2031-05-20',
+        'items': [{'product_id': product['product_id'], 'quantity': 4, 'unit_price': 2.5}]})
+    assert response.status_code == 201
+    return response.get_json()['order_id']
+
+
+def month_row(monthly, month):
+    return next((row for row in monthly if row['month'] == month), None)
+
+
+def test_completion_updates_summaries(app_module, client, order, customer_id):
+    assert month_row(summaries(app_module)[0], '2031-05') is None
+
+    set_status(app_module, order, '已完成')
+    monthly, materials, customers = summaries(app_module)
+    row = month_row(monthly, '2031-05')
+    assert (row['order_count'], row['total_amount']) == (1, 10)
+    assert any(row['material_type'] == '其他' for row in materials)
+    name = client.get(f'/api/customers/{customer_id}').get_json()['customer_name']
+    assert any(row['customer_name'] == name for row in customers)
+
+    set_status(app_module, order, '已取消')
+    assert month_row(summaries(app_module)[0], '2031-05') is None
+
+
+def test_rebuild_matches_incremental(app_module, order):
+    set_status(app_module, order, '已完成')
+    incremental = summaries(app_module)
+
+    result = app_module.app.test_cli_runner().invoke(args=['rebuild-sales-summary'])
+    assert result.exit_code == 0, result.output
+    assert 'sales_monthly_summary' in result.output
+    assert summaries(app_module) == incremental
@@ -0,0 +1,50 @@
+"""search 参数：不短于分词长度的词走全文索引并按相关度排序，更短的词退回 LIKE"""
+import pytest
+
+
+@pytest.fixture(scope='module')
+def customers(app_module):
+    client = app_module.app.test_client()
+    ids = []
+    for code, name in (('SRCH01', '苏州氟胶密封件贸易有限公司'), ('SRCH02', '苏州密封件')):
+        response = client.post('/api/customers', json={'customer_code': code, 'customer_name': name,
+                                                       'contact_person': '测试'})
+        assert response.status_code == 201
+        ids.append(response.get_json()['customer_id'])
+    return ids
+
+
+def test_full_text_search(client, customers):
+    body = client.get('/api/customers?search=密封件').get_json()
+    assert body['sort'] == 'relevance'
+    assert {row['customer_id'] for row in body['data']} >= set(customers)
+    assert all(row['search_rank'] > 0 for row in body['data'])
+
+    codes = client.get('/api/customers?search=SRCH02').get_json()['data']
+    assert [row['customer_id'] for row in codes] == [customers[1]]
+
+
+def test_short_term_falls_back_to_like(client, customers, app_module):
+    assert len('苏州') < app_module.db_backend.min_search_length
+    rows = client.get('/api/customers?search=苏州').get_json()['data']
+    assert {row['customer_id'] for row in rows} >= set(customers)
+    assert all(row['search_rank'] == 0 for row in rows)
+
+
+def test_search_is_bounded(client, customers, app_module, monkeypatch):
+    monkeypatch.setattr(app_module.repo, 'search_limit', 1)
+    body = client.get('/api/customers?search=密封件').get_json()
+    assert body['total'] == len(body['data']) == 1
+
+
+def test_order_number_search(client, supplier_id, product):
+    number = client.post('/api/purchase/orders', json={
+        'supplier_id': supplier_id, 'order_date': '2026-10-18',
+        'items': [{'product_id': product['product_id'], 'quantity': 1, 'unit_price': 1}]}
+    ).get_json()['order_number']
+    rows = client.get(f'/api/purchase/orders?search={number}&include=none').get_json()['data']
+    assert [row['order_number'] for row in rows] == [number]
+
+
+def test_relevance_requires_search(client):
+    assert client.get('/api/customers?sort=relevance').status_code == 400
@@ -0,0 +1,30 @@
+"""SQLite 后端：按 schema_sqlite.sql 建库，游标兼容 mysql-connector 的用法"""
+from backends import create_backend
+
+
+def test_new_database_gets_schema_and_sample_data(tmp_path):
+    backend = create_backend('sqlite', sqlite_path=str(tmp_path / 'new.db'))
+    with backend.pool.connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT product_code FROM products WHERE product_id = %s", (1,))
+        assert cursor.fetchone() == {'product_code': 'P001'}
+        cursor.execute("PRAGMA journal_mode")
+        assert cursor.fetchone() == {'journal_mode': 'wal'}
+
+    # 再次打开不会重复建表和写入示例数据
+    again = create_backend('sqlite', sqlite_path=str(tmp_path / 'new.db'))
+    with again.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM products WHERE product_code = %s", ('P001',))
+        assert cursor.fetchone() == (1,)
+
+
+def test_cursor_lastrowid_and_rollback(tmp_path):
+    backend = create_backend('sqlite', sqlite_path=str(tmp_path / 'rollback.db'))
+    with backend.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO customers (customer_code, customer_name) VALUES (%s, %s)", ('C900', '测试客户'))
+        assert cursor.lastrowid > 0
+        conn.rollback()
+        cursor.execute("SELECT COUNT(*) FROM customers WHERE customer_code = %s", ('C900',))
+        assert cursor.fetchone() == (0,)
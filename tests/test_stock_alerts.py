@@ -0,0 +1,38 @@
+"""库存预警表：库存或上下限变化越过阈值时由触发器维护，与全量重建结果一致"""
+
+
+def alert(client, product_id):
+    rows = client.get('/api/inventory/alerts').get_json()
+    return next(((row['alert_type'], row['alert_value']) for row in rows if row['product_id'] == product_id), None)
+
+
+def test_alert_follows_stock(client, product):
+    pid = product['product_id']
+    assert alert(client, pid) is None
+
+    client.post('/api/inventory/adjust', json={'product_id': pid, 'quantity': 4})
+    assert alert(client, pid) == ('库存不足', 6)
+    client.post('/api/inventory/adjust', json={'product_id': pid, 'quantity': 1500})
+    assert alert(client, pid) == ('库存过剩', 500)
+    client.post('/api/inventory/adjust', json={'product_id': pid, 'quantity': 50})
+    assert alert(client, pid) is None
+
+
+def test_alert_follows_thresholds_and_delete(client, product):
+    pid = product['product_id']
+    client.put(f'/api/products/{pid}', json={'min_stock_level': 120})
+    assert alert(client, pid) == ('库存不足', 20)
+
+    client.delete(f'/api/products/{pid}')
+    assert alert(client, pid) is None
+
+
+def test_rebuild_matches_triggers(app_module, client, product):
+    client.post('/api/inventory/adjust', json={'product_id': product['product_id'], 'quantity': 3})
+    with app_module.db_cursor(dictionary=True) as (conn, cursor):
+        before = app_module.repo.stock_alerts(cursor)
+
+    result = app_module.app.test_cli_runner().invoke(args=['rebuild-stock-alerts'])
+    assert result.exit_code == 0, result.output
+    with app_module.db_cursor(dictionary=True) as (conn, cursor):
+        assert app_module.repo.stock_alerts(cursor) == before
@@ -0,0 +1,82 @@
+"""盘点：整单在一个事务中生效，写 '盘点' 流水并返回差异报告"""
+from conftest import latest_transaction, stock
+
+
+def test_stocktake_report_and_ledger(client, product):
+    other = client.post('/api/products', json={
+        'product_code': f"{product['product_code']}-B", 'product_name': '盘点产品', 'material_type': '其他',
+        'unit_price': 10, 'current_stock': 5}).get_json()['product_id']
+    unchanged = client.post('/api/products', json={
+        'product_code': f"{product['product_code']}-C", 'product_name': '盘点产品', 'material_type': '其他',
+        'unit_price': 1, 'current_stock': 7}).get_json()['product_id']
+
+    response = client.post('/api/inventory/stocktake', json={'items': [
+        {'product_id': product['product_id'], 'quantity': 90},
+        {'product_code': f"{product['product_code']}-B", 'quantity': 8},
+        {'product_id': unchanged, 'quantity': 7},
+    ], 'notes': '月末盘点'})
+    assert response.status_code == 200
+    report = response.get_json()
+    assert (report['counted'], report['changed'], report['unchanged']) == (3, 2, 1)
+    assert (report['surplus_quantity'], report['shortage_quantity']) == (3, 10)
+    assert report['variance_amount'] == 5.0
+    # 差异明细按差异金额绝对值降序：+30.0 在 -25.0 之前
+    assert [line['product_id'] for line in report['variances']] == [other, product['product_id']]
+
+    assert stock(client, product['product_id']) == 90
+    assert stock(client, other) == 8
+    row = latest_transaction(client, product['product_id'])
+    assert row['transaction_type'] == '盘点'
+    assert (row['quantity_change'], row['quantity_before'], row['quantity_after']) == (-10, 100, 90)
+    assert row['notes'] == '月末盘点'
+    assert latest_transaction(client, unchanged)['transaction_type'] != '盘点'
+
+
+def test_sheet_errors_change_nothing(client, product):
+    response = client.post('/api/inventory/stocktake', json={'items': [
+        {'product_id': product['product_id'], 'quantity': 50},
+        {'product_code': product['product_code'], 'quantity': 60},
+        {'product_code': 'NO-SUCH-CODE', 'quantity': 1},
+    ]})
+    assert response.status_code == 400
+    errors = response.get_json()['errors']
+    assert [(error['row'], error['error']) for error in errors] == [(2, '产品在盘点单中重复'), (3, '产品不存在')]
+    assert stock(client, product['product_id']) == 100
+
+
+def test_invalid_sheet(client, product):
+    for body in ({}, {'items': []}, {'items': [{'quantity': 1}]},
+                 {'items': [{'product_id': product['product_id'], 'quantity': -1}]}):
+        assert client.post('/api/inventory/stocktake', json=body).status_code == 400
+
+
+def test_stale_book_stock_conflicts(app_module, client, product, monkeypatch):
+    """读取账面库存之后库存被改动过：UPDATE 条件不成立，整单回滚并返回 409"""
+    stock_levels = app_module.repo.stock_levels
+
+    def stale(cursor, product_ids, product_codes):
+        rows = stock_levels(cursor, product_ids, product_codes)
+        return [dict(row, current_stock=row['current_stock'] + 1) for row in rows]
+
+    monkeypatch.setattr(app_module.repo, 'stock_levels', stale)
+    response = client.post('/api/inventory/stocktake',
+                           json={'items': [{'product_id': product['product_id'], 'quantity': 50}]})
+    assert response.status_code == 409
+    assert stock(client, product['product_id']) == 100
+    assert latest_transaction(client, product['product_id'])['transaction_type'] != '盘点'
+
+
+def test_one_update_per_batch(app_module, client, product, statements, monkeypatch):
+    monkeypatch.setattr(app_module.repo, 'STOCKTAKE_UPDATE_SIZE', 2)
+    others = [client.post('/api/products', json={
+        'product_code': f"{product['product_code']}-{n}", 'product_name': '盘点产品', 'material_type': '其他',
+        'unit_price': 1, 'current_stock': 10}).get_json()['product_id'] for n in range(2)]
+
+    statements.clear()
+    response = client.post('/api/inventory/stocktake', json={'items': [
+        {'product_id': product['product_id'], 'quantity': 99}] + [
+        {'product_id': product_id, 'quantity': 11} for product_id in others]})
+    assert response.status_code == 200
+    # 3 个有差异的产品、每批 2 个：两条 UPDATE
+    assert sum(1 for query in statements if 'UPDATE products' in query) == 2
+    assert [stock(client, pid) for pid in [product['product_id']] + others] == [99, 11, 11]
@@ -0,0 +1,54 @@
+"""产品联想：前缀索引的关键字、增量更新，以及 /api/products/suggest 与写接口的同步"""
+from suggest import PrefixIndex, index_keys
+
+
+def test_index_keys():
+    assert index_keys('氟胶O型圈-10mm') >= {'氟胶o型圈-10mm', '胶o型圈-10mm', 'o型圈-10mm', '型圈-10mm', '10mm'}
+    assert 'mm' not in index_keys('10mm')
+
+
+def test_incremental_updates():
+    index = PrefixIndex('id', ('code', 'name'))
+    index.load([{'id': 1, 'code': 'P001', 'name': '氟胶O型圈'}, {'id': 2, 'code': 'P002', 'name': '垫片'}],
+               index.begin_load())
+    assert [row['id'] for row in index.search('p00')] == [1, 2]
+    assert [row['id'] for row in index.search('o型')] == [1]
+
+    index.upsert(2, {'name': 'O型密封垫'})
+    assert [row['id'] for row in index.search('o型')] == [1, 2]
+    assert index.search('垫片') == []
+
+    index.remove(1)
+    assert [row['id'] for row in index.search('p00')] == [2]
+
+
+def test_write_during_load_forces_reload():
+    index = PrefixIndex('id', ('code',))
+    token = index.begin_load()
+    index.upsert(1, {'code': 'P001'})
+    index.load([], token)
+    assert index.stale()
+
+
+def test_suggest_follows_writes(client, product):
+    code = product['product_code']
+    found = client.get(f'/api/products/suggest?q={code[:5]}').get_json()
+    assert product['product_id'] in [row['product_id'] for row in found]
+
+    client.put(f"/api/products/{product['product_id']}", json={'product_name': '联想专用氟胶垫'})
+    found = client.get('/api/products/suggest?q=联想专用').get_json()
+    assert [row['product_id'] for row in found] == [product['product_id']]
+
+    client.delete(f"/api/products/{product['product_id']}")
+    assert client.get('/api/products/suggest?q=联想专用').get_json() == []
+
+
+def test_index_warmed_at_startup(app_module, monkeypatch, statements):
+    monkeypatch.setattr(app_module.product_index, 'loaded_at', None)
+    app_module.warm_product_index()
+    assert not app_module.product_index.stale()
+
+    # 预加载之后联想请求不访问数据库
+    statements.clear()
+    assert app_module.app.test_client().get('/api/products/suggest?q=o').status_code == 200
+    assert statements == []
@@ -29,6 +29,7 @@ CREATE TABLE products (
     current_stock INT DEFAULT 0,
     warehouse_location VARCHAR(100),
     status ENUM('正常', '停用') DEFAULT '正常',
+    version INT NOT NULL DEFAULT 1,  -- 行版本：每次修改加 1（触发器维护），用于 If-Match 条件更新
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (category_id) REFERENCES product_categories(category_id) ON DELETE SET NULL
@@ -75,7 +76,9 @@ CREATE TABLE purchase_orders (
     status ENUM('待审核', '已批准', '已发货', '已完成', '已取消') DEFAULT '待审核',
     notes TEXT,
     created_by VARCHAR(50),
+    version INT NOT NULL DEFAULT 1,  -- 行版本：每次修改加 1（触发器维护），用于 If-Match 条件更新
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (supplier_id) REFERENCES suppliers(supplier_id) ON DELETE SET NULL
 );
 
@@ -102,9 +105,12 @@ CREATE TABLE sales_orders (
     total_amount DECIMAL(12, 2) DEFAULT 0,
     status ENUM('待处理', '已确认', '发货中', '已完成', '已取消') DEFAULT '待处理',
     payment_status ENUM('未支付', '部分支付', '已支付') DEFAULT '未支付',
+    payment_method VARCHAR(20) DEFAULT '现金',
     notes TEXT,
     created_by VARCHAR(50),
+    version INT NOT NULL DEFAULT 1,  -- 行版本：每次修改加 1（触发器维护），用于 If-Match 条件更新
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (customer_id) REFERENCES customers(customer_id) ON DELETE SET NULL
 );
 
@@ -151,6 +157,49 @@ CREATE TABLE users (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- 11. 单号序列表：每个序列键（如 SO-20240315）已发出的最大序号。应用每次预留一段序号
+-- 在内存中发放（order_numbers.py），不需要每张订单访问这张表
+CREATE TABLE order_sequences (
+    sequence_key VARCHAR(20) PRIMARY KEY,
+    last_value INT NOT NULL
+);
+
+-- 12. 库存流水 spool 表：延迟批量写入（ledger.py）时每个 spool 已写入数据库的最大序号，
+-- 与批量写入的流水在同一事务中更新，进程重启重放 spool 时据此跳过已写入的条目；
+-- ledger_commits 为请求事务中登记的 spool 条目，已提交的才写入，写入时删除
+CREATE TABLE ledger_spools (
+    spool_key VARCHAR(255) PRIMARY KEY,
+    flushed_seq BIGINT NOT NULL
+);
+
+CREATE TABLE ledger_commits (
+    spool_key VARCHAR(255) NOT NULL,
+    seq BIGINT NOT NULL,
+    PRIMARY KEY (spool_key, seq)
+);
+
+-- 13. 幂等键表：Idempotency-Key 请求的结果（idempotency.py），多进程部署时共享；
+-- status_code 为 NULL 表示第一次请求仍在处理，expires_at 为过期时间（Unix 秒）
+CREATE TABLE idempotency_keys (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    fingerprint CHAR(40) NOT NULL,
+    status_code INT,
+    response_body MEDIUMTEXT,
+    expires_at BIGINT NOT NULL,
+    INDEX idx_idempotency_expires (expires_at)
+);
+
+-- 14. 热门产品库存预留表（hot_stock.py）：合并扣减时写入的出库流水，订单提交时认领（删除），
+-- reserved_at 为登记时间（Unix 秒），超时仍未认领的由后台线程退回库存
+CREATE TABLE stock_reservations (
+    transaction_id INT PRIMARY KEY,
+    product_id INT NOT NULL,
+    quantity INT NOT NULL,
+    reserved_at BIGINT NOT NULL,
+    INDEX idx_reservations_reserved (reserved_at),
+    FOREIGN KEY (transaction_id) REFERENCES inventory_transactions(transaction_id) ON DELETE CASCADE
+);
+
 
 -- 插入示例数据
 -- 插入产品类别
@@ -197,7 +246,30 @@ CREATE INDEX idx_sales_customer ON sales_orders(customer_id);
 CREATE INDEX idx_sales_status ON sales_orders(status);
 CREATE INDEX idx_transactions_product ON inventory_transactions(product_id);
 CREATE INDEX idx_transactions_date ON inventory_transactions(transaction_date);
+-- 列表游标分页（sort=updated_at / order_date）使用的 (排序列, 主键) 索引
+CREATE INDEX idx_products_updated ON products(updated_at, product_id);
+CREATE INDEX idx_purchase_date ON purchase_orders(order_date, order_id);
+CREATE INDEX idx_purchase_updated ON purchase_orders(updated_at, order_id);
+CREATE INDEX idx_sales_date ON sales_orders(order_date, order_id);
+CREATE INDEX idx_sales_updated ON sales_orders(updated_at, order_id);
+
+-- 全文索引：ngram 分词（ngram_token_size 默认 2，支持中文名称），用于 search 参数
+CREATE FULLTEXT INDEX ft_customers_search ON customers(customer_name, customer_code, contact_person) WITH PARSER ngram;
+CREATE FULLTEXT INDEX ft_suppliers_search ON suppliers(supplier_name, supplier_code, contact_person) WITH PARSER ngram;
+CREATE FULLTEXT INDEX ft_purchase_orders_search ON purchase_orders(order_number) WITH PARSER ngram;
+CREATE FULLTEXT INDEX ft_sales_orders_search ON sales_orders(order_number) WITH PARSER ngram;
+
+
+-- 行版本触发器：任何修改都把 version 加 1（语句自己修改了 version 时不动），
+-- 所有改库存的路径（包括下面的采购触发器）都会让 If-Match 条件更新失败
+CREATE TRIGGER products_bump_version BEFORE UPDATE ON products
+FOR EACH ROW SET NEW.version = IF(NEW.version = OLD.version, OLD.version + 1, NEW.version);
 
+CREATE TRIGGER purchase_orders_bump_version BEFORE UPDATE ON purchase_orders
+FOR EACH ROW SET NEW.version = IF(NEW.version = OLD.version, OLD.version + 1, NEW.version);
+
+CREATE TRIGGER sales_orders_bump_version BEFORE UPDATE ON sales_orders
+FOR EACH ROW SET NEW.version = IF(NEW.version = OLD.version, OLD.version + 1, NEW.version);
 
 -- 创建触发器：自动更新库存
 
@@ -235,48 +307,74 @@ BEGIN
     WHERE p.product_id = NEW.product_id;
 END//
 
--- 触发器：销售订单明细插入时更新库存
-CREATE TRIGGER after_sale_detail_insert
-AFTER INSERT ON sales_order_details
+DELIMITER ;
+
+-- 销售出库不用触发器：创建销售订单时由应用按条件一次扣减整单库存并批量写流水
+-- （Repository.place_sales_order），库存不足时整单回滚。旧库升级时删除原来的触发器，
+-- 否则同一张订单会被扣减两次
+DROP TRIGGER IF EXISTS after_sale_detail_insert;
+
+
+-- 库存预警表：只存处于预警状态的产品，由 products 上的触发器在库存或上下限变化时维护，
+-- 所有改库存的路径（调整、销售、取消、采购触发器、修改产品）都经过这里
+
+
+CREATE TABLE stock_alerts (
+    product_id INT PRIMARY KEY,
+    alert_type ENUM('库存不足', '库存过剩') NOT NULL,
+    alert_value INT NOT NULL,
+    severity INT NOT NULL,  -- ABS(current_stock - min_stock_level)，预警列表的排序键
+    INDEX idx_stock_alerts_order (alert_type, severity DESC),
+    FOREIGN KEY (product_id) REFERENCES products(product_id) ON DELETE CASCADE
+);
+
+
+DELIMITER //
+
+CREATE TRIGGER stock_alerts_product_insert
+AFTER INSERT ON products
 FOR EACH ROW
 BEGIN
-    -- 检查库存是否充足
-    DECLARE current_stock INT;
-    SELECT current_stock INTO current_stock FROM products WHERE product_id = NEW.product_id;
-    
-    IF current_stock >= NEW.quantity THEN
-        -- 更新产品库存
-        UPDATE products 
-        SET current_stock = current_stock - NEW.quantity,
-            updated_at = CURRENT_TIMESTAMP
-        WHERE product_id = NEW.product_id;
-        
-        -- 记录库存变动
-        INSERT INTO inventory_transactions (
-            product_id, transaction_type, reference_id, reference_type,
-            quantity_change, quantity_before, quantity_after, notes, created_by
-        )
-        SELECT 
-            NEW.product_id,
-            '销售出库',
-            NEW.order_id,
-            '销售订单',
-            -NEW.quantity,
-            p.current_stock,
-            p.current_stock - NEW.quantity,
-            CONCAT('销售订单: ', so.order_number),
-            so.created_by
-        FROM products p
-        JOIN sales_orders so ON so.order_id = NEW.order_id
-        WHERE p.product_id = NEW.product_id;
-    ELSE
-        SIGNAL SQLSTATE '45000' 
-        SET MESSAGE_TEXT = '库存不足，无法完成销售';
+    INSERT INTO stock_alerts (product_id, alert_type, alert_value, severity)
+    SELECT NEW.product_id,
+           CASE WHEN NEW.current_stock < NEW.min_stock_level THEN '库存不足' ELSE '库存过剩' END,
+           CASE WHEN NEW.current_stock < NEW.min_stock_level THEN NEW.min_stock_level - NEW.current_stock
+                ELSE NEW.current_stock - NEW.max_stock_level END,
+           ABS(NEW.current_stock - NEW.min_stock_level)
+    FROM DUAL
+    WHERE NEW.current_stock < NEW.min_stock_level OR NEW.current_stock > NEW.max_stock_level;
+END//
+
+-- 变化前后都不在预警状态的产品（绝大多数）不做任何事
+CREATE TRIGGER stock_alerts_product_update
+AFTER UPDATE ON products
+FOR EACH ROW
+BEGIN
+    IF OLD.current_stock < OLD.min_stock_level OR OLD.current_stock > OLD.max_stock_level
+       OR NEW.current_stock < NEW.min_stock_level OR NEW.current_stock > NEW.max_stock_level THEN
+        DELETE FROM stock_alerts WHERE product_id = OLD.product_id;
+        INSERT INTO stock_alerts (product_id, alert_type, alert_value, severity)
+        SELECT NEW.product_id,
+               CASE WHEN NEW.current_stock < NEW.min_stock_level THEN '库存不足' ELSE '库存过剩' END,
+               CASE WHEN NEW.current_stock < NEW.min_stock_level THEN NEW.min_stock_level - NEW.current_stock
+                    ELSE NEW.current_stock - NEW.max_stock_level END,
+               ABS(NEW.current_stock - NEW.min_stock_level)
+        FROM DUAL
+        WHERE NEW.current_stock < NEW.min_stock_level OR NEW.current_stock > NEW.max_stock_level;
     END IF;
 END//
 
 DELIMITER ;
 
+INSERT INTO stock_alerts (product_id, alert_type, alert_value, severity)
+SELECT product_id,
+       CASE WHEN current_stock < min_stock_level THEN '库存不足' ELSE '库存过剩' END,
+       CASE WHEN current_stock < min_stock_level THEN min_stock_level - current_stock
+            ELSE current_stock - max_stock_level END,
+       ABS(current_stock - min_stock_level)
+FROM products
+WHERE current_stock < min_stock_level OR current_stock > max_stock_level;
+
 
 -- 创建存储过程：获取库存预警
 
@@ -291,19 +389,11 @@ BEGIN
         p.current_stock,
         p.min_stock_level,
         p.max_stock_level,
-        CASE 
-            WHEN p.current_stock < p.min_stock_level THEN '库存不足'
-            WHEN p.current_stock > p.max_stock_level THEN '库存过剩'
-            ELSE '正常'
-        END as alert_type,
-        CASE 
-            WHEN p.current_stock < p.min_stock_level THEN p.min_stock_level - p.current_stock
-            WHEN p.current_stock > p.max_stock_level THEN p.current_stock - p.max_stock_level
-            ELSE 0
-        END as alert_value
-    FROM products p
-    WHERE p.current_stock < p.min_stock_level OR p.current_stock > p.max_stock_level
-    ORDER BY alert_type, ABS(p.current_stock - p.min_stock_level) DESC;
+        a.alert_type,
+        a.alert_value
+    FROM stock_alerts a
+    JOIN products p ON p.product_id = a.product_id
+    ORDER BY a.alert_type, a.severity DESC;
 END//
 
 DELIMITER ;
@@ -328,3 +418,131 @@ JOIN products p ON sod.product_id = p.product_id
 JOIN product_categories c ON p.category_id = c.category_id
 WHERE so.status = '已完成'
 GROUP BY DATE_FORMAT(so.order_date, '%Y-%m'), p.material_type, p.category_id; 
+
+
+-- 销售统计汇总表：订单进入'已完成'状态时由触发器累加，离开时扣回，统计接口只读这几张小表
+-- 历史数据或手工改过的数据用 flask --app app rebuild-sales-summary 重建
+
+
+CREATE TABLE sales_monthly_summary (
+    month CHAR(7) PRIMARY KEY,
+    order_count INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE sales_material_summary (
+    material_type VARCHAR(20) PRIMARY KEY,
+    order_count INT NOT NULL DEFAULT 0,
+    total_quantity INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE sales_customer_summary (
+    customer_id INT PRIMARY KEY,
+    order_count INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    INDEX idx_customer_summary_amount (total_amount)
+);
+
+
+DELIMITER //
+
+-- 存储过程：把一张订单计入（p_sign = 1）或扣出（p_sign = -1）销售汇总
+CREATE PROCEDURE ApplySalesSummary(IN p_order_id INT, IN p_order_date DATE, IN p_customer_id INT,
+                                   IN p_total_amount DECIMAL(12, 2), IN p_sign INT)
+BEGIN
+    INSERT INTO sales_monthly_summary (month, order_count, total_amount)
+    VALUES (DATE_FORMAT(p_order_date, '%Y-%m'), p_sign, p_sign * p_total_amount)
+    ON DUPLICATE KEY UPDATE order_count = order_count + VALUES(order_count),
+                            total_amount = total_amount + VALUES(total_amount);
+
+    IF p_customer_id IS NOT NULL THEN
+        INSERT INTO sales_customer_summary (customer_id, order_count, total_amount)
+        VALUES (p_customer_id, p_sign, p_sign * p_total_amount)
+        ON DUPLICATE KEY UPDATE order_count = order_count + VALUES(order_count),
+                                total_amount = total_amount + VALUES(total_amount);
+    END IF;
+
+    INSERT INTO sales_material_summary (material_type, order_count, total_quantity, total_amount)
+    SELECT p.material_type, p_sign, p_sign * SUM(sod.quantity), p_sign * SUM(sod.total_price)
+    FROM sales_order_details sod
+    JOIN products p ON p.product_id = sod.product_id
+    WHERE sod.order_id = p_order_id
+    GROUP BY p.material_type
+    ON DUPLICATE KEY UPDATE order_count = order_count + VALUES(order_count),
+                            total_quantity = total_quantity + VALUES(total_quantity),
+                            total_amount = total_amount + VALUES(total_amount);
+END//
+
+CREATE TRIGGER sales_summary_order_insert
+AFTER INSERT ON sales_orders
+FOR EACH ROW
+BEGIN
+    IF NEW.status = '已完成' THEN
+        CALL ApplySalesSummary(NEW.order_id, NEW.order_date, NEW.customer_id, NEW.total_amount, 1);
+    END IF;
+END//
+
+-- 状态、日期、客户或金额变化时先扣回旧值再累加新值
+CREATE TRIGGER sales_summary_order_update
+AFTER UPDATE ON sales_orders
+FOR EACH ROW
+BEGIN
+    IF (OLD.status = '已完成' OR NEW.status = '已完成')
+       AND NOT (OLD.status <=> NEW.status AND OLD.order_date <=> NEW.order_date
+                AND OLD.customer_id <=> NEW.customer_id AND OLD.total_amount <=> NEW.total_amount) THEN
+        IF OLD.status = '已完成' THEN
+            CALL ApplySalesSummary(OLD.order_id, OLD.order_date, OLD.customer_id, OLD.total_amount, -1);
+        END IF;
+        IF NEW.status = '已完成' THEN
+            CALL ApplySalesSummary(NEW.order_id, NEW.order_date, NEW.customer_id, NEW.total_amount, 1);
+        END IF;
+    END IF;
+END//
+
+-- BEFORE：明细随订单级联删除前扣回
+CREATE TRIGGER sales_summary_order_delete
+BEFORE DELETE ON sales_orders
+FOR EACH ROW
+BEGIN
+    IF OLD.status = '已完成' THEN
+        CALL ApplySalesSummary(OLD.order_id, OLD.order_date, OLD.customer_id, OLD.total_amount, -1);
+    END IF;
+END//
+
+-- 已完成订单增删明细时调整材料类别汇总；订单数只在该类别第一条/最后一条明细变化时增减
+CREATE TRIGGER sales_summary_detail_insert
+AFTER INSERT ON sales_order_details
+FOR EACH ROW
+BEGIN
+    IF (SELECT status FROM sales_orders WHERE order_id = NEW.order_id) = '已完成' THEN
+        INSERT INTO sales_material_summary (material_type, order_count, total_quantity, total_amount)
+        SELECT p.material_type,
+               NOT EXISTS (SELECT 1 FROM sales_order_details d JOIN products dp ON dp.product_id = d.product_id
+                           WHERE d.order_id = NEW.order_id AND d.detail_id <> NEW.detail_id
+                             AND dp.material_type = p.material_type),
+               NEW.quantity, NEW.total_price
+        FROM products p
+        WHERE p.product_id = NEW.product_id
+        ON DUPLICATE KEY UPDATE order_count = order_count + VALUES(order_count),
+                                total_quantity = total_quantity + VALUES(total_quantity),
+                                total_amount = total_amount + VALUES(total_amount);
+    END IF;
+END//
+
+CREATE TRIGGER sales_summary_detail_delete
+AFTER DELETE ON sales_order_details
+FOR EACH ROW
+BEGIN
+    IF (SELECT status FROM sales_orders WHERE order_id = OLD.order_id) = '已完成' THEN
+        UPDATE sales_material_summary s
+        SET s.order_count = s.order_count - NOT EXISTS (
+                SELECT 1 FROM sales_order_details d JOIN products dp ON dp.product_id = d.product_id
+                WHERE d.order_id = OLD.order_id AND dp.material_type = s.material_type),
+            s.total_quantity = s.total_quantity - OLD.quantity,
+            s.total_amount = s.total_amount - OLD.total_price
+        WHERE s.material_type = (SELECT material_type FROM products WHERE product_id = OLD.product_id);
+    END IF;
+END//
+
+DELIMITER ;